@@ -0,0 +1,82 @@
+#Builds the camera frames the benchmarks run on out of the tags in artags/, so the suite doesn't need a camera.
+#PNGs are written with zlib directly, no image library needed.
+#Run with: python3 benchmarks/fixtures.py
+import os
+import re
+import struct
+import zlib
+
+import numpy as np
+
+path = os.path.dirname(os.path.abspath(__file__))
+tagsPath = os.path.join(path, '../artags')
+framesPath = os.path.join(path, 'data/frames')
+
+FRAME_WIDTH = 1280
+FRAME_HEIGHT = 720
+
+#Reads one of the artags SVGs into a grid of 0 (black) and 255 (white) cells
+def readTag(markerID):
+    with open(os.path.join(tagsPath, f'4x4_1000-{markerID}.svg')) as f:
+        svg = f.read()
+    size = int(re.search(r'viewBox="0 0 (\d+) (\d+)"', svg).group(1))
+    grid = np.zeros((size, size), np.uint8)
+    for rect in re.finditer(r'<rect([^>]*)>', svg):
+        attributes = dict(re.findall(r'(\w+)="([^"]*)"', rect.group(1)))
+        x, y = int(attributes.get('x', 0)), int(attributes.get('y', 0))
+        w, h = int(attributes['width']), int(attributes['height'])
+        grid[y:y + h, x:x + w] = 255 if attributes['fill'] == 'white' else 0
+    return grid
+
+#Draws a tag size pixels wide (not counting its white border) centered at (x, y)
+def drawTag(frame, markerID, size, x, y):
+    grid = readTag(markerID)
+    #white border a cell wide all the way around, like the printed tags
+    grid = np.pad(grid, 1, constant_values=255)
+    cells = grid.shape[0]
+    total = size * cells // (cells - 2)
+    index = np.arange(total) * cells // total
+    tag = grid[index][:, index]
+    top = y - total // 2
+    left = x - total // 2
+    frame[top:top + total, left:left + total] = tag
+
+#A plain background that gets darker towards the bottom like the ground does
+def background():
+    rows = np.linspace(170, 90, FRAME_HEIGHT).astype(np.uint8)
+    return np.repeat(rows[:, None], FRAME_WIDTH, axis=1)
+
+#Writes an 8 bit grayscale PNG
+def writePNG(fileName, image):
+    height, width = image.shape
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    #every row starts with filter type 0 (none)
+    raw = b''.join(b'\x00' + image[row].tobytes() for row in range(height))
+    with open(fileName, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw, 9)))
+        f.write(chunk(b'IEND', b''))
+
+#name: list of (id, size in pixels, x, y)
+FRAMES = {
+    'near': [(1, 200, 760, 360)],
+    'far': [(1, 24, 400, 300)],
+    'gate': [(1, 90, 440, 380), (2, 90, 860, 370)],
+    'empty': [],
+}
+
+def build():
+    os.makedirs(framesPath, exist_ok=True)
+    for name, tags in FRAMES.items():
+        frame = background()
+        for markerID, size, x, y in tags:
+            drawTag(frame, markerID, size, x, y)
+        writePNG(os.path.join(framesPath, name + '.png'), frame)
+        print('Wrote', os.path.join(framesPath, name + '.png'))
+
+if __name__ == '__main__':
+    build()
@@ -0,0 +1,30 @@
+#Measures how fast LocationF9P's NMEA parser gets through a recorded log
+#Run with: python3 benchmarks/nmea.py [path/to/log.nmea] [chunk size]
+import os
+import sys
+from time import perf_counter
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+
+from libs.NMEA import NMEAParser
+
+def benchmark(data, chunkSize=1024, repeats=20):
+    best = float('inf')
+    for _ in range(repeats):
+        parser = NMEAParser()
+        start = perf_counter()
+        #feeds the log in chunks like the serial port would hand it over
+        for i in range(0, len(data), chunkSize):
+            parser.feed(data[i:i + chunkSize])
+        best = min(best, perf_counter() - start)
+    return parser, best
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.abspath(__file__)) + '/data/f9p.nmea'
+    chunkSize = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    parser, seconds = benchmark(data, chunkSize)
+    print(f'{len(data)} bytes, {parser.sentences} sentences in {seconds * 1000:.2f} ms')
+    print(f'{parser.sentences / seconds:,.0f} sentences/s, {len(data) / seconds / 1e6:.2f} MB/s')
+    print(f'bad checksums: {parser.bad_checksums}, unknown: {parser.unknown}, malformed: {parser.malformed}')
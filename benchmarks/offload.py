@@ -0,0 +1,90 @@
+#Measures whether sending frames to a detection server beats looking for tags on the rover.
+#For each fixture frame it times the local path (decode the MJPG and run markersFound, what the rover does
+#with [OFFLOAD] off) against the offload path (send the JPEG and wait for the detections to come back).
+#
+#Run with:   python3 benchmarks/offload.py                      starts a stand in server on this machine
+#            python3 benchmarks/offload.py --host 10.0.0.2      uses detectionServer.py running somewhere else
+#Offloading pays off when the round trip is shorter than the local time, or when it's close and the
+#rover's CPU is needed for something else. The local server only shows the overhead of the protocol,
+#point it at the base station over the real radio link to see the real thing.
+import argparse
+import os
+import sys
+from threading import Thread
+from time import monotonic, perf_counter, sleep
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+
+import cv2
+import numpy as np
+
+from libs import Offload
+from libs.ARTracker import ARTracker
+
+path = os.path.dirname(os.path.abspath(__file__))
+configPath = os.path.join(path, '../config.ini')
+
+def percentiles(times):
+    times = sorted(times)
+    return [times[min(len(times) - 1, int(f * len(times)))] * 1000 for f in (.5, .9, .99)]
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser(description='Compares local tag detection against the detection server')
+    argParser.add_argument('--host', default=None, help='detection server to use, starts one here if not given')
+    argParser.add_argument('--port', type=int, default=0, help="detection server's port")
+    argParser.add_argument('--frames', type=int, default=50, help='times each fixture frame is sent')
+    argParser.add_argument('--quality', type=int, default=90, help='JPEG quality, cameras send around 90')
+    args = argParser.parse_args()
+
+    tracker = ARTracker([], configFile=configPath)
+    if args.host is None:
+        server = Offload.DetectionServer(ARTracker([], configFile=configPath), '127.0.0.1', args.port)
+        t = Thread(target=server.serve_forever, name='detection server', args=())
+        t.daemon = True
+        t.start()
+        host, port = '127.0.0.1', server.port
+    else:
+        host, port = args.host, args.port
+
+    client = Offload.OffloadClient(host, port)
+    client.start()
+    start = monotonic()
+    while not client.is_connected:
+        if monotonic() - start > 5:
+            print(f"Couldn't connect to the detection server at {host}:{port}")
+            exit(1)
+        sleep(.05)
+
+    print(f"{'frame':<8} {'KB':>6} {'local p50 ms':>13} {'p90':>7} {'offload p50 ms':>15} {'p90':>7} {'p99':>7} {'same tags':>10}")
+    seq = 0
+    for name in ('near', 'far', 'gate', 'empty'):
+        frame = cv2.imread(os.path.join(path, 'data/frames', name + '.png'))
+        if frame is None:
+            print(f'Missing fixture frame {name}.png, run benchmarks/fixtures.py')
+            exit(-1)
+        #what the camera would hand over with CAP_PROP_CONVERT_RGB off
+        jpeg = np.frombuffer(Offload.encode(frame, args.quality), np.uint8)
+
+        local = []
+        for _ in range(args.frames):
+            begin = perf_counter()
+            localTags = tracker.markersFound(Offload.decode(jpeg))
+            local.append(perf_counter() - begin)
+
+        remote = []
+        matches = 0
+        for _ in range(args.frames):
+            seq += 1
+            timestamp = monotonic()
+            client.submit(0, seq, timestamp, jpeg)
+            results = client.wait_result(0, seq, 2.0)
+            if results is None:
+                print('Timed out waiting on frame', seq)
+                continue
+            remote.append(monotonic() - timestamp)
+            matches += sorted(r['id'] for r in results) == sorted(localTags)
+
+        if not remote:
+            continue
+        print(f"{name:<8} {len(jpeg) / 1024:6.0f} " + ' '.join(f'{v:{w}.1f}' for v, w in zip(percentiles(local)[:2], (13, 7))) +
+              ' ' + ' '.join(f'{v:{w}.1f}' for v, w in zip(percentiles(remote), (15, 7, 7))) + f" {matches}/{len(remote):>6}")
+    client.stop()
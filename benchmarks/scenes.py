@@ -0,0 +1,257 @@
+#Renders frames of tags at known distances and angles, with a ground truth file, for testing detection.
+#Tags are placed the way the rover's camera model in config.ini sees them: DEGREES_PER_PIXEL and
+#VDEGREES_PER_PIXEL put the tag's center in the frame and the FOCAL_LENGTH model sets its size.
+#
+#Run with:   python3 benchmarks/scenes.py render out/ --count 1000 --distance 100 2000 --blur 0 2
+#            python3 benchmarks/scenes.py render out.avi --count 300        writes a video instead of PNGs
+#            python3 benchmarks/scenes.py evaluate out/                     runs markerFound on them and scores it
+#Every frame is built from --seed and its own number, so the same arguments always give the same frames.
+#The ground truth goes in truth.jsonl next to the frames (or <video>.jsonl), one line per frame.
+import argparse
+import configparser
+import json
+import os
+import sys
+from math import radians, sin, cos
+from multiprocessing import Pool, cpu_count
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+
+import cv2
+import numpy as np
+
+from benchmarks.fixtures import readTag
+
+path = os.path.dirname(os.path.abspath(__file__))
+configPath = os.path.join(path, '../config.ini')
+
+FRAME_WIDTH = 1280
+FRAME_HEIGHT = 720
+
+#The parts of [ARTRACKER] the camera model needs
+def cameraModel(config):
+    section = config['ARTRACKER']
+    return {
+        'dpp': float(section['DEGREES_PER_PIXEL']),
+        'vdpp': float(section['VDEGREES_PER_PIXEL']),
+        'f0': float(section['FOCAL_LENGTH']),
+        'f30H': float(section['FOCAL_LENGTH30H']),
+        'f30V': float(section['FOCAL_LENGTH30V']),
+        'tagWidth': float(section['KNOWN_TAG_WIDTH']),
+    }
+
+#Picks one frame's scene out of the ranges given on the command line
+def sampleScene(args, index):
+    rng = np.random.default_rng([args.seed, index])
+    def pick(bounds):
+        return float(rng.uniform(bounds[0], bounds[1])) if len(bounds) == 2 else float(bounds[0])
+    return {
+        'frame': index,
+        'id': int(rng.choice(args.ids)),
+        'distance': pick(args.distance),
+        'bearing': pick(args.bearing),
+        'elevation': pick(args.elevation),
+        'tilt': pick(args.tilt),
+        'blur': pick(args.blur),
+        'noise': pick(args.noise),
+        'lighting': pick(args.lighting),
+        'seed': [args.seed, index],
+    }
+
+#Ground and sky with some lumpy texture so detection has more than a flat background to deal with
+def background(rng):
+    horizon = int(FRAME_HEIGHT * rng.uniform(.3, .45))
+    image = np.empty((FRAME_HEIGHT, FRAME_WIDTH), np.float32)
+    image[:horizon] = np.linspace(200, 170, horizon)[:, None]
+    image[horizon:] = np.linspace(150, 95, FRAME_HEIGHT - horizon)[:, None]
+    texture = rng.normal(0, 1, (FRAME_HEIGHT // 16 + 1, FRAME_WIDTH // 16 + 1)).astype(np.float32)
+    texture = cv2.resize(texture, (FRAME_WIDTH, FRAME_HEIGHT), interpolation=cv2.INTER_CUBIC)
+    image[horizon:] += 18 * texture[horizon:]
+    return image
+
+#Where the tag's corners land in the frame: the center from the angles and degrees per pixel,
+#the size from ARTracker's focal length model, and tilt (turning the tag about its vertical axis)
+#squeezing it and making the far edge shorter
+def projectCorners(scene, model):
+    centerX = FRAME_WIDTH / 2 + scene['bearing'] / model['dpp']
+    centerY = FRAME_HEIGHT / 2 + scene['elevation'] / model['vdpp']
+    focalLength = model['f0'] + (abs(scene['bearing']) / 30) * (model['f30H'] - model['f0']) + \
+        (abs(scene['elevation']) / 30) * (model['f30V'] - model['f0'])
+    half = model['tagWidth'] / 2
+    tilt = radians(scene['tilt'])
+    corners = []
+    #top left, top right, bottom right, bottom left like aruco
+    for x, y in ((-half, -half), (half, -half), (half, half), (-half, half)):
+        depth = scene['distance'] + x * sin(tilt)
+        corners.append((centerX + focalLength * x * cos(tilt) / depth, centerY + focalLength * y / depth))
+    return np.array(corners, np.float32)
+
+#id: tag grid with its white border, so each process only reads each SVG once
+tags = {}
+
+def renderScene(scene, model):
+    rng = np.random.default_rng(scene['seed'])
+    image = background(rng)
+
+    corners = projectCorners(scene, model)
+    #the tag with a white border a cell wide, drawn at about twice the size it ends up so warping it
+    #down doesn't alias
+    if scene['id'] not in tags:
+        tags[scene['id']] = np.pad(readTag(scene['id']), 1, constant_values=255)
+    grid = tags[scene['id']]
+    size = np.abs(corners[1] - corners[0]).max()
+    cellSize = max(2, int(np.ceil(2 * size / grid.shape[0])))
+    tag = np.kron(grid, np.ones((cellSize, cellSize), np.uint8)).astype(np.float32)
+    inner = grid.shape[0] - 2
+    #the tag's own corners (inside the border) inside the padded image
+    source = np.array([[cellSize, cellSize], [cellSize * (inner + 1), cellSize],
+        [cellSize * (inner + 1), cellSize * (inner + 1)], [cellSize, cellSize * (inner + 1)]], np.float32)
+    transform = cv2.getPerspectiveTransform(source, corners)
+    warped = cv2.warpPerspective(tag, transform, (FRAME_WIDTH, FRAME_HEIGHT), flags=cv2.INTER_LINEAR)
+    mask = cv2.warpPerspective(np.ones_like(tag), transform, (FRAME_WIDTH, FRAME_HEIGHT), flags=cv2.INTER_LINEAR)
+    #the printed tag isn't pure black and white under sunlight
+    image = image * (1 - mask) + (20 + warped * (215 / 255)) * mask
+
+    #lighting scales everything, past 1 starts clipping like an overexposed camera
+    image *= scene['lighting']
+    if scene['blur'] > 0:
+        image = cv2.GaussianBlur(image, (0, 0), scene['blur'])
+    if scene['noise'] > 0:
+        image += rng.normal(0, scene['noise'], image.shape).astype(np.float32)
+    frame = np.clip(image, 0, 255).astype(np.uint8)
+
+    truth = dict(scene)
+    truth['corners'] = corners.round(2).tolist()
+    truth['width'] = float(((corners[1][0] - corners[0][0]) + (corners[2][0] - corners[3][0])) / 2)
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR), truth
+
+#Renders one frame and writes it as a PNG, runs in a worker process
+def renderToFile(job):
+    scene, model, folder = job
+    frame, truth = renderScene(scene, model)
+    truth['file'] = f"{scene['frame']:06d}.png"
+    cv2.imwrite(os.path.join(folder, truth['file']), frame)
+    return truth
+
+#Renders one frame and hands it back for the video writer, runs in a worker process
+def renderToMemory(job):
+    scene, model = job
+    return renderScene(scene, model)
+
+def render(args, model):
+    scenes = [sampleScene(args, i) for i in range(args.count)]
+    video = args.output.lower().endswith(('.avi', '.mp4', '.mkv'))
+    with Pool(args.processes) as pool:
+        if video:
+            truthPath = os.path.splitext(args.output)[0] + '.jsonl'
+            writer = cv2.VideoWriter(args.output, cv2.VideoWriter_fourcc(*'MJPG'), 10, (FRAME_WIDTH, FRAME_HEIGHT))
+            truths = []
+            #imap keeps the frames in order for the video while they still render in parallel
+            for frame, truth in pool.imap(renderToMemory, [(scene, model) for scene in scenes], chunksize=4):
+                writer.write(frame)
+                truths.append(truth)
+            writer.release()
+        else:
+            os.makedirs(args.output, exist_ok=True)
+            truthPath = os.path.join(args.output, 'truth.jsonl')
+            truths = pool.map(renderToFile, [(scene, model, args.output) for scene in scenes], chunksize=4)
+    with open(truthPath, 'w') as f:
+        for truth in truths:
+            f.write(json.dumps(truth) + '\n')
+    print(f"Rendered {len(truths)} frames to {args.output}, ground truth in {truthPath}")
+
+tracker = None
+
+#Gives each worker process its own tracker, without any cameras
+def startTracker(configFile):
+    global tracker
+    from libs.ARTracker import ARTracker
+    #markerFound prints on every frame
+    sys.stdout = open(os.devnull, 'w')
+    tracker = ARTracker([], configFile=configFile)
+
+#Runs markerFound on one frame and compares it to the truth, runs in a worker process
+def evaluateFrame(job):
+    truth, frame = job
+    if isinstance(frame, str):
+        frame = cv2.imread(frame)
+    found = tracker.markerFound(truth['id'], frame)
+    return {
+        'distance': truth['distance'],
+        'found': found,
+        'distanceError': tracker.distanceToMarker - truth['distance'] if found else None,
+        'angleError': tracker.angleToMarker - truth['bearing'] if found else None,
+    }
+
+def evaluate(args):
+    video = args.output.lower().endswith(('.avi', '.mp4', '.mkv'))
+    truthPath = os.path.splitext(args.output)[0] + '.jsonl' if video else os.path.join(args.output, 'truth.jsonl')
+    with open(truthPath) as f:
+        truths = [json.loads(line) for line in f]
+    if video:
+        cap = cv2.VideoCapture(args.output)
+        jobs = [(truth, cap.read()[1]) for truth in truths]
+    else:
+        jobs = [(truth, os.path.join(args.output, truth['file'])) for truth in truths]
+
+    with Pool(args.processes, initializer=startTracker, initargs=(args.config,)) as pool:
+        results = pool.map(evaluateFrame, jobs, chunksize=4)
+
+    #scores by distance so it's clear where detection falls off
+    edges = np.unique(np.linspace(min(r['distance'] for r in results), max(r['distance'] for r in results) + 1, 6).round())
+    print(f"{'distance cm':>15} {'frames':>7} {'found':>7} {'dist err %':>11} {'angle err':>10}")
+    for low, high in zip(edges[:-1], edges[1:]):
+        inBin = [r for r in results if low <= r['distance'] < high]
+        if not inBin:
+            continue
+        found = [r for r in inBin if r['found']]
+        line = f"{f'{low:.0f}-{high:.0f}':>15} {len(inBin):7d} {100 * len(found) / len(inBin):6.1f}%"
+        if found:
+            distanceError = np.median([abs(r['distanceError']) / r['distance'] for r in found]) * 100
+            angleError = np.median([abs(r['angleError']) for r in found])
+            line += f" {distanceError:11.1f} {angleError:10.2f}"
+        print(line)
+    total = sum(r['found'] for r in results)
+    print(f"Found {total} of {len(results)} ({100 * total / len(results):.1f}%)")
+
+def idList(text):
+    ids = []
+    for part in text.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            ids.extend(range(int(first), int(last) + 1))
+        else:
+            ids.append(int(part))
+    return ids
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser(description="Renders tags at known spots for testing detection")
+    argParser.add_argument("--config", default=configPath, help="config file with the camera model")
+    argParser.add_argument("--processes", type=int, default=cpu_count(), help="processes to work in")
+    commands = argParser.add_subparsers(dest="command", required=True)
+
+    renderParser = commands.add_parser("render", help="renders frames and their ground truth")
+    renderParser.add_argument("output", help="folder for PNGs, or a .avi file for a video")
+    renderParser.add_argument("--count", type=int, default=100, help="frames to render")
+    renderParser.add_argument("--seed", type=int, default=0, help="same seed, same frames")
+    renderParser.add_argument("--ids", type=idList, default=list(range(6)), help="tag ids to use, like 0-5 or 1,4")
+    #each of these takes one value, or a low and high to pick from
+    renderParser.add_argument("--distance", type=float, nargs='+', default=[100, 1500], help="cm")
+    renderParser.add_argument("--bearing", type=float, nargs='+', default=[-40, 40], help="degrees, positive is right")
+    renderParser.add_argument("--elevation", type=float, nargs='+', default=[-5, 10], help="degrees, positive is down")
+    renderParser.add_argument("--tilt", type=float, nargs='+', default=[-45, 45], help="degrees the tag is turned")
+    renderParser.add_argument("--blur", type=float, nargs='+', default=[0, 1.5], help="gaussian blur sigma in pixels")
+    renderParser.add_argument("--noise", type=float, nargs='+', default=[0, 6], help="gaussian noise std dev")
+    renderParser.add_argument("--lighting", type=float, nargs='+', default=[.5, 1.3], help="brightness multiplier")
+
+    evaluateParser = commands.add_parser("evaluate", help="runs markerFound on rendered frames and scores it")
+    evaluateParser.add_argument("output", help="folder or video made by render")
+    args = argParser.parse_args()
+
+    if args.command == "render":
+        config = configparser.ConfigParser(allow_no_value=True)
+        if not config.read(args.config):
+            print("DID NOT OPEN CONFIG")
+            exit(-2)
+        render(args, cameraModel(config))
+    else:
+        evaluate(args)
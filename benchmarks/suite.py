@@ -0,0 +1,241 @@
+#Benchmarks the rover's hot paths and checks them against stored baselines.
+#Runs without cameras, GPS or network: frames come from benchmarks/data/frames (see fixtures.py),
+#GPS data from benchmarks/data/f9p.nmea and wheel speeds go to a UDP socket on localhost.
+#
+#Run with:   python3 benchmarks/suite.py                 runs everything and compares against baselines.json
+#            python3 benchmarks/suite.py --save          stores this run as the new baselines
+#            python3 benchmarks/suite.py -k marker       only runs benchmarks with "marker" in the name
+#A benchmark regresses when its median gets slower than the baseline by more than its tolerance.
+#Tolerances can be set per benchmark in baselines.json, otherwise --tolerance is used.
+#Exits with 1 if anything regressed.
+import argparse
+import json
+import os
+import platform
+import socket
+import sys
+from threading import Thread
+from time import perf_counter_ns
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+
+import cv2
+
+from libs import UDPOut
+from libs.ARTracker import ARTracker
+from libs.Drive import Drive
+from libs.Locationf9p import LocationF9P
+from libs.NMEA import NMEAParser
+
+path = os.path.dirname(os.path.abspath(__file__))
+configPath = os.path.join(path, '../config.ini')
+baselinesPath = os.path.join(path, 'baselines.json')
+
+#a couple hundred meters from where the fixture log drives, so distances and bearings aren't trivial
+TARGET = (38.4390, -110.8110)
+
+#Times func() over and over, returns every call's time in nanoseconds
+def timeCalls(func, iterations, warmup):
+    for _ in range(warmup):
+        func()
+    times = []
+    for _ in range(iterations):
+        start = perf_counter_ns()
+        func()
+        times.append(perf_counter_ns() - start)
+    return times
+
+def percentile(sortedTimes, fraction):
+    return sortedTimes[min(len(sortedTimes) - 1, int(fraction * len(sortedTimes)))]
+
+def summarize(times, itemsPerCall=1):
+    times = sorted(times)
+    total = sum(times)
+    return {
+        'calls': len(times),
+        'p50_us': percentile(times, .5) / 1000,
+        'p90_us': percentile(times, .9) / 1000,
+        'p99_us': percentile(times, .99) / 1000,
+        'max_us': times[-1] / 1000,
+        'per_second': len(times) * itemsPerCall / (total / 1e9) if total else 0.0,
+    }
+
+#Counts whatever gets sent to it on its own thread, stands in for the mbeds
+class UDPSink:
+    def __init__(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.port = self.socket.getsockname()[1]
+        self.received = 0
+        t = Thread(target=self.receive, name='udp sink', args=())
+        t.daemon = True
+        t.start()
+
+    def receive(self):
+        while True:
+            self.socket.recv(64)
+            self.received += 1
+
+#Everything the benchmarks share, set up once
+class Bench:
+    def __init__(self):
+        self.frames = {}
+        for name in ('near', 'far', 'gate', 'empty'):
+            self.frames[name] = cv2.imread(os.path.join(path, 'data/frames', name + '.png'))
+            if self.frames[name] is None:
+                print(f'Missing fixture frame {name}.png, run benchmarks/fixtures.py')
+                exit(-1)
+        with open(os.path.join(path, 'data/f9p.nmea'), 'rb') as f:
+            self.nmea = f.read()
+        #one epoch's worth of sentences at a time, like the receiver sends them
+        lines = self.nmea.splitlines(keepends=True)
+        self.epochs = []
+        epoch = b''
+        for line in lines:
+            if line.startswith(b'$GNRMC') or line.startswith(b'$GPRMC'):
+                if epoch:
+                    self.epochs.append(epoch)
+                epoch = b''
+            epoch += line
+        if epoch:
+            self.epochs.append(epoch)
+
+        #no cameras, markerFound gets handed the fixture frames directly
+        self.tracker = ARTracker([], configFile=configPath)
+        #getSpeeds only needs the error accumulation, the rest of Drive needs hardware
+        self.drive = Drive.__new__(Drive)
+        self.drive.errorAccumulation = 0.0
+        self.drive.baseSpeed = 50
+
+        #the swift GPS library isn't around on a plain box, the F9P class does the same math
+        self.gps = LocationF9P(protocol='nmea')
+        for message in NMEAParser().feed(self.nmea):
+            self.gps.handle_message(message)
+        self.gps.start_mission([list(TARGET)])
+        self.sink = UDPSink()
+
+    def markerFound(self, name, ids):
+        frame = self.frames[name]
+        id1, id2 = ids
+        return lambda: self.tracker.markerFound(id1, frame.copy(), id2)
+
+    def getSpeeds(self):
+        error = [-40.0, -5.0, 0.0, 3.0, 25.0]
+        state = {'i': 0}
+        def call():
+            state['i'] += 1
+            self.drive.getSpeeds(self.drive.baseSpeed, error[state['i'] % 5], 100)
+        return call
+
+    def nmeaParse(self):
+        def call():
+            parser = NMEAParser()
+            for i in range(0, len(self.nmea), 1024):
+                parser.feed(self.nmea[i:i + 1024])
+        return call
+
+    def sendWheelSpeeds(self):
+        return lambda: UDPOut.sendWheelSpeeds('127.0.0.1', self.sink.port, 50, 50, 50, 40, 40, 40)
+
+    #One pass of the driving loop: a GPS epoch comes in, the rover works out where to steer,
+    #looks at a frame for the tag and sends the wheel speeds
+    def controlTick(self):
+        parser = NMEAParser()
+        frame = self.frames['far']
+        state = {'i': 0}
+        def call():
+            epoch = self.epochs[state['i'] % len(self.epochs)]
+            state['i'] += 1
+            for message in parser.feed(epoch):
+                self.gps.handle_message(message)
+            if self.gps.distance_to(*TARGET) > .0025:
+                speeds = self.drive.getSpeeds(self.drive.baseSpeed, self.gps.bearing_to(*TARGET), 100)
+            else:
+                speeds = [0, 0]
+            self.tracker.markerFound(1, frame.copy())
+            UDPOut.sendWheelSpeeds('127.0.0.1', self.sink.port, speeds[0], speeds[0], speeds[0],
+                speeds[1], speeds[1], speeds[1])
+        return call
+
+#name: (how to build the function, calls, warmup calls, items per call)
+def cases(bench):
+    nmeaSentences = len(bench.nmea.splitlines())
+    return {
+        'markerFound near': (lambda: bench.markerFound('near', (1, -1)), 60, 5, 1),
+        'markerFound far': (lambda: bench.markerFound('far', (1, -1)), 60, 5, 1),
+        'markerFound gate': (lambda: bench.markerFound('gate', (1, 2)), 60, 5, 1),
+        'markerFound empty': (lambda: bench.markerFound('empty', (1, -1)), 60, 5, 1),
+        'getSpeeds': (bench.getSpeeds, 20000, 1000, 1),
+        'distance_to': (lambda: lambda: bench.gps.distance_to(*TARGET), 20000, 1000, 1),
+        'bearing_to': (lambda: lambda: bench.gps.bearing_to(*TARGET), 20000, 1000, 1),
+        'nmea parse log': (bench.nmeaParse, 30, 3, nmeaSentences),
+        'sendWheelSpeeds': (bench.sendWheelSpeeds, 5000, 200, 1),
+        'control tick': (bench.controlTick, 60, 5, 1),
+    }
+
+def loadBaselines():
+    if not os.path.exists(baselinesPath):
+        return {}
+    with open(baselinesPath) as f:
+        return json.load(f)
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser(description='Benchmarks the rover hot paths')
+    argParser.add_argument('-k', '--filter', default='', help='only run benchmarks with this in their name')
+    argParser.add_argument('--save', action='store_true', help='store the results as the new baselines')
+    argParser.add_argument('--tolerance', type=float, default=.25,
+        help='how much slower than the baseline a median can get before it counts as a regression (.25 is 25%%)')
+    argParser.add_argument('--scale', type=float, default=1.0, help='multiplies how many calls each benchmark makes')
+    args = argParser.parse_args()
+
+    bench = Bench()
+    baselines = loadBaselines()
+    results = {}
+    regressions = []
+
+    #the tracker's prints would drown out the table
+    stdout = sys.stdout
+    print(f"{'benchmark':<20} {'per second':>12} {'p50 us':>10} {'p90 us':>10} {'p99 us':>10} {'max us':>10} {'vs baseline':>12}")
+    for name, (build, iterations, warmup, items) in cases(bench).items():
+        if args.filter not in name:
+            continue
+        func = build()
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            times = timeCalls(func, max(1, int(iterations * args.scale)), warmup)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        result = summarize(times, items)
+        results[name] = result
+
+        change = ''
+        baseline = baselines.get(name)
+        if baseline is not None:
+            ratio = result['p50_us'] / baseline['p50_us'] - 1
+            tolerance = baseline.get('tolerance', args.tolerance)
+            change = f'{ratio * 100:+.0f}%'
+            if ratio > tolerance:
+                change += ' SLOWER'
+                regressions.append(name)
+        print(f"{name:<20} {result['per_second']:12,.0f} {result['p50_us']:10.1f} {result['p90_us']:10.1f} "
+              f"{result['p99_us']:10.1f} {result['max_us']:10.1f} {change:>12}")
+
+    print(f'{bench.sink.received} wheel speed packets made it to the loopback sink')
+    if args.save:
+        for name, result in results.items():
+            saved = {'p50_us': round(result['p50_us'], 2), 'per_second': round(result['per_second'], 1)}
+            #keeps tolerances that were set by hand
+            if 'tolerance' in baselines.get(name, {}):
+                saved['tolerance'] = baselines[name]['tolerance']
+            baselines[name] = saved
+        baselines['_machine'] = {'platform': platform.platform(), 'python': platform.python_version(),
+            'processor': platform.processor() or platform.machine()}
+        with open(baselinesPath, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print('Saved baselines to', baselinesPath)
+    elif not baselines:
+        print('No baselines yet, run with --save to store this run as the baseline')
+
+    if regressions:
+        print('Regressed:', ', '.join(regressions))
+        exit(1)
@@ -0,0 +1,58 @@
+#Measures how fast LocationF9P's UBX parser gets through a recorded NAV-PVT stream,
+#then replays the stream through LocationF9P to check the fixes that come out of it
+#Run with: python3 benchmarks/ubx.py [path/to/stream.ubx] [chunk size]
+import io
+import os
+import sys
+from time import perf_counter
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+
+from libs.UBX import UBXParser
+from libs.Locationf9p import LocationF9P
+
+def benchmark(data, chunkSize=1024, repeats=20):
+    best = float('inf')
+    for _ in range(repeats):
+        parser = UBXParser()
+        start = perf_counter()
+        #feeds the stream in chunks like the serial port would hand it over
+        for i in range(0, len(data), chunkSize):
+            parser.feed(data[i:i + chunkSize])
+        best = min(best, perf_counter() - start)
+    return parser, best
+
+#Runs the stream through LocationF9P's read loop and returns every fix it published
+def replay(data, chunkSize=1024):
+    gps = LocationF9P(protocol="ubx")
+    gps.device_open_file = io.BufferedReader(io.BytesIO(data), buffer_size=chunkSize)
+    gps.parser.buffer = bytearray(chunkSize)
+    gps.parser.view = memoryview(gps.parser.buffer)
+    fixes = []
+    gps.add_fix_callback(fixes.append)
+    while True:
+        messages = gps.parser.read_from(gps.device_open_file)
+        if not messages and not gps.device_open_file.peek(1):
+            break
+        for message in messages:
+            gps.handle_message(message)
+    return gps, fixes
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.abspath(__file__)) + '/data/f9p.ubx'
+    chunkSize = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    parser, seconds = benchmark(data, chunkSize)
+    print(f'{len(data)} bytes, {parser.messages} messages in {seconds * 1000:.2f} ms')
+    print(f'{parser.messages / seconds:,.0f} messages/s, {len(data) / seconds / 1e6:.2f} MB/s')
+    print(f'bad checksums: {parser.bad_checksums}, unknown: {parser.unknown}, acks: {parser.acks}, naks: {parser.naks}')
+
+    gps, fixes = replay(data, chunkSize)
+    #every valid NAV-PVT should come out as exactly one fix, in order
+    times = [fix.time for fix in fixes]
+    assert len(fixes) > 0, 'no fixes came out of the stream'
+    assert times == sorted(times) and len(set(times)) == len(times), 'fixes came out of order or twice'
+    last = fixes[-1]
+    print(f'replayed {len(fixes)} fixes, last: {last.latitude:.7f} {last.longitude:.7f} '
+          f'bearing {last.bearing:.1f} speed {last.speed:.2f} m/s')
@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+
+#Stand in detection server for [OFFLOAD]. Runs the same ARTracker.markersFound the rover would on frames
+#the rover sends and sends back the tags it found, so the rover's CPU doesn't have to.
+#Run it on the base station (or anything with more cores) with the same config.ini as the rover:
+#    python3 detectionServer.py [--port 9200] [--metrics 9101]
+#then set MODE=on and HOST to this machine's address in the rover's [OFFLOAD] section.
+#benchmarks/offload.py measures whether it's worth it.
+import argparse
+import configparser
+import os
+
+from libs.ARTracker import ARTracker
+from libs import Metrics
+from libs import Offload
+
+path = os.path.dirname(os.path.abspath(__file__))
+configPath = os.path.join(path, 'config.ini')
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Looks for tags in frames the rover sends it")
+    argParser.add_argument("--config", default=configPath, help="config file, should be the same one the rover uses")
+    argParser.add_argument("--host", default="0.0.0.0", help="address to listen on")
+    argParser.add_argument("--port", type=int, default=None, help="port to listen on, defaults to PORT in [OFFLOAD]")
+    argParser.add_argument("--metrics", type=int, default=0, help="port to serve metrics on, 0 to not")
+    args = argParser.parse_args()
+
+    config = configparser.ConfigParser(allow_no_value=True)
+    if not config.read(args.config):
+        print("DID NOT OPEN CONFIG")
+        exit(-2)
+    port = args.port if args.port is not None else int(config['OFFLOAD']['PORT'])
+
+    if args.metrics:
+        Metrics.serve(args.metrics)
+    server = Offload.DetectionServer(ARTracker([], configFile=args.config), args.host, port)
+    print(f"Detection server listening on {args.host}:{server.port}")
+    server.serve_forever()
@@ -1,4 +1,3 @@
-from time import sleep
 from libs import Location
 
 #os.chdir(os.path.dirname(os.path.abspath(__file__)))
@@ -9,8 +8,11 @@ if __name__ == '__main__':
     l.start_GPS_thread()
     print('reading data')
     while True:
-        print(l.latitude)
-        print(l.longitude)
-        print(l.bearing)
+        #waits for the next fix instead of polling so every fix gets printed once
+        fix = l.wait_for_fix(timeout=1)
+        if fix is None:
+            continue
+        print(fix.latitude)
+        print(fix.longitude)
+        print(fix.bearing)
         print()
-        sleep(1)
@@ -1,17 +1,12 @@
-from nis import maps
 import os
-from random import randint, random
-
-from scipy import rand
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
-import threading
-
 import sys
 sys.path.append('../../Mission Control/RoverMap/')
 
 from server import MapServer
 from libs import Location
+from libs import Telemetry
 
 if __name__ == '__main__':
 
@@ -24,18 +19,13 @@ if __name__ == '__main__':
     mapServer.register_routes()
     mapServer.start()
 
-    def set_interval(func, sec):
-        def func_wrapper():
-            set_interval(func, sec)
-            func()
-        t = threading.Timer(sec, func_wrapper)
-        t.start()
-        return t
-
-    def update():
+    def update(payload):
         print("sending update...")
         #mapServer.update_rover_coords([38.4375 + randint(0, 100) / 10000 , -110.8125])
-        mapServer.update_rover_coords([loc.latitude, loc.longitude])
-    
-    set_interval(update, 0.500)
+        for coords in payload['trail'] or [payload['coords']]:
+            mapServer.update_rover_coords(coords)
 
+    #only sends points when the rover moves or turns enough
+    telemetry = Telemetry.TelemetryPublisher(update)
+    loc.add_fix_callback(telemetry.on_fix)
+    telemetry.thread.join()
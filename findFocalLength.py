@@ -1,65 +1,261 @@
 #!/usr/bin/python3
 
-#This programs returns the camera focal length assuming tag is tag 0, 20cm wide and 100cm away
+#Calibrates the [ARTRACKER] distance and angle constants from video of a tag at known spots.
+#
+#  1. Write a plan file with one spot per line: <distance cm> <horizontal degrees> <vertical degrees>
+#     Angles are from the center of the image, positive to the right and down. Put in a few distances
+#     straight ahead plus some spots around 30 degrees off to the side and up or down.
+#  2. Record: python3 findFocalLength.py record plan.txt /dev/video0
+#     It asks you to set the tag at each spot and records a few seconds of each one into
+#     calibration.avi with calibration.txt saying which frames go with which spot.
+#  3. Fit: python3 findFocalLength.py fit calibration.avi [--write]
+#     Finds the tag in every frame (spread over every core), fits DEGREES_PER_PIXEL, VDEGREES_PER_PIXEL
+#     and the FOCAL_LENGTH model ARTracker uses by least squares, and prints how far off each spot is
+#     with the new values. --write puts them into config.ini.
+import argparse
+import configparser
+import os
+import re
+from multiprocessing import Pool, cpu_count
+
 import cv2
 import cv2.aruco as aruco
 import numpy as np
-import os
-import configparser
-from time import sleep
-
-#opens the camera
-cam = cv2.VideoCapture('/dev/video0')
-if not cam.isOpened():
-    print("Camera not connected")
-    exit(-1)
-
-#sets up the config stuff
-config = configparser.ConfigParser(allow_no_value=True)
-config.read(os.path.dirname(__file__) + '/config.ini')
-
-#sets the resolution and 4cc
-format = config['ARTRACKER']['FORMAT']
-cam.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(format[0], format[1], format[2], format[3]))
-
-dppH = float(config['ARTRACKER']['DEGREES_PER_PIXEL'])
-dppV = float(config['ARTRACKER']['VDEGREES_PER_PIXEL'])
-width = int(config['ARTRACKER']['FRAME_WIDTH'])
-height = int(config['ARTRACKER']['FRAME_HEIGHT'])
-cam.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-cam.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-
-tagDict = aruco.Dictionary_get(aruco.DICT_4X4_50)
-
-while True:
-    try:
-        #takes image and detects markers
+
+path = os.path.dirname(os.path.abspath(__file__))
+configPath = os.path.join(path, 'config.ini')
+
+#the same cutoffs ARTracker.markerFound tries, so calibration sees tags the way the rover does
+THRESHOLDS = range(40, 221, 60)
+
+#The video's segments file sits next to it: one line per spot, <first frame> <last frame> <distance> <h angle> <v angle>
+def segmentsPath(video):
+    return os.path.splitext(video)[0] + '.txt'
+
+def readRows(fileName, columns):
+    rows = []
+    with open(fileName) as f:
+        for lineNum, line in enumerate(f, 1):
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            values = [float(item) for item in line.split()]
+            if len(values) != columns:
+                raise ValueError(f"{fileName} line {lineNum}: expected {columns} numbers, got {len(values)}")
+            rows.append(values)
+    return rows
+
+#Records every spot in the plan into one video and writes which frames go with which spot
+def record(args, config):
+    plan = readRows(args.plan, 3)
+    format = config['ARTRACKER']['FORMAT']
+    width = int(config['ARTRACKER']['FRAME_WIDTH'])
+    height = int(config['ARTRACKER']['FRAME_HEIGHT'])
+
+    cam = cv2.VideoCapture(args.camera)
+    if not cam.isOpened():
+        print("Camera not connected")
+        exit(-1)
+    cam.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*format))
+    cam.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    cam.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+
+    #MJPG keeps the file small and doesn't lose enough detail to move the tag corners
+    writer = cv2.VideoWriter(args.video, cv2.VideoWriter_fourcc(*'MJPG'), 10, (width, height))
+    frame = 0
+    with open(segmentsPath(args.video), 'w') as segments:
+        for distance, hAngle, vAngle in plan:
+            input(f"Put the tag {distance:g}cm away at {hAngle:g} degrees horizontal, {vAngle:g} vertical and press enter")
+            #the first few frames can still be from before the tag was moved
+            for _ in range(5):
+                cam.read()
+            first = frame
+            while frame - first < args.frames:
+                ret, image = cam.read()
+                if not ret:
+                    continue
+                writer.write(image)
+                frame += 1
+            segments.write(f"{first} {frame - 1} {distance:g} {hAngle:g} {vAngle:g}\n")
+            print(f"Recorded frames {first} to {frame - 1}")
+    writer.release()
+    cam.release()
+    print(f"Saved {args.video} and {segmentsPath(args.video)}")
+
+#Finds the tag in frames [first, last] of the video and returns one row per frame it was seen in:
+#frame number, center x, center y, width in pixels. Runs in a worker process
+def detectRange(job):
+    video, first, last, tagID = job
+    tagDict = aruco.Dictionary_get(aruco.DICT_4X4_50)
+    cam = cv2.VideoCapture(video)
+    cam.set(cv2.CAP_PROP_POS_FRAMES, first)
+    rows = []
+    for frame in range(first, last + 1):
         ret, image = cam.read()
-        corners, markerIDs, rejected = aruco.detectMarkers(image, tagDict)
-        
-        tagWidth = 0
-        if not markerIDs is None and markerIDs[0] == 4:
-            tagWidth = corners[0][0][1][0] - corners[0][0][0][0]
-            
-             #IMPORTANT: Assumes tag is 20cm wide and 100cm away 
-            focalLength = (tagWidth * 100) / 20
-            print("Focal length: ", focalLength)
-
-            centerXMarker = (corners[0][0][1][0] + corners[0][0][0][0]) / 2 
-            angleToMarkerH = dppH * (centerXMarker - width/2)
-            print('Horizontal angle: ', angleToMarkerH)
-            
-            centerYMarker = (corners[0][0][0][1] + corners[0][0][2][1]) / 2 
-            angleToMarkerV = -1 *dppV * (centerYMarker - height/2)
-            print('Vertical angle: ', angleToMarkerV)
-        else:
-            print("Nothing found")
-            
-        sleep(.1)
-    
-    except KeyboardInterrupt:
-        break
-    except:
-        pass #When running multiple times in a row, must cycle through a few times
-       
-cam.release() #releases the camera
+        if not ret:
+            break
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        for cutoff in THRESHOLDS:
+            bw = cv2.threshold(gray, cutoff, 255, cv2.THRESH_BINARY)[1]
+            corners, markerIDs, rejected = aruco.detectMarkers(bw, tagDict)
+            if markerIDs is None or tagID not in markerIDs:
+                continue
+            c = corners[list(markerIDs.flatten()).index(tagID)][0]
+            #measured the same way ARTracker.markerFound measures it
+            width = ((c[1][0] - c[0][0]) + (c[2][0] - c[3][0])) / 2
+            rows.append((frame, c[:, 0].mean(), c[:, 1].mean(), width))
+            break
+    cam.release()
+    return rows
+
+#Detects the tag in every segment of the video, splitting the frames across processes
+def detect(video, segments, tagID, processes, chunk=30):
+    jobs = []
+    for first, last, *_ in segments:
+        for start in range(int(first), int(last) + 1, chunk):
+            jobs.append((video, start, min(start + chunk - 1, int(last)), tagID))
+    with Pool(processes) as pool:
+        rows = [row for result in pool.map(detectRange, jobs) for row in result]
+    if not rows:
+        return np.empty((0, 4))
+    return np.array(rows, dtype=float)
+
+#Least squares fit of angle = dpp * pixels from center, returns dpp.
+#Only spots that are actually off center say anything about it
+def fitDegreesPerPixel(offsets, angles, current):
+    used = np.abs(angles) > 1
+    if not used.any():
+        return current
+    return float(offsets[used] @ angles[used] / (offsets[used] @ offsets[used]))
+
+#ARTracker's focal length model is
+#   f = f0 + (|h|/30)(f30H - f0) + (|v|/30)(f30V - f0)
+#which is linear in f0, f30H and f30V, and every frame's focal length is known from distance * width / tagWidth.
+#Returns (f0, f30H, f30V). A term the spots never moved along stays equal to f0
+def fitFocalLengths(hAngles, vAngles, focalLengths):
+    h = np.abs(hAngles) / 30
+    v = np.abs(vAngles) / 30
+    columns = [1 - h - v]
+    if h.max() > 1 / 30:
+        columns.append(h)
+    if v.max() > 1 / 30:
+        columns.append(v)
+    A = np.column_stack(columns)
+    solution = np.linalg.lstsq(A, focalLengths, rcond=None)[0]
+    f0 = solution[0]
+    rest = list(solution[1:])
+    f30H = rest.pop(0) if h.max() > 1 / 30 else f0
+    f30V = rest.pop(0) if v.max() > 1 / 30 else f0
+    return float(f0), float(f30H), float(f30V)
+
+#Sets keys in one section of an ini file, leaving every other line (and comment) alone
+def writeSection(fileName, section, values):
+    with open(fileName) as f:
+        lines = f.readlines()
+    inSection = False
+    remaining = dict(values)
+    end = len(lines)
+    for i, line in enumerate(lines):
+        header = re.match(r'\s*\[(.+)\]', line)
+        if header:
+            if inSection:
+                end = i
+                break
+            inSection = header.group(1) == section
+            continue
+        key = re.match(r'\s*([A-Za-z0-9_]+)\s*=', line)
+        if inSection and key and key.group(1).upper() in remaining:
+            lines[i] = f"{key.group(1)}={remaining.pop(key.group(1).upper())}\n"
+    #keys that weren't there yet go at the end of the section
+    lines[end:end] = [f"{key}={value}\n" for key, value in remaining.items()]
+    with open(fileName, 'w') as f:
+        f.writelines(lines)
+
+def fit(args, config):
+    segments = np.array(readRows(segmentsPath(args.video), 5))
+    width = int(config['ARTRACKER']['FRAME_WIDTH'])
+    height = int(config['ARTRACKER']['FRAME_HEIGHT'])
+    tagWidth = float(config['ARTRACKER']['KNOWN_TAG_WIDTH'])
+
+    rows = detect(args.video, segments, args.id, args.processes)
+    print(f"Found tag {args.id} in {len(rows)} of {int((segments[:, 1] - segments[:, 0] + 1).sum())} frames")
+    if len(rows) == 0:
+        exit(-1)
+
+    #matches every detection up with the spot it was recorded at
+    frames = rows[:, 0]
+    spot = np.searchsorted(segments[:, 0], frames, side='right') - 1
+    distance, hTrue, vTrue = segments[spot, 2], segments[spot, 3], segments[spot, 4]
+    xOffset = rows[:, 1] - width / 2
+    yOffset = rows[:, 2] - height / 2
+    pixelWidth = rows[:, 3]
+
+    dppH = fitDegreesPerPixel(xOffset, hTrue, float(config['ARTRACKER']['DEGREES_PER_PIXEL']))
+    dppV = fitDegreesPerPixel(yOffset, vTrue, float(config['ARTRACKER']['VDEGREES_PER_PIXEL']))
+
+    #the focal length model gets fit against the angles the rover will compute, not the true ones
+    hAngles = dppH * xOffset
+    vAngles = dppV * yOffset
+    f0, f30H, f30V = fitFocalLengths(hAngles, vAngles, distance * pixelWidth / tagWidth)
+
+    realFocalLength = f0 + (np.abs(hAngles) / 30) * (f30H - f0) + (np.abs(vAngles) / 30) * (f30V - f0)
+    distanceError = tagWidth * realFocalLength / pixelWidth - distance
+    hError = hAngles - hTrue
+    vError = vAngles - vTrue
+
+    print()
+    print(f"{'distance':>9} {'h':>6} {'v':>6} {'frames':>7} {'dist err cm':>12} {'dist err %':>11} {'h err':>7} {'v err':>7}")
+    for i, (first, last, d, h, v) in enumerate(segments):
+        mine = spot == i
+        if not mine.any():
+            print(f"{d:9g} {h:6g} {v:6g} {0:7d}   tag not found")
+            continue
+        err = np.median(distanceError[mine])
+        print(f"{d:9g} {h:6g} {v:6g} {int(mine.sum()):7d} {err:12.1f} {100 * err / d:11.1f} "
+              f"{np.median(hError[mine]):7.2f} {np.median(vError[mine]):7.2f}")
+    print()
+    print(f"RMS distance error: {np.sqrt(np.mean(distanceError ** 2)):.1f}cm, "
+          f"RMS angle error: {np.sqrt(np.mean(hError ** 2)):.2f} horizontal, {np.sqrt(np.mean(vError ** 2)):.2f} vertical")
+
+    values = {
+        'DEGREES_PER_PIXEL': f"{dppH:.6g}",
+        'VDEGREES_PER_PIXEL': f"{dppV:.6g}",
+        'FOCAL_LENGTH': f"{f0:.1f}",
+        'FOCAL_LENGTH30H': f"{f30H:.1f}",
+        'FOCAL_LENGTH30V': f"{f30V:.1f}",
+    }
+    print()
+    print("[ARTRACKER]")
+    for key, value in values.items():
+        print(f"{key}={value}")
+    if args.write:
+        writeSection(args.config, 'ARTRACKER', values)
+        print(f"Written to {args.config}")
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Calibrates the [ARTRACKER] focal lengths and degrees per pixel")
+    argParser.add_argument("--config", default=configPath, help="config file to read and write")
+    commands = argParser.add_subparsers(dest="command", required=True)
+
+    recordParser = commands.add_parser("record", help="records the tag at each spot in a plan file")
+    recordParser.add_argument("plan", help="file with one <distance cm> <h degrees> <v degrees> per line")
+    recordParser.add_argument("camera", help="camera to record with, like /dev/video0")
+    recordParser.add_argument("--video", default="calibration.avi", help="video to record to")
+    recordParser.add_argument("--frames", type=int, default=30, help="frames to record at each spot")
+
+    fitParser = commands.add_parser("fit", help="fits the constants from a recorded video")
+    fitParser.add_argument("video", nargs="?", default="calibration.avi", help="video made by record")
+    fitParser.add_argument("--id", type=int, default=4, help="id of the tag in the video")
+    fitParser.add_argument("--processes", type=int, default=cpu_count(), help="processes to detect with")
+    fitParser.add_argument("--write", action="store_true", help="write the results into the config file")
+    args = argParser.parse_args()
+
+    config = configparser.ConfigParser(allow_no_value=True)
+    if not config.read(args.config):
+        print("DID NOT OPEN CONFIG")
+        exit(-2)
+
+    if args.command == "record":
+        record(args, config)
+    else:
+        fit(args, config)
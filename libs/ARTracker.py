@@ -3,8 +3,13 @@ import cv2.aruco as aruco
 import numpy as np
 import configparser
 import sys
-from time import sleep
+from time import sleep, perf_counter, monotonic
 import os
+from math import sin, cos, atan2, radians, degrees, hypot
+from libs import Metrics
+from libs import Camera
+from libs import FrameQuality
+from libs import Offload
 '''
 darknetPath = os.path.dirname(os.path.abspath(__file__)) + '/../YOLO/darknet/'
 sys.path.append(darknetPath)
@@ -12,6 +17,33 @@ from darknet_images import *
 from darknet import load_network
 '''
 
+#One tag seen in one frame
+class Detection:
+    __slots__ = ('id', 'corners', 'angle', 'distance', 'centerX', 'centerY', 'width', 'camera', 'bearing', 'range', 'timestamp')
+
+    def __init__(self, id, corners, angle, distance, centerX, centerY, width, camera=-1):
+        self.id = id
+        #same format aruco gives corners in, [[topLeft, topRight, bottomRight, bottomLeft]]
+        self.corners = corners
+        #degrees from the center of the image, positive is to the right
+        self.angle = angle
+        #cm
+        self.distance = distance
+        #pixels
+        self.centerX = centerX
+        self.centerY = centerY
+        self.width = width
+        #index of the camera it was seen in
+        self.camera = camera
+        #degrees and cm from the center of the rover instead of the camera, set by findMarkers
+        self.bearing = angle
+        self.range = distance
+        #monotonic() time the frame was read, set by findMarkers
+        self.timestamp = None
+
+    def __repr__(self):
+        return f"Detection(id={self.id}, bearing={self.bearing:.1f}, range={self.range:.0f}, camera={self.camera})"
+
 class ARTracker:
 
     # Constructor
@@ -24,6 +56,7 @@ class ARTracker:
         self.angleToMarker = -999.9
         self.index1 = -1
         self.index2 = -1
+        self.passes = 0 #how many thresholds the last markerFound call tried
         self.useYOLO = useYOLO
         self.cameras = cameras
         
@@ -37,6 +70,17 @@ class ARTracker:
                 print("{os.getcwd()}/{configFile}")
             exit(-2)
 
+        #(yaw degrees, forward cm, right cm) of each camera on the rover, see [CAMERAS].
+        #Cameras past the ones listed are treated as looking straight ahead from the center
+        self.mounts = []
+        if config.has_section('CAMERAS'):
+            for name in config['CAMERAS']['ORDER'].split(','):
+                name = name.strip().upper()
+                self.mounts.append((float(config['CAMERAS'][name + '_YAW']), float(config['CAMERAS'][name + '_FORWARD']),
+                    float(config['CAMERAS'][name + '_RIGHT'])))
+        #which camera the last findMarker result came from
+        self.camera = -1
+
         # Set variables from the config file
         self.degreesPerPixel = float(config['ARTRACKER']['DEGREES_PER_PIXEL'])
         self.vDegreesPerPixel = float(config['ARTRACKER']['VDEGREES_PER_PIXEL'])
@@ -47,6 +91,25 @@ class ARTracker:
         self.format = config['ARTRACKER']['FORMAT']
         self.frameWidth = int(config['ARTRACKER']['FRAME_WIDTH'])
         self.frameHeight = int(config['ARTRACKER']['FRAME_HEIGHT'])
+        #far away tags that aruco turned down get cropped out, blown up and checked again
+        self.recoveryCandidates = int(config['ARTRACKER'].get('RECOVERY_CANDIDATES', 16))
+        self.recoveryMaxSize = float(config['ARTRACKER'].get('RECOVERY_MAX_SIZE', 60))
+        self.recoveryTileSize = int(config['ARTRACKER'].get('RECOVERY_TILE_SIZE', 96))
+        self.recoveredTags = Metrics.counter('rover_recovered_tags_total', 'Tags found by checking rejected candidates again')
+        #the threshold the last tag was found with, the cheap detection mode only tries this one
+        self.lastThreshold = 100
+
+        #blurry or washed out frames get skipped or only get the cheap detection, see [QUALITY]
+        quality = config['QUALITY'] if config.has_section('QUALITY') else {}
+        self.qualityMode = quality.get('MODE', 'cheap')
+        self.qualitySettings = {
+            'scale_width': int(quality.get('SCALE_WIDTH', 320)),
+            'min_sharpness': float(quality.get('MIN_SHARPNESS', 15)),
+            'sharpness_ratio': float(quality.get('SHARPNESS_RATIO', .5)),
+            'max_clipped': float(quality.get('MAX_CLIPPED', .4)),
+            'clipped_ratio': float(quality.get('CLIPPED_RATIO', 1.5)),
+            'max_skipped': int(quality.get('MAX_SKIPPED', 10)),
+        }
         
         #sets up yolo
         if useYOLO:
@@ -66,6 +129,15 @@ class ARTracker:
             self.videoWriter = cv2.VideoWriter("autonomous.avi", cv2.VideoWriter_fourcc(
                 self.format[0], self.format[1], self.format[2], self.format[3]), 5, (self.frameWidth, self.frameHeight), False)
         
+        #frames can go to a detection server instead of being looked at here, see [OFFLOAD]
+        offload = config['OFFLOAD'] if config.has_section('OFFLOAD') else {}
+        self.offload = None
+        #the detection server makes its tracker without cameras, that one mustn't offload to itself
+        if offload.get('MODE', 'off') == 'on' and self.cameras != []:
+            self.offload = Offload.OffloadClient(offload['HOST'], int(offload['PORT']))
+        self.offloadDeadline = float(offload.get('DEADLINE', 80)) / 1000
+        self.roiMargin = int(offload.get('ROI_MARGIN', 80))
+
         # Set the ar marker dictionary
         self.markerDict = aruco.Dictionary_get(aruco.DICT_4X4_50)
         
@@ -85,6 +157,9 @@ class ARTracker:
                 cam.set(cv2.CAP_PROP_FRAME_WIDTH, self.frameWidth)
                 cam.set(cv2.CAP_PROP_BUFFERSIZE, 1) # greatly speeds up the program but the writer is a bit wack because of this
                 cam.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(self.format[0], self.format[1], self.format[2], self.format[3]))
+                if self.offload is not None:
+                    #hands back the camera's MJPG as is, frames only get decoded if they have to be looked at here
+                    cam.set(cv2.CAP_PROP_CONVERT_RGB, 0)
                 #ret, testIm =  self.caps[i].read()[0]:
                 if not cam.read()[0]:
                     cam.release()
@@ -92,6 +167,44 @@ class ARTracker:
                     self.caps.append(cam)
                     break
 
+        #each camera gets read on its own thread so findMarker always gets the newest frame without waiting
+        self.streams = []
+        for i in range(len(self.caps)):
+            stream = Camera.Camera(self.caps[i], str(self.cameras[i]))
+            stream.start()
+            self.streams.append(stream)
+        if self.offload is not None:
+            self.offload.start()
+        #corners of the tags last seen on each camera, the local fallback only looks around them
+        self.lastCorners = [None] * len(self.caps)
+
+        #the last detection on each camera as (frame seq, id1, id2, results). Asking about the same ids
+        #again before the camera has a new frame just gives back the same answer instead of redoing it
+        self.detectionCache = [None] * len(self.caps)
+        #same idea for findMarkers, (frame seq, ids, {id: Detection})
+        self.markersCache = [None] * len(self.caps)
+
+        self.qualityGates = []
+        for i in range(len(self.caps)):
+            if self.qualityMode == 'off':
+                self.qualityGates.append(None)
+            else:
+                self.qualityGates.append(FrameQuality.QualityGate(str(self.cameras[i]), **self.qualitySettings))
+
+        #per camera metrics, made here so findMarker only has to update them
+        self.detectionLatencies = []
+        self.thresholdPasses = []
+        self.lastPasses = []
+        self.cacheHits = []
+        self.offloadFallbacks = []
+        for i in range(len(self.caps)):
+            camera = str(self.cameras[i])
+            self.offloadFallbacks.append(Metrics.counter('rover_offload_fallbacks_total', 'Frames looked at on the rover because the detection server was late', camera=camera))
+            self.cacheHits.append(Metrics.counter('rover_detection_cache_hits_total', 'Detections reused because the frame had not changed', camera=camera))
+            self.detectionLatencies.append(Metrics.latency('rover_detection', 'Time spent looking for tags in a frame', camera=camera))
+            self.thresholdPasses.append(Metrics.counter('rover_threshold_passes_total', 'Thresholds tried while looking for tags', camera=camera))
+            self.lastPasses.append(Metrics.gauge('rover_threshold_passes', 'Thresholds tried on the last frame', camera=camera))
+
 
     #helper method to convert YOLO detections into the aruco corners format
     def _convertToCorners(self,detections, numCorners):
@@ -121,153 +234,213 @@ class ARTracker:
         
         return corners
     
+    #Finds every tag in ids (or every tag at all if ids is None) in one pass over the image.
+    #Returns {id: Detection}. With ids given it stops trying thresholds as soon as all of them are found,
+    #with ids None it tries every threshold so tags that only show up under some lighting still get found.
+    #cheap only tries the threshold that last worked and doesn't try to recover rejected candidates.
+    #If image is a crop, offset is the (x, y) of its top left corner in the full frame
+    def markersFound(self, image, ids=None, cheap=False, offset=(0, 0)):
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        found = {}
+        rejected = []
+        self.passes = 0
+        self.bw = image
+        # tries converting to b&w using different different cutoffs to find the perfect one for the current lighting
+        for i in ((self.lastThreshold,) if cheap else range(40, 221, 60)):
+            self.passes += 1
+            bw = cv2.threshold(image,i,255, cv2.THRESH_BINARY)[1]
+            (corners, markerIDs, self.rejected) = aruco.detectMarkers(bw, self.markerDict)
+            rejected.extend(self.rejected)
+            if markerIDs is None:
+                continue
+            for m in range(len(markerIDs)):
+                markerID = int(markerIDs[m][0])
+                if ids is not None and markerID not in ids:
+                    continue
+                detection = self._measure(markerID, corners[m] + np.float32(offset))
+                #if the same tag shows up twice the biggest one is the one to trust
+                if markerID not in found or detection.width > found[markerID].width:
+                    found[markerID] = detection
+                    self.bw = bw
+                    self.lastThreshold = i
+            if ids is not None and len(found) == len(ids):
+                break
+
+        if not cheap and self.recoveryCandidates > 0 and rejected and (ids is None or len(found) < len(ids)):
+            for markerID, detection in self._recoverRejected(image, rejected, offset).items():
+                if (ids is None or markerID in ids) and markerID not in found:
+                    found[markerID] = detection
+                    self.recoveredTags.inc()
+        return found
+
+    #Small quads aruco found but couldn't read are usually tags that are too far away to have enough
+    #pixels per bit. This crops each one out of the gray image, blows it up to a tile and lays the tiles
+    #out in one mosaic, so every candidate gets checked again with a single detectMarkers call.
+    #Returns {id: Detection} with the corners back in full frame pixels
+    def _recoverRejected(self, image, rejected, offset=(0, 0)):
+        candidates = []
+        for quad in rejected:
+            q = quad[0]
+            size = np.linalg.norm(q - np.roll(q, 1, axis=0), axis=1)
+            #too big to gain anything from upscaling, or too lopsided to be a tag
+            if size.max() > self.recoveryMaxSize or size.min() < .3 * size.max():
+                continue
+            if not cv2.isContourConvex(q.astype(np.float32)):
+                continue
+            center = q.mean(axis=0)
+            #the same quad usually gets rejected under several thresholds
+            if any(np.abs(center - other).max() < size.max() / 2 for other, _ in candidates):
+                continue
+            candidates.append((center, size.max()))
+            if len(candidates) == self.recoveryCandidates:
+                break
+        if not candidates:
+            return {}
+
+        tile = self.recoveryTileSize
+        gap = tile // 8
+        columns = int(np.ceil(np.sqrt(len(candidates))))
+        rows = int(np.ceil(len(candidates) / columns))
+        mosaic = np.full((rows * (tile + gap) + gap, columns * (tile + gap) + gap), 255, np.uint8)
+        #for each tile: (x, y) of the crop in the frame, (x, y) of the tile in the mosaic, scale
+        placements = []
+        for k, (center, size) in enumerate(candidates):
+            #crops a square around the quad with room for the white border around the tag
+            half = size
+            x0 = int(max(0, center[0] - half))
+            y0 = int(max(0, center[1] - half))
+            x1 = int(min(image.shape[1], center[0] + half))
+            y1 = int(min(image.shape[0], center[1] + half))
+            crop = image[y0:y1, x0:x1]
+            if crop.size == 0:
+                continue
+            scale = tile / max(crop.shape)
+            crop = cv2.resize(crop, (max(1, int(crop.shape[1] * scale)), max(1, int(crop.shape[0] * scale))),
+                interpolation=cv2.INTER_CUBIC)
+            tx = gap + (k % columns) * (tile + gap)
+            ty = gap + (k // columns) * (tile + gap)
+            mosaic[ty:ty + crop.shape[0], tx:tx + crop.shape[1]] = crop
+            placements.append(((x0, y0), (tx, ty), scale))
+
+        (corners, markerIDs, _) = aruco.detectMarkers(mosaic, self.markerDict)
+        found = {}
+        if markerIDs is None:
+            return found
+        for m in range(len(markerIDs)):
+            c = corners[m][0]
+            center = c.mean(axis=0)
+            for (x0, y0), (tx, ty), scale in placements:
+                if tx <= center[0] < tx + tile and ty <= center[1] < ty + tile:
+                    full = ((c - (tx, ty)) / scale + (x0 + offset[0], y0 + offset[1])).astype(np.float32)
+                    markerID = int(markerIDs[m][0])
+                    found[markerID] = self._measure(markerID, full[None])
+                    break
+        return found
+
+    #Works out the angle and distance to a tag from its corners
+    def _measure(self, markerID, corners):
+        c = corners[0]
+        centerX = (c[0][0] + c[1][0] + c[2][0] + c[3][0]) / 4
+        centerY = (c[0][1] + c[1][1] + c[2][1] + c[3][1]) / 4
+        # takes the pixels from the marker to the center of the image and multiplies it by the degrees per pixel
+        angle = self.degreesPerPixel * (centerX - self.frameWidth/2)
+
+        '''
+        distanceToAR = (knownWidthOfMarker(20cm) * focalLengthOfCamera) / pixelWidthOfMarker
+        focalLength = focal length at 0 degrees horizontal and 0 degrees vertical
+        focalLength30H = focal length at 30 degreees horizontal and 0 degrees vertical
+        focalLength30V = focal length at 30 degrees vertical and 0 degrees horizontal
+        realFocalLength of camera = focalLength 
+                                    + (horizontal angle to marker/30) * (focalLength30H - focalLength)
+                                    + (vertical angle to marker / 30) * (focalLength30V - focalLength)
+        If focalLength30H and focalLength30V both equal focalLength then realFocalLength = focalLength which is good for non huddly cameras
+        Please note that the realFocalLength calculation is an approximation that could be much better if anyone wants to try to come up with something better
+        '''
+        hAngle = abs(angle)
+        vAngle = abs(self.vDegreesPerPixel * (centerY - self.frameHeight/2))
+        realFocalLength = self.focalLength + (hAngle/30) * (self.focalLength30H - self.focalLength) + \
+            (vAngle/30) * (self.focalLength30V - self.focalLength)
+        width = ((c[1][0] - c[0][0]) + (c[2][0] - c[3][0])) / 2
+        distance = (self.knownMarkerWidth * realFocalLength) / width if width > 0 else -1
+        return Detection(markerID, corners, angle, distance, centerX, centerY, width)
+
     #id1 is the main ar tag to track, id2 is if you're looking at a gatepost, image is the image to analyze
-    def markerFound(self, id1, image, id2=-1):
-        # converts to grayscale
-        cv2.cvtColor(image, cv2.COLOR_RGB2GRAY, image)  
-        
+    #cheap does one threshold pass and skips YOLO, for frames that failed the quality check
+    def markerFound(self, id1, image, id2=-1, cheap=False):
         self.index1 = -1
         self.index2 = -1
-        bw = image #will hold the black and white image
-        # tries converting to b&w using different different cutoffs to find the perfect one for the current lighting
-        for i in range(40, 221, 60):
-            bw = cv2.threshold(image,i,255, cv2.THRESH_BINARY)[1]
-            (self.corners, self.markerIDs, self.rejected) = aruco.detectMarkers(bw, self.markerDict)   
-            if not (self.markerIDs is None):
-                print('', end='') #I have not been able to reproduce an error when I have a print statement here so I'm leaving it in    
-                if id2==-1: #single post
-                    self.index1 = -1 
-                    # this just checks to make sure that it found the right marker
-                    for m in range(len(self.markerIDs)):  
-                        if self.markerIDs[m] == id1:
-                            self.index1 = m  
-                            break  
-                
-                    if self.index1 != -1:
-                        print("Found the correct marker!")
-                        if self.write:
-                            self.videoWriter.write(bw)   #purely for debug   
-                            cv2.waitKey(1)
-                        break                    
-                    
-                    else:
-                        print("Found a marker but was not the correct one") 
-                
-                else: #gate post
-                    self.index1 = -1
-                    self.index2 = -1
-                    if len(self.markerIDs) == 1: 
-                       print('Only found marker ', self.markerIDs[0])
-                    else:
-                        for j in range(len(self.markerIDs) - 1, -1,-1): #I trust the biggest markers the most
-                            if self.markerIDs[j][0] == id1:
-                                self.index1 = j 
-                            elif self.markerIDs[j][0] == id2:
-                                self.index2 = j
-                    if self.index1 != -1 and self.index2 != -1:
-                        print('Found both markers!')
-                        if self.write:
-                            self.videoWriter.write(bw)   #purely for debug   
-                            cv2.waitKey(1)
-                        break                        
-                     
-            if i == 220:  #did not find any AR markers with any b&w cutoff using aruco                
-                #Checks to see if yolo can find a tag
-                if self.useYOLO:
-                    detections = []
-                    if not self.write:
-                        #this is a simpler detection function that doesn't return the image
-                        detections = simple_detection(image, self.network, self.class_names, self.thresh)
-                    else:
-                        #more complex detection that returns the image to be written
-                        image, detections = complex_detection(image, self.network, self.class_names, self.class_colors, self.thresh)
-                    #cv2.imwrite('ar.jpg', image)
-                    for d in detections:
-                        print(d)
-                        
-                    if id2 == -1 and len(detections) > 0:
-                        self.corners = self._convertToCorners(detections, 1)
-                        self.index1 = 0 #Takes the highest confidence ar tag
-                        if self.write:
-                            self.videoWriter.write(image)   #purely for debug   
-                            cv2.waitKey(1)                        
-                    elif len(detections) > 1:
-                        self.corners = self._convertToCorners(detections, 2)
-                        self.index1 = 0 #takes the two highest confidence ar tags
-                        self.index2 = 1
-                        if self.write:
-                            self.videoWriter.write(image)   #purely for debug   
-                            cv2.waitKey(1)
-                    print(self.corners)    
+        found = self.markersFound(image, {id1} if id2 == -1 else {id1, id2}, cheap)
+
+        if self._useFound(found, id1, id2):
+            if self.write:
+                self.videoWriter.write(self.bw)   #purely for debug   
+                cv2.waitKey(1)
+            return True
+
+        if found:
+            print('Only found marker ', list(found))
+
+        #did not find any AR markers with any b&w cutoff using aruco, checks to see if yolo can find a tag
+        if self.useYOLO and not cheap:
+            detections = []
+            if not self.write:
+                #this is a simpler detection function that doesn't return the image
+                detections = simple_detection(image, self.network, self.class_names, self.thresh)
+            else:
+                #more complex detection that returns the image to be written
+                image, detections = complex_detection(image, self.network, self.class_names, self.class_colors, self.thresh)
+            for d in detections:
+                print(d)
                 
-                #Not even YOLO saw anything
-                if self.index1 == -1 or (self.index2 == -1 and id2 != -1): 
-                    if self.write:
-                        self.videoWriter.write(image) 
-                        #cv2.imshow('window', image)
-                        cv2.waitKey(1)
-                    self.distanceToMarker = -1 
-                    self.angleToMarker = -999 
-                    return False 
+            if id2 == -1 and len(detections) > 0:
+                self.corners = self._convertToCorners(detections, 1)
+                self.index1 = 0 #Takes the highest confidence ar tag
+                detection = self._measure(id1, np.array(self.corners[0]))
+                self.angleToMarker = detection.angle
+                self.distanceToMarker = detection.distance
+            elif id2 != -1 and len(detections) > 1:
+                self.corners = self._convertToCorners(detections, 2)
+                self.index1 = 0 #takes the two highest confidence ar tags
+                self.index2 = 1
+                self._measureGate(self._measure(id1, np.array(self.corners[0])), self._measure(id2, np.array(self.corners[1])))
+            if self.write:
+                self.videoWriter.write(image)   #purely for debug   
+                cv2.waitKey(1)
+            if self.index1 != -1:
+                return True
         
+        #Not even YOLO saw anything
+        if self.write:
+            self.videoWriter.write(self.bw)
+            cv2.waitKey(1)
+        self.distanceToMarker = -1 
+        self.angleToMarker = -999 
+        return False 
+
+    #Sets the angle and distance from {id: Detection} if id1 (and id2 for a gate) are in it
+    def _useFound(self, found, id1, id2):
+        if id1 not in found or (id2 != -1 and id2 not in found):
+            return False
         if id2 == -1:
-            centerXMarker = (self.corners[self.index1][0][0][0] + self.corners[self.index1][0][1][0] + \
-                self.corners[self.index1][0][2][0] + self.corners[self.index1][0][3][0]) / 4
-            # takes the pixels from the marker to the center of the image and multiplies it by the degrees per pixel
-            self.angleToMarker = self.degreesPerPixel * (centerXMarker - self.frameWidth/2)
-        
-            '''
-            distanceToAR = (knownWidthOfMarker(20cm) * focalLengthOfCamera) / pixelWidthOfMarker
-            focalLength = focal length at 0 degrees horizontal and 0 degrees vertical
-            focalLength30H = focal length at 30 degreees horizontal and 0 degrees vertical
-            focalLength30V = focal length at 30 degrees vertical and 0 degrees horizontal
-            realFocalLength of camera = focalLength 
-                                        + (horizontal angle to marker/30) * (focalLength30H - focalLength)
-                                        + (vertical angle to marker / 30) * (focalLength30V - focalLength)
-            If focalLength30H and focalLength30V both equal focalLength then realFocalLength = focalLength which is good for non huddly cameras
-            Please note that the realFocalLength calculation is an approximation that could be much better if anyone wants to try to come up with something better
-            '''
-            hAngleToMarker = abs(self.angleToMarker)
-            centerYMarker = (self.corners[self.index1][0][0][1] + self.corners[self.index1][0][1][1] + \
-                self.corners[self.index1][0][2][1] + self.corners[self.index1][0][3][1]) / 4
-            vAngleToMarker = abs(self.vDegreesPerPixel * (centerYMarker - self.frameHeight/2))
-            realFocalLength = self.focalLength + (hAngleToMarker/30) * (self.focalLength30H - self.focalLength) + \
-                (vAngleToMarker/30) * (self.focalLength30V - self.focalLength)
-            widthOfMarker = ((self.corners[self.index1][0][1][0] - self.corners[self.index1][0][0][0]) + \
-                (self.corners[self.index1][0][2][0] - self.corners[self.index1][0][3][0])) / 2
-            self.distanceToMarker = (self.knownMarkerWidth * realFocalLength) / widthOfMarker 
-            
+            print("Found the correct marker!")
+            self.corners = [found[id1].corners]
+            self.index1 = 0
+            self.angleToMarker = found[id1].angle
+            self.distanceToMarker = found[id1].distance
         else:
-            centerXMarker1 = (self.corners[self.index1][0][0][0] + self.corners[self.index1][0][1][0] + \
-                self.corners[self.index1][0][2][0] + self.corners[self.index1][0][3][0]) / 4
-            centerXMarker2 = (self.corners[self.index2][0][0][0] + self.corners[self.index2][0][1][0] + \
-                self.corners[self.index2][0][2][0] + self.corners[self.index2][0][3][0]) / 4
-            self.angleToMarker = self.degreesPerPixel * ((centerXMarker1 + centerXMarker2)/2 - self.frameWidth/2) 
-        
-            hAngleToMarker1 = abs(self.vDegreesPerPixel * (centerXMarker1 - self.frameWidth/2))
-            hAngleToMarker2 = abs(self.vDegreesPerPixel * (centerXMarker2 - self.frameWidth/2))
-            centerYMarker1 = (self.corners[self.index1][0][0][1] + self.corners[self.index1][0][1][1] + \
-                self.corners[self.index1][0][2][1] + self.corners[self.index1][0][3][1]) / 4
-            centerYMarker2 = (self.corners[self.index2][0][0][1] + self.corners[self.index2][0][1][1] + \
-                self.corners[self.index2][0][2][1] + self.corners[self.index2][0][3][1]) / 4
-            vAngleToMarker1 = abs(self.vDegreesPerPixel * (centerYMarker1 - self.frameHeight/2))
-            vAngleToMarker2 = abs(self.vDegreesPerPixel * (centerYMarker2 - self.frameHeight/2))
-            realFocalLength1 = self.focalLength + (hAngleToMarker1/30) * (self.focalLength30H - self.focalLength) + \
-                (vAngleToMarker1/30) * (self.focalLength30V - self.focalLength)
-            realFocalLength2 = self.focalLength + (hAngleToMarker2/30) * (self.focalLength30H - self.focalLength) + \
-                (vAngleToMarker2/30) * (self.focalLength30V - self.focalLength)     
-            widthOfMarker1 = ((self.corners[self.index1][0][1][0] - self.corners[self.index1][0][0][0]) + \
-                (self.corners[self.index1][0][2][0] - self.corners[self.index1][0][3][0])) / 2
-            widthOfMarker2 = ((self.corners[self.index2][0][1][0] - self.corners[self.index2][0][0][0]) + \
-                (self.corners[self.index1][0][2][0] - self.corners[self.index1][0][3][0])) / 2
-
-            #distanceToAR = (knownWidthOfMarker(20cm) * focalLengthOfCamera) / pixelWidthOfMarker
-            distanceToMarker1 = (self.knownMarkerWidth * realFocalLength1) / widthOfMarker1
-            distanceToMarker2 = (self.knownMarkerWidth * realFocalLength2) / widthOfMarker2
-            print(f"1: {distanceToMarker1}, 2: {distanceToMarker2}")
-            self.distanceToMarker = (distanceToMarker1 + distanceToMarker2) / 2
-    
-        return True 
+            print('Found both markers!')
+            self.corners = [found[id1].corners, found[id2].corners]
+            self.index1 = 0
+            self.index2 = 1
+            self._measureGate(found[id1], found[id2])
+        return True
+
+    #Aims between the two gate posts, distance is the average of the two
+    def _measureGate(self, post1, post2):
+        self.angleToMarker = self.degreesPerPixel * ((post1.centerX + post2.centerX)/2 - self.frameWidth/2)
+        print(f"1: {post1.distance}, 2: {post2.distance}")
+        self.distanceToMarker = (post1.distance + post2.distance) / 2
         
     '''
     id1 is the marker you want to look for
@@ -277,10 +450,201 @@ class ARTracker:
     def findMarker(self, id1, id2=-1, cameras=-1):
         if cameras == -1:
             cameras=len(self.caps)
-            
+        ids = {id1} if id2 == -1 else {id1, id2}
+        hits = set()
         for i in range(cameras):
-            ret, frame = self.caps[i].read()
-            if self.markerFound(id1, frame, id2=id2): 
+            cached = self.detectionCache[i]
+            if cached is not None and cached[0] == self.streams[i].seq and cached[1] == id1 and cached[2] == id2:
+                hits.add(i)
+        if self.offload is not None:
+            sent, deadline = self._offloadSubmit(cameras, ids, hits)
+
+        for i in range(cameras):
+            if i in hits:
+                self.cacheHits[i].inc()
+                found = self._restoreDetection(self.detectionCache[i][3])
+            else:
+                if self.offload is not None:
+                    if i not in sent:
+                        continue
+                    seq, timestamp, frame, submitted = sent[i]
+                else:
+                    seq, timestamp, frame = self.streams[i].wait_for_frame()
+                    if frame is None:
+                        continue
+                start = perf_counter()
+                if self.offload is not None:
+                    self.index1 = -1
+                    self.index2 = -1
+                    detections = self._offloadDetect(i, seq, frame, submitted, deadline, ids)
+                    found = self._useFound(detections, id1, id2)
+                    if not found:
+                        self._notFound()
+                else:
+                    mode = self._qualityMode(i, frame)
+                    if mode == 'skip':
+                        found = self._notFound()
+                    else:
+                        found = self.markerFound(id1, frame, id2=id2, cheap=mode == 'cheap')
+                self.detectionLatencies[i].observe(perf_counter() - start)
+                self.thresholdPasses[i].inc(self.passes)
+                self.lastPasses[i].set(self.passes)
+                if found:
+                    self.angleToMarker, self.distanceToMarker = self.toRover(i, self.angleToMarker, self.distanceToMarker)
+                self.detectionCache[i] = (seq, id1, id2, self._saveDetection(found))
+            if found: 
+                self.camera = i
                 return True
 
         return False
+
+    #Looks for every tag in ids (or every tag if ids is None) with one detection pass per camera.
+    #Returns {id: Detection}, each tag comes from the first camera that saw it
+    def findMarkers(self, ids=None, cameras=-1):
+        if cameras == -1:
+            cameras=len(self.caps)
+        key = frozenset(ids) if ids is not None else None
+        hits = set()
+        for i in range(cameras):
+            cached = self.markersCache[i]
+            if cached is not None and cached[0] == self.streams[i].seq and cached[1] == key:
+                hits.add(i)
+        if self.offload is not None:
+            sent, deadline = self._offloadSubmit(cameras, key, hits)
+
+        found = {}
+        for i in range(cameras):
+            if i in hits:
+                self.cacheHits[i].inc()
+                detections = self.markersCache[i][2]
+            else:
+                if self.offload is not None:
+                    if i not in sent:
+                        continue
+                    seq, timestamp, frame, submitted = sent[i]
+                else:
+                    seq, timestamp, frame = self.streams[i].wait_for_frame()
+                    if frame is None:
+                        continue
+                start = perf_counter()
+                if self.offload is not None:
+                    detections = self._offloadDetect(i, seq, frame, submitted, deadline, key)
+                else:
+                    mode = self._qualityMode(i, frame)
+                    if mode == 'skip':
+                        detections = {}
+                        self.passes = 0
+                    else:
+                        detections = self.markersFound(frame, key, cheap=mode == 'cheap')
+                for detection in detections.values():
+                    detection.camera = i
+                    detection.bearing, detection.range = self.toRover(i, detection.angle, detection.distance)
+                    detection.timestamp = timestamp
+                self.detectionLatencies[i].observe(perf_counter() - start)
+                self.thresholdPasses[i].inc(self.passes)
+                self.lastPasses[i].set(self.passes)
+                self.markersCache[i] = (seq, key, detections)
+            for markerID, detection in detections.items():
+                if markerID not in found:
+                    found[markerID] = detection
+            if key is not None and len(found) == len(key):
+                break
+        return found
+
+    #(yaw degrees, forward cm, right cm) of camera i
+    def mount(self, i):
+        return self.mounts[i] if 0 <= i < len(self.mounts) else (0.0, 0.0, 0.0)
+
+    #Turns an angle (degrees) and distance (cm) seen by camera i into a bearing and range from the center
+    #of the rover, so a tag seen by any camera can be steered at directly. A distance of -1 stays -1
+    def toRover(self, i, angle, distance):
+        yaw, forward, right = self.mount(i)
+        if distance < 0:
+            return angle + yaw, distance
+        direction = radians(angle + yaw)
+        forward += distance * cos(direction)
+        right += distance * sin(direction)
+        return degrees(atan2(right, forward)), hypot(forward, right)
+
+    #Tags in camera i's frame from the detection server. If it doesn't answer within the deadline (or isn't
+    #connected) the frame gets decoded and looked at here, only around where tags were last seen if there were any
+    #Sends the newest frame from every camera that isn't in skip to the detection server before waiting on
+    #any of them, so the server has all of them at once and the cameras share one deadline instead of each
+    #waiting out its own. Returns ({camera: (seq, timestamp, frame, whether it went out)}, deadline)
+    def _offloadSubmit(self, cameras, ids, skip):
+        sent = {}
+        for i in range(cameras):
+            if i in skip:
+                continue
+            seq, timestamp, frame = self.streams[i].wait_for_frame()
+            if frame is not None:
+                sent[i] = (seq, timestamp, frame, self.offload.submit(i, seq, timestamp, frame, ids))
+        return sent, monotonic() + self.offloadDeadline
+
+    #The detection server's tags for camera i's frame seq, or the rover's own if they aren't back by deadline
+    def _offloadDetect(self, i, seq, frame, submitted, deadline, ids):
+        detections = None
+        if submitted:
+            results = self.offload.wait_result(i, seq, max(deadline - monotonic(), 0))
+            if results is not None:
+                detections = {}
+                for r in results:
+                    if ids is None or r['id'] in ids:
+                        detections[r['id']] = Detection(r['id'], np.array(r['corners'], np.float32), r['angle'],
+                            r['distance'], r['centerX'], r['centerY'], r['width'])
+                self.passes = 0
+        if detections is None:
+            self.offloadFallbacks[i].inc()
+            image = Offload.decode(frame)
+            mode = self._qualityMode(i, image)
+            if mode == 'skip':
+                detections = {}
+                self.passes = 0
+            else:
+                detections = self._roiDetect(i, image, ids, mode == 'cheap')
+        self.lastCorners[i] = [d.corners for d in detections.values()] or None
+        return detections
+
+    #markersFound on just the part of the image around the tags last seen on camera i, or all of it if there weren't any
+    def _roiDetect(self, i, image, ids, cheap):
+        if not self.lastCorners[i]:
+            return self.markersFound(image, ids, cheap)
+        points = np.concatenate([np.asarray(c).reshape(-1, 2) for c in self.lastCorners[i]])
+        x0, y0 = np.maximum(points.min(axis=0) - self.roiMargin, 0).astype(int)
+        x1, y1 = (points.max(axis=0) + self.roiMargin).astype(int)
+        return self.markersFound(image[y0:y1, x0:x1], ids, cheap, offset=(x0, y0))
+
+    #How much detection a frame from camera i gets: 'full', 'cheap' or 'skip'
+    def _qualityMode(self, i, frame):
+        gate = self.qualityGates[i]
+        if gate is None or gate.check(frame):
+            return 'full'
+        return 'skip' if self.qualityMode == 'skip' else 'cheap'
+
+    #Leaves things the way markerFound does when it doesn't see anything
+    def _notFound(self):
+        self.index1 = -1
+        self.index2 = -1
+        self.passes = 0
+        self.distanceToMarker = -1
+        self.angleToMarker = -999
+        return False
+
+    #Everything markerFound leaves behind, so a cached detection can be put back exactly like it was
+    def _saveDetection(self, found):
+        return (found, getattr(self, 'corners', None), self.index1, self.index2,
+            self.angleToMarker, self.distanceToMarker, self.passes)
+
+    def _restoreDetection(self, saved):
+        (found, self.corners, self.index1, self.index2,
+            self.angleToMarker, self.distanceToMarker, self.passes) = saved
+        return found
+
+    #Stops reading from the cameras and lets them go
+    def release(self):
+        if self.offload is not None:
+            self.offload.stop()
+        for stream in self.streams:
+            stream.stop()
+        for cap in self.caps:
+            cap.release()
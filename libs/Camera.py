@@ -0,0 +1,88 @@
+from threading import Thread, Condition
+from time import monotonic, sleep
+
+from libs import Metrics
+from libs import Layout
+
+# Keeps pulling frames from one camera on its own thread so whoever needs a frame gets a fresh one
+# instead of whatever sat in the driver's buffer. Frames are only grabbed, which for MJPG is just
+# taking the compressed buffer, and only get decoded when someone asks for one, so cameras nobody is
+# looking at don't burn CPU. Every grabbed frame gets a sequence number and the time it came in, so
+# anything worked out from a frame can be tied back to exactly which frame it came from.
+# Only this thread ever touches cap, OpenCV captures aren't safe to share between threads.
+class Camera:
+    def __init__(self, cap, name:str):
+        self.cap = cap
+        self.name = name
+        # sequence number of the newest frame grabbed
+        self.grabbed = 0
+        # (sequence number, monotonic time it was grabbed, frame) of the newest decoded frame,
+        # swapped out whole so readers never see a mix
+        self.latest = (0, 0.0, None)
+        # set by wait_for_frame when it needs a frame decoded, the next grabbed one gets decoded
+        self.wanted = False
+        self.condition = Condition()
+        self.running = False
+        self.thread = None
+        self.frame_rate = Metrics.rate('rover_camera_frames', 'Frames grabbed from the camera', camera=name)
+        self.decoded = Metrics.counter('rover_camera_decoded_total', 'Frames decoded because something asked for them', camera=name)
+        self.read_errors = Metrics.counter('rover_camera_read_errors_total', 'Failed camera reads', camera=name)
+
+    def start(self):
+        self.running = True
+        self.thread = Thread(target=self.read_loop, name=f'camera {self.name}', args=())
+        self.thread.daemon = True
+        self.thread.start()
+        Metrics.watch_thread(self.thread.name)
+
+    def stop(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+
+    def read_loop(self):
+        Layout.enter('vision')
+        while self.running:
+            if not self.cap.grab():
+                self.read_errors.inc()
+                sleep(.01)
+                continue
+            now = monotonic()
+            self.frame_rate.tick()
+            with self.condition:
+                self.grabbed += 1
+                seq = self.grabbed
+                wanted = self.wanted
+                self.wanted = False
+            if not wanted:
+                continue
+            ret, frame = self.cap.retrieve()
+            with self.condition:
+                if ret:
+                    self.decoded.inc()
+                    self.latest = (seq, now, frame)
+                else:
+                    self.read_errors.inc()
+                    # tries again on the next frame
+                    self.wanted = True
+                self.condition.notify_all()
+
+    # Sequence number of the newest frame the camera has, 0 until the first one comes in
+    @property
+    def seq(self):
+        return self.grabbed
+
+    # Blocks until there's a decoded frame newer than after_seq and returns it as (seq, timestamp, frame).
+    # With after_seq None it's the newest frame the camera has, or the first one if nothing has come in yet.
+    # If that frame was never decoded it can't be anymore (the camera thread is already waiting on the
+    # next one) so the next frame gets decoded instead, which can take up to one frame.
+    # The frame is None if it timed out before any frame got decoded
+    def wait_for_frame(self, after_seq:int = None, timeout:float = 1.0):
+        with self.condition:
+            needed = max(self.grabbed, 1) if after_seq is None else after_seq + 1
+            if self.latest[0] < needed:
+                self.wanted = True
+                self.condition.wait_for(lambda: self.latest[0] >= needed or not self.running, timeout)
+            return self.latest
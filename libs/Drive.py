@@ -1,74 +1,163 @@
 from threading import Thread
-from threading import Timer
 import configparser
 import os
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
 import math
-from time import sleep
-from nis import maps
-
+from time import monotonic
 import sys
-sys.path.append('../../Mission Control/RoverMap/')
-from server import MapServer
 
 from libs import UDPOut
-from libs import Location
-from libs import ARTracker
+from libs import Extrapolator
+from libs import Telemetry
+from libs import Search
+from libs import Startup
+from libs import Metrics
+from libs import Layout
+from libs import Maneuver
+
+#The map server lives in the Mission Control repo next to this one
+mapServerPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../Mission Control/RoverMap/')
+configPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../config.ini')
 
 class Drive:
     
-    def __init__(self, baseSpeed, cameras):
+    #timeline is an optional Startup.Timeline to record startup phases in
+    def __init__(self, baseSpeed, cameras, timeline=None):
         self.baseSpeed = baseSpeed
-        self.tracker = ARTracker.ARTracker(cameras)
-        
-        #Starts everything needed by the map
-        self.mapServer = MapServer()
-        self.mapServer.register_routes()
-        self.mapServer.start(debug=False)
-        self.startMap(self.updateMap, .5)
-        sleep(.1)
+        self.timeline = timeline if timeline is not None else Startup.Timeline()
 
         #sets up the parser
         config = configparser.ConfigParser(allow_no_value=True)
-        config.read(os.path.dirname(__file__) + '/../config.ini')
+        config.read(configPath)
         
         #parses config
         self.mbedIP = str(config['CONFIG']['MBED_IP'])
         self.mbedPort = int(config['CONFIG']['MBED_PORT'])
         swiftIP = str(config['CONFIG']['SWIFT_IP'])
         swiftPort = str(config['CONFIG']['SWIFT_PORT'])
-        self.gps = Location.Location(swiftIP, swiftPort)
-        self.gps.start_GPS()
+
+        #keeps detection off the cores sending wheel speeds, see [LAYOUT]. The main thread runs detection
+        Layout.configure(config)
+        Layout.enter('vision')
+
+        #serves the metrics so the base station can watch them live, a port of 0 turns it off
+        self.metricsFile = config['METRICS'].get('DUMP_FILE')
+        metricsPort = int(config['METRICS']['PORT'])
+        if metricsPort:
+            try:
+                Metrics.serve(metricsPort, config['METRICS']['HOST'])
+            except OSError as e:
+                print("Couldn't start the metrics server:", e)
+        self.controlLoop = Metrics.rate('rover_control_loop', 'Driving control loop')
+        self.gateSettings = {
+            'approach': float(config['GATE']['APPROACH_DISTANCE']),
+            'through': float(config['GATE']['THROUGH_DISTANCE']),
+            'arrive': float(config['GATE']['ARRIVE_DISTANCE']),
+        }
+        self.gateTimeout = float(config['GATE']['TIMEOUT'])
+        self.speedLoop = Metrics.rate('rover_wheel_commands', 'Wheel speeds sent to the mbeds')
+
+        #The cameras, GPS and map don't depend on each other so they all get brought up at once.
+        #Their heavy imports (cv2, the gps library, flask) happen in there too so those overlap as well
+        started = self.timeline.run_parallel({
+            'cameras': lambda: self.startCameras(cameras),
+            'gps': lambda: self.startGPS(swiftIP, swiftPort),
+            'map server': self.startMapServer,
+        })
+        self.tracker = started['cameras']
+        self.gps = started['gps']
+        self.mapServer = started['map server']
+
+        #fills in the position between fixes so distance and bearing checks aren't tied to fix timing
+        self.predictor = Extrapolator.Extrapolator(self.gps, float(config['PREDICTION']['WHEEL_SCALE']),
+            float(config['PREDICTION']['TRACK_WIDTH']), float(config['PREDICTION']['MAX_HORIZON']))
+        self.gps.predictor = self.predictor
+
+        #only sends the map new points when the rover actually moved or turned, from its own thread
+        self.telemetry = Telemetry.TelemetryPublisher(self.updateMap, float(config['TELEMETRY']['MIN_DISTANCE']),
+            float(config['TELEMETRY']['MIN_HEADING']), float(config['TELEMETRY']['MAX_INTERVAL']),
+            int(config['TELEMETRY']['BATCH_SIZE']), float(config['TELEMETRY']['TOLERANCE']))
+        self.gps.add_fix_callback(self.telemetry.on_fix)
+
+        #the fix callbacks all run on the GPS thread so it's the only one ticking this
+        fixRate = Metrics.rate('rover_gps_fix', 'New GPS fixes')
+        self.gps.add_fix_callback(lambda fix: fixRate.tick())
+        Metrics.gauge('rover_gps_fix_age_seconds', 'Seconds since the last GPS fix', function=lambda: self.gps.fix.age())
+        for name in ('send wheel speeds', 'update GPS fields', 'telemetry publisher'):
+            Metrics.watch_thread(name)
+
+        #spaces the search legs off of how much ground the cameras can actually see
+        self.searchPattern = config['SEARCH']['PATTERN']
+        self.searchRadius = float(config['SEARCH']['MAX_RADIUS'])
+        hfov = float(config['ARTRACKER']['DEGREES_PER_PIXEL']) * int(config['ARTRACKER']['FRAME_WIDTH'])
+        self.searchSpacing = Search.leg_spacing(hfov, float(config['SEARCH']['DETECTION_RANGE']),
+            float(config['SEARCH']['OVERLAP']))
         
         self.speeds = [0,0]
         self.errorAccumulation = 0.0
+        #set by abort() to stop whatever the rover is doing
+        self.aborted = False
         
         #starts the thread that sends wheel speeds
         self.running = True
         t = Thread(target=self.sendSpeed, name=('send wheel speeds'), args=())
         t.daemon = True
         t.start()
+        #whatever else got started, like the map server's threads, goes with the io threads
+        Layout.apply_all('io')
+        self.timeline.report()
+        Layout.report()
 
-        
-    def startMap(self, func, seconds):
-        def func_wrapper():
-            self.startMap(func, seconds)
-            func()
-        t = Timer(seconds, func_wrapper)
-        t.start()
-        return t
+    #Opens every camera, cv2 only gets imported here
+    def startCameras(self, cameras):
+        from libs import ARTracker
+        return ARTracker.ARTracker(cameras, configFile=configPath)
+
+    #Connects to the GPS
+    def startGPS(self, swiftIP, swiftPort):
+        from libs import Location
+        gps = Location.Location(swiftIP, swiftPort)
+        gps.start_GPS()
+        return gps
 
-    def updateMap(self):
-        self.mapServer.update_rover_coords([self.gps.latitude, self.gps.longitude])
+    #Starts everything needed by the map
+    def startMapServer(self):
+        if mapServerPath not in sys.path:
+            sys.path.append(mapServerPath)
+        from server import MapServer
+        mapServer = MapServer()
+        mapServer.register_routes()
+        mapServer.start(debug=False)
+        return mapServer
+
+    #Writes the current metrics to the file set in the config, if there is one
+    def dumpMetrics(self):
+        if self.metricsFile:
+            Metrics.dump(self.metricsFile)
+            print("Metrics written to", self.metricsFile)
+
+    #Sends a telemetry payload to the map, runs on the telemetry thread
+    def updateMap(self, payload):
+        #newer map servers can take everything at once
+        if hasattr(self.mapServer, 'update_telemetry'):
+            self.mapServer.update_telemetry(payload)
+            return
+        #otherwise the simplified trail goes out point by point so the map still draws the path
+        for coords in payload['trail']:
+            self.mapServer.update_rover_coords(coords)
+        if not payload['trail']:
+            self.mapServer.update_rover_coords(payload['coords'])
 
 
     #Every 100ms, send the current left and right wheel speeds to the mbeds
     def sendSpeed(self):
+        Layout.enter('control')
         while self.running:
             ls = int(self.speeds[0])
             rs = int(self.speeds[1])
             UDPOut.sendWheelSpeeds(self.mbedIP, self.mbedPort, ls,ls,ls, rs,rs,rs)
-            sleep(.1)
+            self.predictor.set_wheel_speeds(ls, rs)
+            self.speedLoop.tick()
+            Layout.sleep(.1)
     
     #time in milliseconds
     #error in degrees
@@ -132,6 +221,41 @@ class Drive:
     
         return values
         
+    #Stops the current mission as soon as the control loop sees it, safe to call from any thread
+    def abort(self):
+        self.aborted = True
+
+    #Runs a maneuver from the control loop. Every tick check() gets called (if given) and if it returns
+    #something truthy the maneuver ends right there. Returns what check returned, "aborted" if abort()
+    #was called, or None if the maneuver ran all the way through
+    def runManeuver(self, maneuver, check=None, period=.1):
+        maneuver.start()
+        while True:
+            if self.aborted:
+                maneuver.stop("aborted")
+                self.speeds = [0,0]
+                return "aborted"
+            speeds = maneuver.step()
+            if speeds is None:
+                return None
+            self.speeds = list(speeds)
+            if check is not None:
+                result = check()
+                if result:
+                    maneuver.stop(result)
+                    return result
+            Layout.sleep(period)
+            self.controlLoop.tick()
+
+    #Stops and records that the marker(s) were found
+    def markerSeen(self, id1, id2):
+        self.gps.stop_GPS_thread()
+        print('Found Marker!')
+        self.speeds = [0,0]
+        self.telemetry.add_detection({'id': id1, 'id2': id2, 'distance': self.tracker.distanceToMarker,
+            'angle': self.tracker.angleToMarker, 'coords': [self.gps.latitude, self.gps.longitude]})
+        self.telemetry.set_state("found marker")
+
     #Cleaner way to print out the wheel speeds
     def printSpeeds(self):
         print("Left wheels: ", round(self.speeds[0],1))
@@ -139,72 +263,108 @@ class Drive:
     
     #Drives along a given list of GPS coordinates while looking for the given ar markers
     #Keep id2 at -1 if looking for one post, set id1 to -1 if you aren't looking for AR markers 
-    def driveAlongCoordinates(self, locations, id1, id2=-1):
+    #Set optimize to True to reorder the locations for the shortest drive from where the rover is,
+    #pinFirst and pinLast keep the first and last locations where they are
+    def driveAlongCoordinates(self, locations, id1, id2=-1, optimize=False, pinFirst=False, pinLast=False):
         #Starts the GPS
         self.gps.start_GPS_thread()
         print('Waiting for GPS connection...')
-        #while self.gps.all_zero: 
-        #    continue
-        print('Connected to GPS')
+        connected = self.gps.wait_for_fix(timeout=5) is not None
+        #Fixes the local frame and projects the waypoints once so the loop only does flat math.
+        #Done after the first fix so the rover's position is projected from a real one
+        projected = self.gps.start_mission(locations)
+        if not connected:
+            print('No GPS fix yet, continuing anyway')
+        else:
+            print('Connected to GPS')
+            if optimize and len(locations) > 2:
+                #numpy only gets imported if the route actually gets optimized
+                from libs import Route
+                fix = self.gps.fix
+                locations = Route.optimize(locations, projected, (fix.east, fix.north), pinFirst, pinLast)
         
-        #backs up and turns to avoid running into the last detected sign. Also allows it to get a lock on heading
+        #backs up and turns to avoid running into the last detected sign. Also allows it to get a lock on heading.
+        #Keeps looking for the marker and checking for the first location the whole time and stops early for either
         if(id1 > -1):
-            self.speeds = [-60,-60]
-            self.printSpeeds()
-            sleep(2)
-            self.speeds = [0,0]
-            self.printSpeeds()
-            sleep(2)
-            self.speeds = [80,20]
-            self.printSpeeds()
-            sleep(4)
+            maneuver = Maneuver.Maneuver(Maneuver.back_up(60, 2), Maneuver.hold(2), Maneuver.turn(80, 20, 4))
         else:
-            self.speeds = (self.baseSpeed, self.baseSpeed)
-            self.printSpeeds()
-            sleep(3)
+            maneuver = Maneuver.Maneuver(Maneuver.straight(self.baseSpeed, 3))
+        def check():
+            if id1 != -1 and self.tracker.findMarker(id1, id2):
+                return "marker"
+            if len(locations) > 0 and self.gps.distance_to(locations[0][0], locations[0][1]) <= .0025:
+                return "arrived"
+            return None
+        result = self.runManeuver(maneuver, check)
+        if result == "marker":
+            self.markerSeen(id1, id2)
+            return True
+        if result == "aborted":
+            self.telemetry.set_state("aborted")
+            return False
 
         #navigates to each location
-        for l in locations:
+        if self.driveToLocations(locations, id1, id2, "waypoint"):
+            return True
+
+        #didn't see the marker on the way, so searches around the last location while still looking for it
+        if id1 != -1 and len(locations) > 0 and self.searchPattern != "none":
+            print('Made it to location without seeing marker(s), searching')
+            search = Search.search_locations(self.gps.frame, locations[-1][0], locations[-1][1],
+                self.searchPattern, self.searchSpacing, self.searchRadius)
+            if self.driveToLocations(search, id1, id2, "search point"):
+                return True
+
+        self.gps.stop_GPS_thread()
+        print('Made it to location without seeing marker(s)')
+        self.speeds = [0,0]
+        self.telemetry.set_state("arrived without seeing marker")
+        return False
+
+    #Drives to each location in order, returns True as soon as the marker(s) are seen
+    def driveToLocations(self, locations, id1, id2, name):
+        for i, l in enumerate(locations):
             self.errorAccumulation = 0
+            self.telemetry.set_state(f"driving to {name} {i + 1} of {len(locations)}")
             while self.gps.distance_to(l[0], l[1]) > .0025: #.0025km
+                if self.aborted:
+                    self.speeds = [0,0]
+                    self.telemetry.set_state("aborted")
+                    return False
                 bearingTo = self.gps.bearing_to(l[0], l[1])
                 print(self.gps.distance_to(l[0], l[1]) )
                 self.speeds = self.getSpeeds(self.baseSpeed, bearingTo, 100) #It will sleep for 100ms
-                sleep(.1) #Sleeps for 100ms
+                Layout.sleep(.1) #Sleeps for 100ms
+                self.controlLoop.tick()
                 self.printSpeeds()
                 
                 if(id1 != -1 and self.tracker.findMarker(id1, id2)):
-                    self.gps.stop_GPS_thread()
-                    print('Found Marker!')
-                    self.speeds = [0,0]
+                    self.markerSeen(id1, id2)
                     return True
-                    
-        self.gps.stop_GPS_thread()
-        print('Made it to location without seeing marker(s)')
-        self.speeds = [0,0]
         return False
                 
     def trackARMarker(self, id1, id2=-1):
         stopDistance = 350 #stops when 250cm from markers TODO make sure rover doesn't stop too far away with huddlys
         timesNotFound = -1
-        self.tracker.findMarker(id1, id2, cameras=1) #Gets and initial angle from the main camera
+        self.telemetry.set_state("tracking marker")
+        self.tracker.findMarker(id1, id2) #Gets an initial angle from whichever camera sees it
         self.errorAccumulation = 0
            
         count = 0
-        #Centers the middle camera with the tag
+        #Centers the middle camera with the tag. Angles are from the center of the rover no matter
+        #which camera saw the tag, so a side camera sighting turns the rover straight at it
         while self.tracker.angleToMarker > 14 or self.tracker.angleToMarker < -14:
-            if self.tracker.findMarker(id1, id2, cameras=1): #Only looking with the center camera right now
-                if timesNotFound == -1:
-                    self.speeds = [0,0]
-                    sleep(.5)
-                    self.speeds = [self.baseSpeed, self.baseSpeed]
-                    sleep(.8)
+            if self.tracker.findMarker(id1, id2):
+                if timesNotFound == -1 and self.tracker.camera == 0:
+                    #stops and creeps forward, still watching the tag so it can stop as soon as it's centered
+                    self.runManeuver(Maneuver.Maneuver(Maneuver.hold(.5), Maneuver.straight(self.baseSpeed, .8)),
+                        lambda: self.tracker.findMarker(id1, id2) and -14 <= self.tracker.angleToMarker <= 14)
                     self.speeds = [0,0]
                 else:
                     self.speeds = self.getSpeeds(0, self.tracker.angleToMarker, 100)
                 print(self.tracker.angleToMarker, " ", self.tracker.distanceToMarker)
                 timesNotFound = 0
-            elif timesNotFound == -1: #Never seen the tag with the main camera
+            elif timesNotFound == -1: #No camera has seen the tag yet
                 if(math.ceil(int(count/20)/5) % 2 == 1):
                     self.speeds = [self.baseSpeed+5,-self.baseSpeed-5]
                 else:
@@ -218,10 +378,17 @@ class Drive:
                 timesNotFound = -1
                 #return False
             self.printSpeeds()
-            sleep(.1)
+            Layout.sleep(.1)
+            self.controlLoop.tick()
             count+=1
-        self.speeds = [0,0]
-        sleep(.5)
+            if self.aborted:
+                self.speeds = [0,0]
+                self.telemetry.set_state("aborted")
+                return False
+        self.runManeuver(Maneuver.Maneuver(Maneuver.hold(.5)))
+        if self.aborted:
+            self.telemetry.set_state("aborted")
+            return False
             
         if id2 == -1:            
             self.errorAccumulation = 0
@@ -229,6 +396,10 @@ class Drive:
             
             #Tracks down the tag
             while self.tracker.distanceToMarker > stopDistance or self.tracker.distanceToMarker == -1: #-1 means we lost the tag
+                if self.aborted:
+                    self.speeds = [0,0]
+                    self.telemetry.set_state("aborted")
+                    return False
                 markerFound = self.tracker.findMarker(id1, cameras = 1) #Looks for the tag
                 
                 if self.tracker.distanceToMarker > stopDistance:
@@ -243,43 +414,82 @@ class Drive:
                 elif self.tracker.distanceToMarker == -1:
                     self.speeds = [0,0]
                     print("Lost tag")
+                    self.telemetry.set_state("lost tag")
                     return False #TODO this is bad
                 
                 self.printSpeeds()
-                sleep(.1)
+                Layout.sleep(.1)
+                self.controlLoop.tick()
             
             #We scored!
             self.speeds = [0,0]
             print("In range of the tag!")
+            self.telemetry.set_state("in range of the tag")
             return True
         else:
-            #Gets the coords to the point that is 4m infront of the gate posts (get_coordinates expects distance in km)
-            coords = self.gps.get_coordinates(self.tracker.distanceToMarker/100000.0+.004, self.tracker.angleToMarker)
-            
-            self.speeds = [self.baseSpeed, self.baseSpeed]
-            sleep(5)
-            
-            #TODO: test this more after getting the new GPS
-            '''
-            #Rover hasn't been moving for a bit so moves to get correct bearing
-            self.speeds = [-self.baseSpeed, -self.baseSpeed]
-            self.printSpeeds()
-            sleep(2)
-            self.speeds = [0,0]
-            self.printSpeeds()
-            sleep(1)
-            self.speeds = [self.baseSpeed, self.baseSpeed]
+            return self.driveThroughGate(id1, id2)
+
+    #Drives through the gate made by tags id1 and id2. Every new frame from the main camera updates where
+    #the posts are and the rover steers for the point in front of the gate, then the point past it
+    def driveThroughGate(self, id1, id2):
+        #Gate needs cv2, which only gets imported once the cameras are up (see startCameras)
+        from libs import Gate
+        self.telemetry.set_state("driving through gate")
+        #the GPS thread got stopped when the gate was first seen, the pose has to keep updating from here
+        if not self.gps.running:
+            self.gps.start_GPS_thread()
+        tracker = self.tracker
+        matrix = Gate.camera_matrix(tracker.degreesPerPixel, tracker.vDegreesPerPixel, tracker.frameWidth, tracker.frameHeight)
+        gate = Gate.GateTracker(id1, id2, tracker.knownMarkerWidth, matrix, mounts=tracker.mounts, **self.gateSettings)
+        self.errorAccumulation = 0
+
+        start = monotonic()
+        lastTick = start
+        seq = 0
+        timesNotFound = 0
+        while not gate.passed:
+            if self.aborted:
+                self.speeds = [0,0]
+                self.telemetry.set_state("aborted")
+                return False
+            if monotonic() - start > self.gateTimeout:
+                self.speeds = [0,0]
+                print("Couldn't get through the gate in time")
+                self.telemetry.set_state("gate timed out")
+                return False
+
+            #runs once per frame from the main camera
+            seq = tracker.streams[0].wait_for_frame(seq, .2)[0]
+            detections = tracker.findMarkers([id1, id2], cameras=1)
+            #the posts get placed from where the rover was when the frame was read, not where it is now
+            frameTime = next(iter(detections.values())).timestamp if detections else None
+            if gate.update(detections, self.gps.pose(frameTime)):
+                timesNotFound = 0
+            else:
+                timesNotFound += 1
+            east, north, heading = self.gps.pose()
+            now = monotonic()
+            elapsed = (now - lastTick) * 1000
+            lastTick = now
+
+            target = gate.target(east, north)
+            if target is not None:
+                bearingTo = (math.degrees(math.atan2(target[0] - east, target[1] - north)) - heading + 180) % 360 - 180
+                self.speeds = self.getSpeeds(self.baseSpeed, bearingTo, elapsed)
+                print(f"Heading for the gate's {gate.phase} point, {math.hypot(target[0] - east, target[1] - north):.1f}m away at {bearingTo:.0f} degrees")
+            elif not gate.passed:
+                #hasn't seen both posts yet
+                self.speeds = [0,0]
+                if timesNotFound > 30:
+                    print("Lost the gate")
+                    self.telemetry.set_state("lost gate")
+                    return False
             self.printSpeeds()
-            sleep(2)
-            
-            #Drives to the calculated location
-            while self.gps.distance_to(coords[0], coords[1]) > .003: #TODO: might want to adjust distance here...
-                bearingTo = self.gps.bearing_to(coords[0], coords[1])
-                print(self.gps.distance_to(coords[0], coords[1]) )
-                self.speeds = self.getSpeeds(self.baseSpeed, bearingTo, 100) #It will sleep for 100ms
-                sleep(.1) #Sleeps for 100ms
-                self.printSpeeds()
-            '''
+            self.controlLoop.tick()
+
+        self.speeds = [0,0]
+        self.telemetry.set_state("through the gate")
+        return True
                         
         
          
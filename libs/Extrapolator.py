@@ -0,0 +1,112 @@
+from math import sin, cos, radians, degrees
+from threading import Lock
+from time import monotonic
+
+# A predicted pose in the mission's local frame
+class Prediction:
+    __slots__ = ('east', 'north', 'heading', 'age')
+
+    def __init__(self, east:float, north:float, heading:float, age:float):
+        self.east = east
+        self.north = north
+        # degrees, 0 is North and positive is clockwise like Fix.bearing
+        self.heading = heading
+        # seconds between the fix this came from and the time it was predicted for
+        self.age = age
+
+# Wraps an angle in degrees to (-180, 180]
+def wrap(angle:float):
+    while angle > 180:
+        angle -= 360
+    while angle <= -180:
+        angle += 360
+    return angle
+
+# Fills in the rover's pose between GPS fixes.
+# Velocity comes from the fixes, yaw rate comes from the wheel commands when there are
+# any newer than the last fix (since they react right away) and from the fixes otherwise.
+# The pose is rolled forward from the last fix with a constant speed and turn rate.
+class Extrapolator:
+    # wheel_scale is m/s of ground speed per unit of wheel speed (the -90 to 90 sent to the mbeds)
+    # track_width is the distance in meters between the left and right wheels
+    # max_horizon is how many seconds past a fix we're willing to extrapolate
+    # min_speed is the speed in m/s below which the fixes' heading isn't trusted for a yaw rate
+    def __init__(self, gps, wheel_scale:float = .011, track_width:float = .9, max_horizon:float = 2.0, min_speed:float = .3):
+        self.gps = gps
+        self.min_speed = min_speed
+        self.wheel_scale = wheel_scale
+        self.track_width = track_width
+        self.max_horizon = max_horizon
+        self.lock = Lock()
+
+        self.fix = None
+        self.speed = 0.0
+        self.fix_yaw_rate = 0.0
+        # latest commanded speeds as (left, right, time)
+        self.command = None
+        gps.add_fix_callback(self.on_fix)
+
+    # Called from the GPS thread for every new fix
+    def on_fix(self, fix):
+        with self.lock:
+            previous = self.fix
+            self.fix = fix
+            if previous is None:
+                return
+            dt = fix.received - previous.received
+            if dt <= 0:
+                return
+            # the receiver's speed is better than differencing when it has one
+            if fix.speed is not None:
+                self.speed = fix.speed
+            else:
+                self.speed = ((fix.east - previous.east) ** 2 + (fix.north - previous.north) ** 2) ** .5 / dt
+            # heading from a rover that's barely moving is mostly noise
+            if self.speed >= self.min_speed:
+                self.fix_yaw_rate = wrap(fix.bearing - previous.bearing) / dt
+            else:
+                self.fix_yaw_rate = 0.0
+
+    # Called every time the wheel speeds get sent out
+    def set_wheel_speeds(self, left:float, right:float):
+        self.command = (left, right, monotonic())
+
+    # Yaw rate in degrees/s a pair of wheel speeds should give, positive is turning right
+    def wheel_yaw_rate(self, left:float, right:float):
+        return degrees((left - right) * self.wheel_scale / self.track_width)
+
+    # Predicts the pose at the given time.monotonic() time (now by default)
+    # Returns None until there's a fix to predict from
+    def predict(self, now:float = None):
+        if now is None:
+            now = monotonic()
+        with self.lock:
+            fix = self.fix
+            speed = self.speed
+            yaw_rate = self.fix_yaw_rate
+        if fix is None:
+            return None
+
+        command = self.command
+        if command is not None and command[2] >= fix.received:
+            left, right, _ = command
+            yaw_rate = self.wheel_yaw_rate(left, right)
+            # stopping shows up in the commands long before it shows up in the fixes
+            if left == 0 and right == 0:
+                speed = 0.0
+
+        age = now - fix.received
+        dt = min(max(age, 0.0), self.max_horizon)
+        heading = fix.bearing
+        theta = radians(heading)
+        turn = radians(yaw_rate) * dt
+        if abs(turn) < 1e-6:
+            distance = speed * dt
+            east = fix.east + distance * sin(theta)
+            north = fix.north + distance * cos(theta)
+        else:
+            # moving along a circular arc at a constant speed and turn rate
+            radius = speed * dt / turn
+            east = fix.east + radius * (cos(theta) - cos(theta + turn))
+            north = fix.north + radius * (sin(theta + turn) - sin(theta))
+        return Prediction(east, north, wrap(heading + degrees(turn)), age)
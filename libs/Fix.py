@@ -0,0 +1,98 @@
+from threading import Condition
+from time import monotonic
+
+# One position fix from the GPS. Fixes are immutable so a reader always sees
+# the latitude, longitude and bearing that came from the same message, new fixes
+# are published by swapping the whole object instead of writing fields one by one.
+class Fix:
+    __slots__ = ('latitude', 'longitude', 'height', 'time', 'error', 'bearing',
+                 'east', 'north', 'received', 'speed', 'course', 'hdop', 'satellites', 'quality')
+
+    def __init__(self, latitude=0.0, longitude=0.0, height=0.0, time=0, error=0, bearing=0.0,
+                 east=0.0, north=0.0, received=None, speed=None, course=None, hdop=None,
+                 satellites=None, quality=None):
+        set_field = object.__setattr__
+        set_field(self, 'latitude', latitude)
+        set_field(self, 'longitude', longitude)
+        set_field(self, 'height', height)
+        set_field(self, 'time', time)
+        set_field(self, 'error', error)
+        set_field(self, 'bearing', bearing)
+        # position in meters in the mission's local frame (0 if no origin is set)
+        set_field(self, 'east', east)
+        set_field(self, 'north', north)
+        # time.monotonic() when the fix came in from the receiver
+        set_field(self, 'received', monotonic() if received is None else received)
+        # ground speed (m/s) and true course (degrees) if the receiver reports them
+        set_field(self, 'speed', speed)
+        set_field(self, 'course', course)
+        # fix quality info, None if the receiver doesn't report it
+        set_field(self, 'hdop', hdop)
+        set_field(self, 'satellites', satellites)
+        set_field(self, 'quality', quality)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Fix is immutable, use replace() to make a changed copy")
+
+    def __delattr__(self, name):
+        raise AttributeError("Fix is immutable")
+
+    # Returns a copy of this fix with the given fields changed
+    def replace(self, **changes):
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return Fix(**fields)
+
+    # Seconds since the fix came in
+    def age(self, now:float = None):
+        return (monotonic() if now is None else now) - self.received
+
+    def __repr__(self):
+        return 'Fix(' + ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__) + ')'
+
+
+# Hands out the latest fix and wakes up anyone waiting for the next one.
+# Readers either grab .fix, block in wait() or register a callback.
+class FixPublisher:
+    def __init__(self):
+        self.fix = Fix(received=0.0)
+        # number of fixes published so far, used to tell if a fix is new
+        self.count = 0
+        self.condition = Condition()
+        self.callbacks = []
+
+    # Swaps in a new fix, wakes up waiters and runs the callbacks
+    def publish(self, fix:Fix):
+        return self.update(lambda previous: fix)
+
+    # Builds the next fix out of the current one with the lock held, so nothing published in between
+    # gets overwritten, then wakes up waiters and runs the callbacks. With new_fix False it's the same
+    # fix re-expressed (like after moving the origin) and doesn't count as a new one for wait()
+    def update(self, build, new_fix:bool = True):
+        with self.condition:
+            fix = build(self.fix)
+            self.fix = fix
+            if new_fix:
+                self.count += 1
+            self.condition.notify_all()
+        # callbacks run on the GPS thread so they should be quick
+        for callback in self.callbacks:
+            callback(fix)
+        return fix
+
+    # Blocks until a fix newer than the given count comes in (or any new fix if count is None)
+    # Returns the fix or None if it timed out
+    def wait(self, count:int = None, timeout:float = None):
+        with self.condition:
+            if count is None:
+                count = self.count
+            if not self.condition.wait_for(lambda: self.count > count, timeout):
+                return None
+            return self.fix
+
+    def subscribe(self, callback):
+        self.callbacks.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.callbacks:
+            self.callbacks.remove(callback)
@@ -0,0 +1,188 @@
+from math import sin, cos, tan, radians, hypot, sqrt
+
+import cv2
+import numpy as np
+
+from libs import Metrics
+
+# Keeps track of where both posts of a gate are in the mission's local frame (meters east and north)
+# while the rover drives at it. Every frame each post's tag gets its own solvePnP, which is put into
+# the local frame with the rover's pose and averaged into that post's estimate weighted by how far away
+# the tag was, since far tags are much less reliable. From the two posts it works out an approach
+# point in front of the gate and a point past it, which move as the estimates settle.
+
+# Pinhole camera matrix that matches the degrees per pixel ARTracker uses for angles
+def camera_matrix(degrees_per_pixel:float, vdegrees_per_pixel:float, width:int, height:int):
+    fx = 1 / tan(radians(degrees_per_pixel))
+    fy = 1 / tan(radians(vdegrees_per_pixel))
+    return np.array([[fx, 0, width / 2], [0, fy, height / 2], [0, 0, 1]], dtype=np.float64)
+
+# Where one post is believed to be
+class Post:
+    __slots__ = ('east', 'north', 'variance', 'updates', 'misses')
+
+    def __init__(self):
+        self.east = 0.0
+        self.north = 0.0
+        # meters squared, how unsure the estimate is
+        self.variance = 0.0
+        self.updates = 0
+        # sightings in a row that were too far off the estimate to use
+        self.misses = 0
+
+    def __repr__(self):
+        return f"Post({self.east:.2f}, {self.north:.2f}, +/-{sqrt(self.variance):.2f}m, {self.updates} updates)"
+
+class GateTracker:
+    # tag_width is in cm like KNOWN_TAG_WIDTH. approach and through are how many meters in front of
+    # and past the gate the waypoints go, arrive is how close to one counts as being there.
+    # A sighting's noise is min_noise + range_noise * range^2 meters, drift is how much the estimates
+    # are allowed to wander each update (the rover's pose drifts). Sightings more than outlier
+    # standard deviations off are thrown out, max_misses of those in a row starts that post over.
+    # mounts is each camera's (yaw degrees, forward cm, right cm) like ARTracker.mounts
+    def __init__(self, id1:int, id2:int, tag_width:float, matrix, approach:float = 2.0, through:float = 2.0,
+            arrive:float = .75, min_noise:float = .1, range_noise:float = .02, drift:float = .02,
+            outlier:float = 3.0, max_misses:int = 5, mounts = ()):
+        self.ids = (id1, id2)
+        self.matrix = matrix
+        self.mounts = list(mounts)
+        self.distortion = np.zeros(5)
+        half = tag_width / 200.0
+        # aruco's corner order (top left, top right, bottom right, bottom left) with the tag's center at 0
+        self.tag_points = np.array([[-half, half, 0], [half, half, 0], [half, -half, 0], [-half, -half, 0]], dtype=np.float64)
+        self.approach = approach
+        self.through = through
+        self.arrive = arrive
+        self.min_noise = min_noise
+        self.range_noise = range_noise
+        self.drift = drift
+        self.outlier = outlier
+        self.max_misses = max_misses
+
+        self.posts = {id1: Post(), id2: Post()}
+        # which way through the gate, fixed the first time both posts are known so it
+        # doesn't flip once the rover crosses the line
+        self.side = 0
+        # 'approach' then 'through' then 'passed'
+        self.phase = 'approach'
+        self.outliers = Metrics.counter('rover_gate_outliers_total', 'Gate post sightings too far off to use')
+
+    # Where the tag is from the center of the rover as (meters forward, meters right), None if solvePnP couldn't do it
+    def locate(self, corners, camera:int = -1):
+        image_points = np.asarray(corners, dtype=np.float64).reshape(4, 2)
+        ok, rvec, tvec = cv2.solvePnP(self.tag_points, image_points, self.matrix, self.distortion,
+            flags=cv2.SOLVEPNP_IPPE_SQUARE)
+        if not ok or tvec[2][0] <= 0:
+            return None
+        forward, right = tvec[2][0], tvec[0][0]
+        if 0 <= camera < len(self.mounts):
+            yaw, mount_forward, mount_right = self.mounts[camera]
+            y = radians(yaw)
+            forward, right = (mount_forward / 100 + forward * cos(y) - right * sin(y),
+                              mount_right / 100 + forward * sin(y) + right * cos(y))
+        return forward, right
+
+    # Adds this frame's sightings. detections is {id: Detection} like ARTracker.findMarkers gives and
+    # pose is the rover's (east, north, heading) when the frame was taken. Returns how many posts got updated
+    def update(self, detections, pose):
+        east, north, heading = pose
+        h = radians(heading)
+        updated = 0
+        for post_id, post in self.posts.items():
+            detection = detections.get(post_id)
+            if detection is None:
+                continue
+            located = self.locate(detection.corners, detection.camera)
+            if located is None:
+                continue
+            forward, right = located
+            measured_east = east + forward * sin(h) + right * cos(h)
+            measured_north = north + forward * cos(h) - right * sin(h)
+            noise = (self.min_noise + self.range_noise * (forward * forward + right * right)) ** 2
+            if self._fuse(post, measured_east, measured_north, noise):
+                updated += 1
+        return updated
+
+    # Kalman update of a post that isn't moving
+    def _fuse(self, post, east:float, north:float, noise:float):
+        if post.updates == 0:
+            post.east, post.north, post.variance = east, north, noise
+            post.updates = 1
+            return True
+
+        post.variance += self.drift * self.drift
+        off = hypot(east - post.east, north - post.north)
+        if post.updates >= 3 and off > self.outlier * sqrt(post.variance + noise):
+            self.outliers.inc()
+            post.misses += 1
+            if post.misses >= self.max_misses:
+                # the estimate itself was off, like from a bad first look, so it starts over from here
+                print(f"Gate post estimate was off by {off:.1f}m, starting it over")
+                post.east, post.north, post.variance = east, north, noise
+                post.updates = 1
+                post.misses = 0
+                return True
+            return False
+
+        gain = post.variance / (post.variance + noise)
+        post.east += gain * (east - post.east)
+        post.north += gain * (north - post.north)
+        post.variance *= 1 - gain
+        post.updates += 1
+        post.misses = 0
+        return True
+
+    @property
+    def ready(self):
+        return all(post.updates > 0 for post in self.posts.values())
+
+    # (midpoint, unit normal pointing through the gate from the rover's side, width in meters) or None
+    # until both posts have been seen. east and north are where the rover is, used the first time to pick the side
+    def line(self, east:float, north:float):
+        if not self.ready:
+            return None
+        first, second = (self.posts[i] for i in self.ids)
+        mid_east = (first.east + second.east) / 2
+        mid_north = (first.north + second.north) / 2
+        width = hypot(second.east - first.east, second.north - first.north)
+        if width == 0:
+            return None
+        normal_east = (second.north - first.north) / width
+        normal_north = -(second.east - first.east) / width
+        if self.side == 0:
+            # points away from the rover
+            self.side = 1 if (mid_east - east) * normal_east + (mid_north - north) * normal_north >= 0 else -1
+        return (mid_east, mid_north), (normal_east * self.side, normal_north * self.side), width
+
+    # The approach point in front of the gate and the point past it, as ((east, north), (east, north))
+    def waypoints(self, east:float, north:float):
+        line = self.line(east, north)
+        if line is None:
+            return None
+        (mid_east, mid_north), (normal_east, normal_north), _ = line
+        return ((mid_east - normal_east * self.approach, mid_north - normal_north * self.approach),
+                (mid_east + normal_east * self.through, mid_north + normal_north * self.through))
+
+    # Point the rover should head for right now, None until both posts have been seen or once it's through
+    def target(self, east:float, north:float):
+        points = self.waypoints(east, north)
+        if points is None or self.phase == 'passed':
+            return None
+        approach, through = points
+        if self.phase == 'approach' and hypot(approach[0] - east, approach[1] - north) <= self.arrive:
+            print("At the gate's approach point, going through")
+            self.phase = 'through'
+        if self.phase == 'through':
+            (mid_east, mid_north), (normal_east, normal_north), _ = self.line(east, north)
+            # how far past the gate line the rover is
+            past = (east - mid_east) * normal_east + (north - mid_north) * normal_north
+            if past >= self.through - self.arrive:
+                print("Through the gate!")
+                self.phase = 'passed'
+                return None
+            return through
+        return approach
+
+    @property
+    def passed(self):
+        return self.phase == 'passed'
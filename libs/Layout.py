@@ -0,0 +1,139 @@
+import os
+from threading import current_thread, enumerate as enumerate_threads
+from time import perf_counter, sleep as plain_sleep
+
+from libs import Metrics
+
+# Decides which cores and scheduling policy each rover thread runs with, so tag detection
+# can't push the wheel commands around. Every thread belongs to a role:
+#   control - the thread sending wheel speeds to the mbeds
+#   io      - GPS, telemetry, the map server, the LEDs and metrics
+#   vision  - camera readers and the main thread, which runs detection
+# Each role gets a set of cores and a policy from the [LAYOUT] section of config.ini.
+# Threads put themselves in their role with enter() when they start since Linux sets
+# affinity and policy per thread, threads the rover didn't start get placed by apply_all().
+
+POLICIES = {
+    'other': getattr(os, 'SCHED_OTHER', 0),
+    'fifo': getattr(os, 'SCHED_FIFO', 1),
+    'rr': getattr(os, 'SCHED_RR', 2),
+}
+POLICY_NAMES = {number: name for name, number in POLICIES.items()}
+
+# role: {'cores': set or None, 'policy': str, 'priority': int}
+roles = {
+    'control': {'cores': None, 'policy': 'other', 'priority': 0},
+    'io': {'cores': None, 'policy': 'other', 'priority': 0},
+    'vision': {'cores': None, 'policy': 'other', 'priority': 0},
+}
+# thread name: (native id, role)
+threads = {}
+# per thread wake up lateness, see sleep()
+lateness = {}
+# only complain about missing permissions once
+warned = set()
+# the cores this process was allowed to run on before any of the roles got applied
+available = os.sched_getaffinity(0) if hasattr(os, 'sched_getaffinity') else set()
+
+# Turns "0,2-3" into {0, 2, 3}. Empty means every core
+def parse_cores(text:str):
+    text = (text or '').strip()
+    if not text:
+        return None
+    cores = set()
+    for part in text.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cores.update(range(int(first), int(last) + 1))
+        else:
+            cores.add(int(part))
+    return cores
+
+# Reads the [LAYOUT] section, anything missing leaves that role alone
+def configure(config):
+    if not config.has_section('LAYOUT'):
+        return
+    section = config['LAYOUT']
+    for role, settings in roles.items():
+        prefix = role.upper()
+        settings['cores'] = parse_cores(section.get(prefix + '_CORES', ''))
+        settings['policy'] = section.get(prefix + '_POLICY', 'other').lower()
+        settings['priority'] = int(section.get(prefix + '_PRIORITY', 0))
+
+# Applies a role's cores and policy to the thread with native id tid (0 is the calling thread)
+def _apply(tid:int, role:str):
+    settings = roles[role]
+
+    cores = settings['cores']
+    if cores is not None and hasattr(os, 'sched_setaffinity'):
+        # cores the machine doesn't have are dropped, and if that leaves nothing the thread stays where it is
+        usable = cores & available
+        if usable:
+            try:
+                os.sched_setaffinity(tid, usable)
+            except OSError as e:
+                _warn('affinity', f"Couldn't pin {role} threads to cores {sorted(usable)}: {e}")
+        else:
+            _warn('cores ' + role, f"None of the {role} cores {sorted(cores)} exist here, leaving them unpinned")
+
+    # other gets set too, a thread placed by apply_all() before it entered its own role has to be put back
+    policy = settings['policy']
+    if hasattr(os, 'sched_setscheduler'):
+        try:
+            priority = settings['priority'] if policy in ('fifo', 'rr') else 0
+            os.sched_setscheduler(tid, POLICIES[policy], os.sched_param(priority))
+        except (OSError, KeyError) as e:
+            # real time needs root or CAP_SYS_NICE, without it the thread just keeps the normal scheduler
+            _warn('policy ' + policy, f"Couldn't use {policy} scheduling for {role} threads, using the normal scheduler: {e}")
+
+def _warn(key:str, message:str):
+    if key not in warned:
+        warned.add(key)
+        print(message)
+
+# Called by a thread when it starts to put itself in a role
+def enter(role:str):
+    thread = current_thread()
+    _apply(0, role)
+    threads[thread.name] = (thread.native_id, role)
+    if thread.name not in lateness:
+        lateness[thread.name] = Metrics.latency('rover_wakeup_late', 'How much later than asked a thread woke up',
+            thread=thread.name)
+
+# Places every running thread that hasn't placed itself, like the map server's, in the given role
+def apply_all(role:str = 'io'):
+    for thread in enumerate_threads():
+        if thread.name in threads or thread.native_id is None:
+            continue
+        _apply(thread.native_id, role)
+        threads[thread.name] = (thread.native_id, role)
+
+# sleep() that also records how late the thread woke up, which is its scheduling latency.
+# Threads that haven't called enter() just sleep
+def sleep(seconds:float):
+    start = perf_counter()
+    plain_sleep(seconds)
+    late = lateness.get(current_thread().name)
+    if late is not None:
+        late.observe(max(0.0, perf_counter() - start - seconds))
+
+# Prints where every thread actually ended up and how late it's been waking up
+def report():
+    print("Thread layout:")
+    alive = {thread.name for thread in enumerate_threads()}
+    for name, (tid, role) in sorted(threads.items(), key=lambda item: item[1][1]):
+        if name not in alive:
+            continue
+        try:
+            cores = ','.join(str(c) for c in sorted(os.sched_getaffinity(tid))) if hasattr(os, 'sched_getaffinity') else '?'
+            policy = POLICY_NAMES.get(os.sched_getscheduler(tid), '?') if hasattr(os, 'sched_getscheduler') else '?'
+            priority = os.sched_getparam(tid).sched_priority if hasattr(os, 'sched_getparam') else 0
+        except OSError:
+            continue
+        line = f"  {name:<22} {role:<8} cores {cores:<8} {policy}"
+        if priority:
+            line += f" {priority}"
+        late = lateness.get(name)
+        if late is not None and late.count:
+            line += f", wakes up {late.average * 1000:.2f}ms late on average ({late.max * 1000:.2f}ms worst)"
+        print(line)
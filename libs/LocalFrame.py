@@ -0,0 +1,88 @@
+from math import cos, sin, radians, degrees, sqrt, atan2, hypot
+
+# Local east-north-up (ENU) tangent plane fixed at a mission origin.
+# Going through earth-centered earth-fixed (ECEF) coordinates keeps the
+# projection exact for the tangent plane, so distances stay centimeter
+# accurate over the few hundred meters the rover drives in a mission.
+# Everything in here is in meters and degrees.
+class LocalFrame:
+    # WGS84 ellipsoid
+    SEMI_MAJOR_AXIS = 6378137.0
+    ECCENTRICITY_SQ = 6.69437999014e-3
+
+    def __init__(self, lat:float, lon:float, height:float = 0.0):
+        self.lat = lat
+        self.lon = lon
+        self.height = height
+
+        # the rotation from ECEF to ENU only depends on the origin so it's done once
+        phi = radians(lat)
+        lam = radians(lon)
+        self.sin_lat = sin(phi)
+        self.cos_lat = cos(phi)
+        self.sin_lon = sin(lam)
+        self.cos_lon = cos(lam)
+        self.x0, self.y0, self.z0 = self.to_ecef(lat, lon, height)
+
+        # waypoints get projected once and looked up after that
+        self.cache = {}
+
+    # Converts geodetic coordinates to ECEF coordinates
+    def to_ecef(self, lat:float, lon:float, height:float = 0.0):
+        phi = radians(lat)
+        lam = radians(lon)
+        sin_phi = sin(phi)
+        cos_phi = cos(phi)
+        n = self.SEMI_MAJOR_AXIS / sqrt(1 - self.ECCENTRICITY_SQ * sin_phi * sin_phi)
+        x = (n + height) * cos_phi * cos(lam)
+        y = (n + height) * cos_phi * sin(lam)
+        z = (n * (1 - self.ECCENTRICITY_SQ) + height) * sin_phi
+        return x, y, z
+
+    # Returns the (east, north) offset in meters of a point from the origin.
+    # Points are assumed to be at the origin's height since waypoints don't have one.
+    def to_enu(self, lat:float, lon:float):
+        x, y, z = self.to_ecef(lat, lon, self.height)
+        dx = x - self.x0
+        dy = y - self.y0
+        dz = z - self.z0
+        east = -self.sin_lon * dx + self.cos_lon * dy
+        north = -self.sin_lat * self.cos_lon * dx - self.sin_lat * self.sin_lon * dy + self.cos_lat * dz
+        return east, north
+
+    # Same as to_enu but remembers the result, use this for waypoints
+    def project(self, lat:float, lon:float):
+        key = (lat, lon)
+        enu = self.cache.get(key)
+        if enu is None:
+            enu = self.to_enu(lat, lon)
+            self.cache[key] = enu
+        return enu
+
+    # Converts a local (east, north) point in meters back to latitude and longitude
+    def to_geodetic(self, east:float, north:float):
+        # rotates back into ECEF, up is left at 0 since everything lives on the plane
+        x = self.x0 - self.sin_lon * east - self.sin_lat * self.cos_lon * north
+        y = self.y0 + self.cos_lon * east - self.sin_lat * self.sin_lon * north
+        z = self.z0 + self.cos_lat * north
+
+        # a few fixed point iterations converge well past centimeters this close to the surface
+        lon = atan2(y, x)
+        p = hypot(x, y)
+        lat = atan2(z, p * (1 - self.ECCENTRICITY_SQ))
+        for _ in range(4):
+            sin_phi = sin(lat)
+            n = self.SEMI_MAJOR_AXIS / sqrt(1 - self.ECCENTRICITY_SQ * sin_phi * sin_phi)
+            lat = atan2(z + self.ECCENTRICITY_SQ * n * sin_phi, p)
+        return degrees(lat), degrees(lon)
+
+    # Distance in meters between two local points
+    @staticmethod
+    def distance(east1:float, north1:float, east2:float, north2:float):
+        return hypot(east2 - east1, north2 - north1)
+
+    # Bearing in degrees from the first local point to the second
+    # (0 is North, 90 is East, +/-180 is South, -90 is West)
+    @staticmethod
+    def bearing(east1:float, north1:float, east2:float, north2:float):
+        return degrees(atan2(east2 - east1, north2 - north1))
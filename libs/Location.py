@@ -1,48 +1,148 @@
 #import sys
 #sys.path.append('../')
 from gps import gps
-from math import cos, radians, degrees, sin, atan2, pi, sqrt, asin
+from math import cos, radians, degrees, sin, atan2, pi, sqrt, asin, hypot
 from threading import Thread
-from time import sleep
+from libs.LocalFrame import LocalFrame
+from libs.Fix import Fix, FixPublisher
+from libs import Layout
 
-import os
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
 # Class that computes functions related to location of Rover
 class Location:
     def __init__(self, ip, port):
         self.swift_IP = ip
         self.swift_port = port
-        self.latitude = 0
-        self.longitude = 0
-        self.old_latitude = 0
-        self.old_longitude = 0
-        self.height = 0
-        self.time = 0
-        self.error = 0
-        self.bearing = 0.0
         self.running = True
+        # local tangent plane fixed at the start of a mission, see set_origin
+        self.frame = None
+        # every fix is published here as one immutable snapshot
+        self.fixes = FixPublisher()
+        # optional Extrapolator, when set distance_to and bearing_to use the predicted pose
+        self.predictor = None
         self.all_zero = True
-        self.wait_time = 1
+        # how often the swift library is checked for a new fix. Only new fixes are
+        # published so this just bounds the latency, keep it well under the receiver's rate
+        self.wait_time = .01
+
+    # The latest fix, grab this once and read fields off of it to get a consistent position
+    @property
+    def fix(self):
+        return self.fixes.fix
+
+    @property
+    def latitude(self):
+        return self.fixes.fix.latitude
+
+    @property
+    def longitude(self):
+        return self.fixes.fix.longitude
+
+    @property
+    def height(self):
+        return self.fixes.fix.height
+
+    @property
+    def time(self):
+        return self.fixes.fix.time
+
+    @property
+    def error(self):
+        return self.fixes.fix.error
+
+    @property
+    def bearing(self):
+        return self.fixes.fix.bearing
+
+    @property
+    def east(self):
+        return self.fixes.fix.east
+
+    @property
+    def north(self):
+        return self.fixes.fix.north
+
+    # Blocks until the next fix comes in, returns it or None on timeout
+    def wait_for_fix(self, timeout:float = None):
+        return self.fixes.wait(timeout=timeout)
+
+    # Calls callback(fix) from the GPS thread every time a new fix comes in
+    def add_fix_callback(self, callback):
+        self.fixes.subscribe(callback)
 
     def config(self):
         # read from a file, probably configure this to work with
         # ConfigParser because that's ez
         pass
 
+    # Fixes the local tangent plane at the given point (or the current position)
+    # so distance_to and bearing_to can use flat meter math instead of spherical trig
+    # The frame is swapped and the current fix re-projected in one go under the publisher's lock,
+    # so a fix coming in at the same time can't be projected with the old frame and published after.
+    # Before the first real fix there's nothing to re-project (and no current position to use)
+    def set_origin(self, lat:float = None, lon:float = None):
+        with self.fixes.condition:
+            if self.fixes.count == 0:
+                if lat is None or lon is None:
+                    raise ValueError("Can't put the origin at the current position before the first GPS fix")
+                self.frame = LocalFrame(lat, lon)
+                return self.frame
+        def reproject(fix):
+            if lat is None or lon is None:
+                self.frame = LocalFrame(fix.latitude, fix.longitude)
+            else:
+                self.frame = LocalFrame(lat, lon)
+            east, north = self.frame.to_enu(fix.latitude, fix.longitude)
+            return fix.replace(east=east, north=north)
+        self.fixes.update(reproject, new_fix=False)
+        return self.frame
+
+    # Sets the origin at the first waypoint and projects every waypoint once
+    # Returns the list of (east, north) points in meters. With no waypoints the origin goes
+    # where the rover is, or stays unset (spherical math) if there's no fix yet
+    def start_mission(self, locations):
+        if len(locations) > 0:
+            self.set_origin(locations[0][0], locations[0][1])
+        elif self.fixes.count > 0:
+            self.set_origin()
+        return [self.frame.project(lat, lon) for lat, lon in locations]
+
+    # Returns the rover's (east, north, heading) in the local frame. This is the
+    # predicted pose for right now (or the monotonic() time at) if there's a predictor, otherwise the last fix
+    def pose(self, at:float = None):
+        if self.predictor is not None:
+            prediction = self.predictor.predict(at)
+            if prediction is not None:
+                return prediction.east, prediction.north, prediction.heading
+        fix = self.fixes.fix
+        return fix.east, fix.north, fix.bearing
+
     # Returns distance in kilometers between given latitude and longitude
     def distance_to(self, lat:float, lon:float):
+        if self.frame is not None:
+            east, north = self.frame.project(lat, lon)
+            rover_east, rover_north, _ = self.pose()
+            return hypot(east - rover_east, north - rover_north) / 1000.0
+
+        fix = self.fixes.fix
+
         earth_radius = 6371.301
-        delta_lat = (lat - self.latitude) * (pi/180.0)
-        delta_lon = (lon - self.longitude) * (pi/180.0)
+        delta_lat = (lat - fix.latitude) * (pi/180.0)
+        delta_lon = (lon - fix.longitude) * (pi/180.0)
 
-        a = sin(delta_lat/2) * sin(delta_lat/2) + cos(self.latitude * (pi/180.0)) * cos(lat * (pi/180.0)) * sin(delta_lon/2) * sin(delta_lon/2)
+        a = sin(delta_lat/2) * sin(delta_lat/2) + cos(fix.latitude * (pi/180.0)) * cos(lat * (pi/180.0)) * sin(delta_lon/2) * sin(delta_lon/2)
         c = 2 * atan2(sqrt(a), sqrt(1-a))
         return earth_radius * c
 
     # Calculates difference between given bearing to location and current bearing
     # Positive is turn right, negative is turn left
     def bearing_to(self, lat:float, lon:float):
-        resultbearing = self.calc_bearing(self.latitude, self.longitude, lat, lon) - self.bearing
+        if self.frame is not None:
+            east, north = self.frame.project(lat, lon)
+            rover_east, rover_north, heading = self.pose()
+            resultbearing = degrees(atan2(east - rover_east, north - rover_north)) - heading
+        else:
+            fix = self.fixes.fix
+            resultbearing = self.calc_bearing(fix.latitude, fix.longitude, lat, lon) - fix.bearing
         return resultbearing + 360 if resultbearing < -180 else (resultbearing - 360 if resultbearing > 180 else resultbearing)
 
     # Starts updating fields from the GPS box
@@ -67,24 +167,41 @@ class Location:
     
 
     def update_fields_loop(self):
+        Layout.enter('io')
+        last = None
         while(self.running):
-            if gps.get_latitude() + gps.get_longitude() != 0:
-                self.old_latitude = self.latitude
-                self.old_longitude = self.longitude
-
-                self.latitude = gps.get_latitude()
-                self.longitude = gps.get_longitude()
-                self.height = gps.get_height()
-                self.time = gps.get_time()
-                self.error = gps.get_error()
-                self.bearing = self.calc_bearing(self.old_latitude, self.old_longitude, self.latitude, self.longitude)
+            latitude = gps.get_latitude()
+            longitude = gps.get_longitude()
+            if latitude + longitude != 0:
+                time = gps.get_time()
+                # only publish when the receiver actually has something new
+                if (latitude, longitude, time) != last:
+                    last = (latitude, longitude, time)
+                    self.publish_fix(latitude, longitude, height=gps.get_height(), time=time, error=gps.get_error())
                 self.all_zero = False
             else:
-                all_zero = True
-            # maybe print info or sleep or something idk
-            sleep(self.wait_time)
+                self.all_zero = True
+            Layout.sleep(self.wait_time)
         return
 
+    # Builds a snapshot out of a new position and publishes it
+    def publish_fix(self, latitude:float, longitude:float, **fields):
+        # runs under the publisher's lock, see set_origin
+        def build(previous):
+            frame = self.frame
+            east = north = 0.0
+            if frame is not None:
+                east, north = frame.to_enu(latitude, longitude)
+            if self.fixes.count == 0:
+                # nothing to difference against yet
+                bearing = previous.bearing
+            elif frame is not None:
+                bearing = LocalFrame.bearing(previous.east, previous.north, east, north)
+            else:
+                bearing = self.calc_bearing(previous.latitude, previous.longitude, latitude, longitude)
+            return Fix(latitude, longitude, bearing=bearing, east=east, north=north, **fields)
+        self.fixes.update(build)
+
     # Calculates bearing between two points. 
     # (0 is North, 90 is East, +/-180 is South, -90 is West)
     def calc_bearing(self,lat1:float, lon1:float, lat2:float, lon2:float):
@@ -99,8 +216,9 @@ class Location:
         brng = radians(bearing)      # Assuming bearing is in degrees
         d = distance
 
-        lat1 = radians(self.latitude)   # Current lat point converted to radians
-        lon1 = radians(self.longitude)  # Current long point converted to radians
+        fix = self.fixes.fix
+        lat1 = radians(fix.latitude)   # Current lat point converted to radians
+        lon1 = radians(fix.longitude)  # Current long point converted to radians
 
         lat2 = asin(sin(lat1)*cos(d/R) + 
                     cos(lat1)*sin(d/R)*cos(brng))
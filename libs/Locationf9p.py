@@ -1,46 +1,147 @@
-import sys
-sys.path.append('../')
-from math import cos, radians, degrees, sin, atan2, pi, sqrt, asin
+from math import cos, radians, degrees, sin, atan2, pi, sqrt, asin, hypot
 import threading
+from libs.LocalFrame import LocalFrame
+from libs.Fix import Fix, FixPublisher
+from libs.NMEA import NMEAParser
+from libs import UBX
+from libs import Layout
 
 # Class that computes functions related to location of Rover
 # TODO: Make sure that the current GPS outputs coordinates
-#       in the same format as the swift, and test out 
-#       heading and see if that should be computed
-#       somewhere outside of __parse
+#       in the same format as the swift
 class LocationF9P:
     # To find the device path, run ls -l /dev/serial/by-id/usb-ublox_....(tab complete this)
     # and it will return where it's symlinked to, most likely /dev/ttyACM0
     # you could probably just use that /dev/serial path too
-    def __init__(self, device_path="/dev/ttyACM0"):
+    # protocol is either "nmea" or "ubx". With "ubx" the receiver is read as binary NAV-PVT
+    # and if ubx_rate (Hz) is set, start_GPS will configure the receiver to output it at that rate
+    def __init__(self, device_path="/dev/ttyACM0", protocol="nmea", ubx_rate=None):
         self.device_path = device_path
         self.device_open_file = None
-        self.latitude = 0
-        self.longitude = 0
-        self.old_latitude = 0
-        self.old_longitude = 0
-        self.bearing = 0.0
+        self.protocol = protocol
+        self.ubx_rate = ubx_rate
         self.running = True
+        # local tangent plane fixed at the start of a mission, see set_origin
+        self.frame = None
+        # every fix is published here as one immutable snapshot
+        self.fixes = FixPublisher()
+        # optional Extrapolator, when set distance_to and bearing_to use the predicted pose
+        self.predictor = None
+        self.parser = UBX.UBXParser() if protocol == "ubx" else NMEAParser()
+        # latest speed (m/s) and course (degrees) from RMC/VTG
+        self.speed = None
+        self.course = None
+        self.has_gga = False
+        # course over ground is just noise when standing still, below this (m/s) fixes get differenced instead
+        self.min_course_speed = .3
+
+    # The latest fix, grab this once and read fields off of it to get a consistent position
+    @property
+    def fix(self):
+        return self.fixes.fix
+
+    @property
+    def latitude(self):
+        return self.fixes.fix.latitude
+
+    @property
+    def longitude(self):
+        return self.fixes.fix.longitude
+
+    @property
+    def bearing(self):
+        return self.fixes.fix.bearing
+
+    @property
+    def east(self):
+        return self.fixes.fix.east
+
+    @property
+    def north(self):
+        return self.fixes.fix.north
+
+    # Blocks until the next fix comes in, returns it or None on timeout
+    def wait_for_fix(self, timeout:float = None):
+        return self.fixes.wait(timeout=timeout)
+
+    # Calls callback(fix) from the GPS thread every time a new fix comes in
+    def add_fix_callback(self, callback):
+        self.fixes.subscribe(callback)
 
     def config(self):
         # read from a file, probably configure this to work with
         # ConfigParser because that's ez
         pass
 
+    # Fixes the local tangent plane at the given point (or the current position)
+    # so distance_to and bearing_to can use flat meter math instead of spherical trig
+    # The frame is swapped and the current fix re-projected in one go under the publisher's lock,
+    # so a fix coming in at the same time can't be projected with the old frame and published after.
+    # Before the first real fix there's nothing to re-project (and no current position to use)
+    def set_origin(self, lat:float = None, lon:float = None):
+        with self.fixes.condition:
+            if self.fixes.count == 0:
+                if lat is None or lon is None:
+                    raise ValueError("Can't put the origin at the current position before the first GPS fix")
+                self.frame = LocalFrame(lat, lon)
+                return self.frame
+        def reproject(fix):
+            if lat is None or lon is None:
+                self.frame = LocalFrame(fix.latitude, fix.longitude)
+            else:
+                self.frame = LocalFrame(lat, lon)
+            east, north = self.frame.to_enu(fix.latitude, fix.longitude)
+            return fix.replace(east=east, north=north)
+        self.fixes.update(reproject, new_fix=False)
+        return self.frame
+
+    # Sets the origin at the first waypoint and projects every waypoint once
+    # Returns the list of (east, north) points in meters. With no waypoints the origin goes
+    # where the rover is, or stays unset (spherical math) if there's no fix yet
+    def start_mission(self, locations):
+        if len(locations) > 0:
+            self.set_origin(locations[0][0], locations[0][1])
+        elif self.fixes.count > 0:
+            self.set_origin()
+        return [self.frame.project(lat, lon) for lat, lon in locations]
+
+    # Returns the rover's (east, north, heading) in the local frame. This is the
+    # predicted pose for right now (or the monotonic() time at) if there's a predictor, otherwise the last fix
+    def pose(self, at:float = None):
+        if self.predictor is not None:
+            prediction = self.predictor.predict(at)
+            if prediction is not None:
+                return prediction.east, prediction.north, prediction.heading
+        fix = self.fixes.fix
+        return fix.east, fix.north, fix.bearing
+
     # Returns distance in kilometers between given latitude and longitude
     def distance_to(self, lat:float, lon:float):
+        if self.frame is not None:
+            east, north = self.frame.project(lat, lon)
+            rover_east, rover_north, _ = self.pose()
+            return hypot(east - rover_east, north - rover_north) / 1000.0
+
+        fix = self.fixes.fix
+
         earth_radius = 6371.301
-        delta_lat = (lat - self.latitude) * (pi/180.0)
-        delta_lon = (lon - self.longitude) * (pi/180.0)
+        delta_lat = (lat - fix.latitude) * (pi/180.0)
+        delta_lon = (lon - fix.longitude) * (pi/180.0)
 
-        a = sin(delta_lat/2) * sin(delta_lat/2) + cos(self.latitude * (pi/180.0)) * cos(lat * (pi/180.0)) * sin(delta_lon/2) * sin(delta_lon/2)
+        a = sin(delta_lat/2) * sin(delta_lat/2) + cos(fix.latitude * (pi/180.0)) * cos(lat * (pi/180.0)) * sin(delta_lon/2) * sin(delta_lon/2)
         c = 2 * atan2(sqrt(a), sqrt(1-a))
         return earth_radius * c
 
     # Calculates difference between given bearing to location and current bearing
     # Positive is turn right, negative is turn left
     def bearing_to(self, lat:float, lon:float):
-        resultbearing = self.calc_bearing(self.latitude, self.longitude, lat, lon) - self.bearing
+        if self.frame is not None:
+            east, north = self.frame.project(lat, lon)
+            rover_east, rover_north, heading = self.pose()
+            resultbearing = degrees(atan2(east - rover_east, north - rover_north)) - heading
+        else:
+            fix = self.fixes.fix
+            resultbearing = self.calc_bearing(fix.latitude, fix.longitude, lat, lon) - fix.bearing
         return resultbearing + 360 if resultbearing < -180 else (resultbearing - 360 if resultbearing > 180 else resultbearing)
 
     # Starts updating fields from the GPS box
@@ -60,73 +161,70 @@ class LocationF9P:
         self.running = False
 
     def start_GPS(self):
-        self.device_open_file = open(self.device_path)
+        # unbuffered binary reads so the parser gets whatever bytes are waiting in one go
+        self.device_open_file = open(self.device_path, 'r+b', buffering=0)
+        if self.protocol == "ubx" and self.ubx_rate is not None:
+            self.configure_ubx(self.ubx_rate)
+
+    # Turns on NAV-PVT output at the given rate (Hz). This only goes to the receiver's RAM
+    # so it has to be done again after a power cycle
+    def configure_ubx(self, rate:float):
+        self.device_open_file.write(UBX.nav_pvt_config(rate))
 
     def update_fields_loop(self):
+        Layout.enter('io')
         while(self.running):
-            line_read = self.device_open_file.readline()
-            self.__parse(line_read)
+            for message in self.parser.read_from(self.device_open_file):
+                self.handle_message(message)
         return
 
-    # Parse NMEA messages read from the GPS.
-    # The protocol is described on pdf page 24
-    # of the integration manual (section 4.2.6)
-    # https://cdn.sparkfun.com/assets/f/7/4/3/5/PM-15136.pdf
-    def __parse(self, message_str):
-        if isinstance(message_str, str):
-            split = message_str.split(",")
-            # look for lat/lon messages. We'll almost certainly get
-            # GN messages (maybe only GN messages, but this theoretically accepts other talkers)
-            if split[0].startswith("$") and split[0].endswith("GLL"):
-                computed_checksum = 0
-                for char in message_str:
-                    if char == "*":
-                        # marks the end of the portion to hash
-                        break
-                    elif char == "$":
-                        # marks the beginning
-                        computed_checksum = 0
-                    else:
-                        computed_checksum ^= ord(char)
-
-                computed_checksum = format(computed_checksum, "X")
-                message_checksum = (
-                    message_str.split("*")[-1].replace("\n", "").replace("\r", "")
-                )
-                if computed_checksum != message_checksum:
-                    print(
-                        "`"
-                        + format(computed_checksum, "X")
-                        + "` did not match `"
-                        + message_str.split("*")[-1]
-                        + "`"
-                    )
-                    return
-
-                self.old_latitude = self.latitude
-                self.old_longitude = self.longitude
-
-                # This is just a big pile of slicing up, the goal is to take:
-                # $GNGLL,3511.93307,N,09721.15557,W,011244.00,A,D*64
-                # and output the lat and lon.
-                # It does this by:
-                # - Parsing out the integer number of degrees (2 digits for lat, 3 digits for lon)
-                # - Parsing out the minutes, and dividing them by 60, then adding them to the integer degrees
-                # - Multiplying by -1 if the lat is in the south, or if the lon is in the west
-                self.latitude = (int(split[1][0:2]) + float(split[1][2:]) / 60) * (
-                    -1 if split[2] == "S" else 1
-                )
-                self.longitude = (int(split[3][0:3]) + float(split[3][3:]) / 60) * (
-                    -1 if split[4] == "W" else 1
-                )
-
-                self.bearing = self.calc_bearing(self.old_latitude, self.old_longitude, self.latitude, self.longitude)
-            elif not (
-                message_str == "\n" or message_str == "\r\n" or message_str == ""
-            ) and not message_str.startswith("$"):
-                print(
-                    "got weird message: " + message_str + " of len " + str(len(split))
-                )
+    # NAV-PVT fixes are published as soon as they're decoded.
+    # For NMEA, speed and course come in on RMC/VTG before the GGA of the same epoch, so they're
+    # held onto and the fix gets published on GGA with everything together.
+    # If GGA is turned off on the receiver, RMC or GLL positions get published instead.
+    def handle_message(self, message):
+        kind = message['type']
+        if kind == 'NAV-PVT':
+            # one message has everything so there's nothing to hold onto
+            if message['valid']:
+                self.publish_fix(message['latitude'], message['longitude'], time=message['time'],
+                    height=message['height'], error=message['error'], satellites=message['satellites'],
+                    quality=message['quality'], speed=message['speed'], course=message['course'])
+            return
+        if kind == 'VTG' or kind == 'RMC':
+            self.speed = message['speed']
+            self.course = message['course']
+        if kind == 'GGA':
+            self.has_gga = True
+            self.publish_fix(message['latitude'], message['longitude'], time=message['time'],
+                height=message['height'], hdop=message['hdop'], satellites=message['satellites'],
+                quality=message['quality'], speed=self.speed, course=self.course)
+        elif (kind == 'RMC' or kind == 'GLL') and not self.has_gga:
+            self.publish_fix(message['latitude'], message['longitude'], time=message['time'],
+                speed=self.speed, course=self.course)
+
+    # Builds a snapshot out of a new position and publishes it
+    def publish_fix(self, latitude:float, longitude:float, **fields):
+        # runs under the publisher's lock, see set_origin
+        def build(previous):
+            frame = self.frame
+            east = north = 0.0
+            if frame is not None:
+                east, north = frame.to_enu(latitude, longitude)
+            course = fields.get('course')
+            speed = fields.get('speed')
+            if course is not None and speed is not None and speed >= self.min_course_speed:
+                # the receiver's course over ground, no fix differencing needed
+                bearing = course - 360 if course > 180 else course
+            elif self.fixes.count == 0:
+                # nothing to difference against yet
+                bearing = previous.bearing
+            elif frame is not None:
+                bearing = LocalFrame.bearing(previous.east, previous.north, east, north)
+            else:
+                bearing = self.calc_bearing(previous.latitude, previous.longitude, latitude, longitude)
+            return Fix(latitude, longitude, bearing=bearing, east=east, north=north, **fields)
+        self.fixes.update(build)
 
     # Calculates bearing between two points. 
     # (0 is North, 90 is East, +/-180 is South, -90 is West)
@@ -142,8 +240,9 @@ class LocationF9P:
         brng = radians(bearing)      # Assuming bearing is in degrees
         d = distance
 
-        lat1 = radians(self.latitude)   # Current lat point converted to radians
-        lon1 = radians(self.longitude)  # Current long point converted to radians
+        fix = self.fixes.fix
+        lat1 = radians(fix.latitude)   # Current lat point converted to radians
+        lon1 = radians(fix.longitude)  # Current long point converted to radians
 
         lat2 = asin(sin(lat1)*cos(d/R) + 
                     cos(lat1)*sin(d/R)*cos(brng))
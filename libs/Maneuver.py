@@ -0,0 +1,78 @@
+from time import monotonic
+
+# Timed moves like backing up or pivoting, stepped by the control loop instead of slept through.
+# Each step hands back the wheel speeds for right now, so the loop running it can keep looking
+# for tags, checking the GPS and listening for an abort the whole time, and cut the move short.
+
+# One part of a maneuver: hold these wheel speeds for this many seconds
+class Segment:
+    __slots__ = ('name', 'speeds', 'duration')
+
+    def __init__(self, name:str, speeds, duration:float):
+        self.name = name
+        self.speeds = tuple(speeds)
+        self.duration = duration
+
+    def __repr__(self):
+        return f"Segment({self.name}, {self.speeds}, {self.duration}s)"
+
+def back_up(speed:float, duration:float):
+    return Segment('back up', (-abs(speed), -abs(speed)), duration)
+
+def straight(speed:float, duration:float):
+    return Segment('straight', (speed, speed), duration)
+
+def hold(duration:float):
+    return Segment('hold', (0, 0), duration)
+
+# Positive speed pivots right, negative pivots left
+def pivot(speed:float, duration:float):
+    return Segment('pivot', (speed, -speed), duration)
+
+# Any left and right speeds, like a wide turn
+def turn(left:float, right:float, duration:float):
+    return Segment('turn', (left, right), duration)
+
+class Maneuver:
+    def __init__(self, *segments:Segment):
+        self.segments = segments
+        self.start_time = None
+        # index of the segment running right now, -1 before the first step
+        self.current = -1
+        # why it ended early, None if it ran all the way through
+        self.stopped = None
+
+    def start(self, now:float = None):
+        self.start_time = monotonic() if now is None else now
+        self.current = -1
+        self.stopped = None
+
+    # Wheel speeds for right now, or None once every segment is done (or it got stopped)
+    def step(self, now:float = None):
+        if self.stopped is not None:
+            return None
+        if self.start_time is None:
+            self.start(now)
+        elapsed = (monotonic() if now is None else now) - self.start_time
+        for i, segment in enumerate(self.segments):
+            if elapsed < segment.duration:
+                if i != self.current:
+                    self.current = i
+                    print(f"Maneuver: {segment.name} {segment.speeds} for {segment.duration}s")
+                return segment.speeds
+            elapsed -= segment.duration
+        self.current = len(self.segments)
+        return None
+
+    # Ends the maneuver early, reason says why
+    def stop(self, reason):
+        self.stopped = reason
+
+    @property
+    def done(self):
+        return self.stopped is not None or self.current >= len(self.segments)
+
+    # Total seconds it takes if nothing cuts it short
+    @property
+    def duration(self):
+        return sum(segment.duration for segment in self.segments)
@@ -0,0 +1,216 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, enumerate as enumerate_threads
+from time import perf_counter
+
+# Live health metrics for the rover, served in Prometheus text format.
+#
+# Every metric is created once up front and the hot path only does plain attribute
+# updates on it, no locks and no allocation. Each metric should only ever be updated
+# from one thread so the updates can't step on each other; readers (the HTTP server,
+# dump()) might see a value that's one update behind which is fine for monitoring.
+
+# weight of the newest sample in the moving averages
+SMOOTHING = .1
+
+def _format_labels(labels:dict):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in sorted(labels.items())) + '}'
+
+# A count that only goes up, like UDP packets sent
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name:str, help:str, labels:dict):
+        self.name = name
+        self.help = help
+        self.labels = _format_labels(labels)
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, self.kind, self.labels, self.value
+
+# A value that's set directly. If function is given it's called when the metrics are read instead
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name:str, help:str, labels:dict, function=None):
+        self.name = name
+        self.help = help
+        self.labels = _format_labels(labels)
+        self.function = function
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        yield self.name, self.kind, self.labels, self.function() if self.function is not None else self.value
+
+# Something that's supposed to happen on a schedule, like a control loop or camera frames.
+# Tracks the period between ticks, how much it jitters and the worst period seen, and counts the ticks.
+class Rate:
+    kind = 'gauge'
+
+    def __init__(self, name:str, help:str, labels:dict):
+        self.name = name
+        self.help = help
+        self.labels = _format_labels(labels)
+        self.last = 0.0
+        self.period = 0.0
+        self.jitter = 0.0
+        self.max = 0.0
+        self.ticks = 0
+
+    def tick(self, now:float = None):
+        if now is None:
+            now = perf_counter()
+        last = self.last
+        self.last = now
+        self.ticks += 1
+        if last == 0.0:
+            return
+        period = now - last
+        if self.period == 0.0:
+            self.period = period
+        self.period += (period - self.period) * SMOOTHING
+        self.jitter += (abs(period - self.period) - self.jitter) * SMOOTHING
+        if period > self.max:
+            self.max = period
+
+    # Seconds since the last tick, good for telling if a loop stalled
+    def age(self):
+        return perf_counter() - self.last if self.last else -1.0
+
+    def samples(self):
+        yield self.name + '_period_seconds', self.kind, self.labels, self.period
+        yield self.name + '_jitter_seconds', self.kind, self.labels, self.jitter
+        yield self.name + '_max_period_seconds', self.kind, self.labels, self.max
+        yield self.name + '_rate_hz', self.kind, self.labels, 1 / self.period if self.period > 0 else 0.0
+        yield self.name + '_since_last_seconds', self.kind, self.labels, self.age()
+        yield self.name + '_ticks_total', 'counter', self.labels, self.ticks
+
+# How long something takes, like one detection pass
+class Latency:
+    kind = 'gauge'
+
+    def __init__(self, name:str, help:str, labels:dict):
+        self.name = name
+        self.help = help
+        self.labels = _format_labels(labels)
+        self.average = 0.0
+        self.last = 0.0
+        self.max = 0.0
+        self.count = 0
+
+    def observe(self, seconds:float):
+        self.last = seconds
+        self.count += 1
+        if self.count == 1:
+            self.average = seconds
+        else:
+            self.average += (seconds - self.average) * SMOOTHING
+        if seconds > self.max:
+            self.max = seconds
+
+    def samples(self):
+        yield self.name + '_seconds', self.kind, self.labels, self.average
+        yield self.name + '_last_seconds', self.kind, self.labels, self.last
+        yield self.name + '_max_seconds', self.kind, self.labels, self.max
+        yield self.name + '_count', 'counter', self.labels, self.count
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        # names of threads that are supposed to be running
+        self.threads = []
+
+    # Returns the metric with this name and labels, creating it the first time.
+    # Call these during setup and keep the result, not in the hot path
+    def _get(self, cls, name:str, help:str, labels:dict, **kwargs):
+        key = (name, _format_labels(labels))
+        metric = self.metrics.get(key)
+        if metric is None:
+            metric = cls(name, help, labels, **kwargs)
+            self.metrics[key] = metric
+        return metric
+
+    def counter(self, name:str, help:str = '', **labels):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name:str, help:str = '', function=None, **labels):
+        return self._get(Gauge, name, help, labels, function=function)
+
+    def rate(self, name:str, help:str = '', **labels):
+        return self._get(Rate, name, help, labels)
+
+    def latency(self, name:str, help:str = '', **labels):
+        return self._get(Latency, name, help, labels)
+
+    # Reports whether a thread with this name is alive
+    def watch_thread(self, name:str):
+        if name not in self.threads:
+            self.threads.append(name)
+
+    # Everything in Prometheus text format
+    def render(self):
+        lines = []
+        described = set()
+        for metric in list(self.metrics.values()):
+            for name, kind, labels, value in metric.samples():
+                if name not in described:
+                    described.add(name)
+                    if metric.help:
+                        lines.append(f'# HELP {name} {metric.help}')
+                    lines.append(f'# TYPE {name} {kind}')
+                lines.append(f'{name}{labels} {value}')
+        alive = {thread.name for thread in enumerate_threads() if thread.is_alive()}
+        if self.threads:
+            lines.append('# HELP rover_thread_alive 1 if the thread is running')
+            lines.append('# TYPE rover_thread_alive gauge')
+            for name in self.threads:
+                lines.append(f'rover_thread_alive{_format_labels({"thread": name})} {1 if name in alive else 0}')
+        return '\n'.join(lines) + '\n'
+
+    # Writes the current metrics to a file
+    def dump(self, path:str):
+        with open(path, 'w') as f:
+            f.write(self.render())
+
+    # Serves the metrics over HTTP at http://host:port/metrics from a background thread
+    def serve(self, port:int = 9100, host:str = '0.0.0.0'):
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            # keeps every scrape from getting printed
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        t = Thread(target=server.serve_forever, name='metrics server', args=())
+        t.daemon = True
+        t.start()
+        return server
+
+# The registry everything on the rover reports to
+registry = Registry()
+counter = registry.counter
+gauge = registry.gauge
+rate = registry.rate
+latency = registry.latency
+watch_thread = registry.watch_thread
+render = registry.render
+dump = registry.dump
+serve = registry.serve
@@ -0,0 +1,168 @@
+# Buffered NMEA 0183 parser for the u-blox F9P.
+# The protocol is described on pdf page 24 of the integration manual (section 4.2.6)
+# https://cdn.sparkfun.com/assets/f/7/4/3/5/PM-15136.pdf
+#
+# Raw bytes are bulk read into one reusable buffer, sentences are framed in place
+# and only the sentences we decode ever get split into fields.
+
+KNOTS_TO_MPS = 0.514444
+KPH_TO_MPS = 1 / 3.6
+
+# NMEA sentences are at most 82 characters, $ and line ending included
+MAX_SENTENCE_LENGTH = 82
+# so a 128 byte fold covers all of them
+MAX_FOLD_LENGTH = 128
+
+# XORs every byte together. Instead of looping over each character this treats the
+# bytes as one big integer and folds it in half until the low byte holds the answer.
+def xor_checksum(data):
+    if len(data) > MAX_FOLD_LENGTH:
+        checksum = 0
+        for byte in data:
+            checksum ^= byte
+        return checksum
+    x = int.from_bytes(data, 'little')
+    x ^= x >> 512
+    x ^= x >> 256
+    x ^= x >> 128
+    x ^= x >> 64
+    x ^= x >> 32
+    x ^= x >> 16
+    x ^= x >> 8
+    return x & 0xff
+
+# Turns ddmm.mmmm (or dddmm.mmmm) and a hemisphere into signed decimal degrees
+def parse_coordinate(value:bytes, hemisphere:bytes, degree_digits:int):
+    if not value:
+        return None
+    degrees = int(value[:degree_digits]) + float(value[degree_digits:]) / 60
+    return -degrees if hemisphere in (b'S', b'W') else degrees
+
+def parse_float(value:bytes):
+    return float(value) if value else None
+
+class NMEAParser:
+    def __init__(self, buffer_size=4096):
+        # reusable read buffer so reading never allocates
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        # bytes that haven't been framed into a full sentence yet
+        self.pending = bytearray()
+        # only these sentence types get decoded, everything else is just counted
+        self.decoders = {
+            b'GGA': self.decode_gga,
+            b'RMC': self.decode_rmc,
+            b'VTG': self.decode_vtg,
+            b'GLL': self.decode_gll,
+        }
+        self.sentences = 0
+        self.bad_checksums = 0
+        self.unknown = 0
+        self.malformed = 0
+
+    # Reads whatever is waiting on the device (a file opened in binary mode) and parses it
+    def read_from(self, device):
+        count = device.readinto(self.buffer)
+        if not count:
+            return []
+        return self.feed(self.view[:count])
+
+    # Parses a chunk of raw bytes, returns a list of decoded sentences as dicts.
+    # Partial sentences are kept until the rest of them shows up.
+    def feed(self, data):
+        pending = self.pending
+        pending += data
+        view = memoryview(pending)
+        decoded = []
+        start = pending.find(b'$')
+        consumed = len(pending) if start == -1 else start
+        while start != -1:
+            end = pending.find(b'\n', start, start + MAX_SENTENCE_LENGTH)
+            if end == -1:
+                if len(pending) - start < MAX_SENTENCE_LENGTH:
+                    # wait for the rest of the sentence
+                    break
+                # too long to be a sentence (its line ending got lost or it's noise), so it's dropped
+                # up to the next $ instead of piling up in pending forever
+                self.malformed += 1
+                start = pending.find(b'$', start + 1)
+                consumed = len(pending) if start == -1 else start
+                continue
+            consumed = end + 1
+            star = pending.rfind(b'*', start, end)
+            self.sentences += 1
+            try:
+                valid = star != -1 and xor_checksum(view[start + 1:star]) == int(pending[star + 1:star + 3], 16)
+            except ValueError:
+                valid = False
+            if not valid:
+                self.bad_checksums += 1
+            else:
+                # the talker (GP, GN, ...) is ignored, only the sentence type matters
+                decoder = self.decoders.get(bytes(view[start + 3:start + 6]))
+                if decoder is None:
+                    self.unknown += 1
+                else:
+                    try:
+                        message = decoder(bytes(view[start + 1:star]).split(b','))
+                    except ValueError:
+                        message = None
+                        self.malformed += 1
+                    if message is not None:
+                        decoded.append(message)
+            start = pending.find(b'$', consumed)
+        # the view has to go before the buffer can be resized
+        view.release()
+        del pending[:consumed]
+        return decoded
+
+    # $GNGGA,time,lat,N,lon,W,quality,satellites,hdop,altitude,M,separation,M,age,station
+    def decode_gga(self, fields):
+        if len(fields) < 10 or not fields[2]:
+            return None
+        return {
+            'type': 'GGA',
+            'time': fields[1].decode(),
+            'latitude': parse_coordinate(fields[2], fields[3], 2),
+            'longitude': parse_coordinate(fields[4], fields[5], 3),
+            'quality': int(fields[6] or 0),
+            'satellites': int(fields[7] or 0),
+            'hdop': parse_float(fields[8]),
+            'height': parse_float(fields[9]),
+        }
+
+    # $GNRMC,time,status,lat,N,lon,W,speed (knots),course,date,magnetic variation,E,mode
+    def decode_rmc(self, fields):
+        if len(fields) < 9 or fields[2] != b'A' or not fields[3]:
+            return None
+        speed = parse_float(fields[7])
+        return {
+            'type': 'RMC',
+            'time': fields[1].decode(),
+            'latitude': parse_coordinate(fields[3], fields[4], 2),
+            'longitude': parse_coordinate(fields[5], fields[6], 3),
+            'speed': None if speed is None else speed * KNOTS_TO_MPS,
+            'course': parse_float(fields[8]),
+        }
+
+    # $GNVTG,course (true),T,course (magnetic),M,speed (knots),N,speed (km/h),K,mode
+    def decode_vtg(self, fields):
+        if len(fields) < 8:
+            return None
+        speed = parse_float(fields[7])
+        return {
+            'type': 'VTG',
+            'course': parse_float(fields[1]),
+            'speed': None if speed is None else speed * KPH_TO_MPS,
+        }
+
+    # $GNGLL,3511.93307,N,09721.15557,W,011244.00,A,D
+    def decode_gll(self, fields):
+        if len(fields) < 7 or fields[6] != b'A' or not fields[1]:
+            return None
+        return {
+            'type': 'GLL',
+            'time': fields[5].decode(),
+            'latitude': parse_coordinate(fields[1], fields[2], 2),
+            'longitude': parse_coordinate(fields[3], fields[4], 3),
+        }
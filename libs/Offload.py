@@ -0,0 +1,263 @@
+import json
+import socket
+import struct
+from threading import Thread, Condition, Lock
+from time import monotonic, sleep, perf_counter
+
+import cv2
+import numpy as np
+
+from libs import Metrics
+from libs import Layout
+
+# Sends camera frames to a detection server (usually the base station, see detectionServer.py) and
+# gets the tags it found back, so the rover doesn't have to spend its own CPU on aruco.
+# Frames go out still compressed the way the camera sent them, each with its camera index, sequence
+# number and the time it was read. Results come back with the same three so the rover knows exactly
+# which frame they're for and how long the whole round trip took.
+#
+# Every message is a 4 byte length, then a 1 byte type, then the body:
+#   FRAME  camera (1 byte), seq (4 bytes), timestamp (8 byte double), how many tag ids (1 byte, 0 for
+#          every tag), the ids (2 bytes each), then the JPEG
+#   RESULT JSON: {"camera", "seq", "timestamp", "server_ms", "detections": [{"id", "corners", ...}]}
+
+FRAME = 1
+RESULT = 2
+FRAME_HEADER = struct.Struct('!BIdB')
+TAG_ID = struct.Struct('!H')
+LENGTH = struct.Struct('!IB')
+
+def send_message(sock, kind:int, body:bytes):
+    sock.sendall(LENGTH.pack(len(body), kind) + body)
+
+# Returns (type, body), raises ConnectionError when the other side goes away
+def receive_message(sock):
+    length, kind = LENGTH.unpack(_receive_exactly(sock, LENGTH.size))
+    return kind, _receive_exactly(sock, length)
+
+def _receive_exactly(sock, size:int):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('connection closed')
+        data += chunk
+    return bytes(data)
+
+# True if the frame is still the camera's compressed MJPG, which is what a capture
+# gives back with CAP_PROP_CONVERT_RGB turned off
+def is_encoded(frame):
+    return frame.ndim == 1 or frame.shape[0] == 1
+
+def decode(frame):
+    return cv2.imdecode(frame.reshape(-1), cv2.IMREAD_COLOR) if is_encoded(frame) else frame
+
+# JPEG bytes for a frame. Compressed frames go as they are, anything else (like a video file
+# that ignores CAP_PROP_CONVERT_RGB) gets encoded here
+def encode(frame, quality:int = 90):
+    if is_encoded(frame):
+        return frame.tobytes()
+    return cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+# Rover side of the link. A background thread keeps it connected and collects results
+class OffloadClient:
+    def __init__(self, host:str, port:int, reconnect:float = 1.0, send_timeout:float = .05):
+        self.host = host
+        self.port = port
+        self.reconnect = reconnect
+        # a frame that can't go out this fast is dropped rather than holding up detection
+        self.send_timeout = send_timeout
+        self.sock = None
+        self.send_lock = Lock()
+        self.condition = Condition()
+        # camera: (seq, timestamp, [detection dicts])
+        self.results = {}
+        self.running = False
+
+        self.connected = Metrics.gauge('rover_offload_connected', 'Whether the detection server is connected')
+        self.round_trip = Metrics.latency('rover_offload_round_trip', 'Time from a frame being read to its detections coming back')
+        self.server_time = Metrics.latency('rover_offload_server', 'Time the detection server spent on a frame')
+        self.sent = Metrics.counter('rover_offload_frames_total', 'Frames sent to the detection server')
+        self.sent_bytes = Metrics.counter('rover_offload_bytes_total', 'Bytes of frames sent to the detection server')
+        self.dropped = Metrics.counter('rover_offload_dropped_total', "Frames that couldn't be sent to the detection server")
+
+    def start(self):
+        self.running = True
+        t = Thread(target=self.receive_loop, name='offload link', args=())
+        t.daemon = True
+        t.start()
+        Metrics.watch_thread(t.name)
+
+    def stop(self):
+        self.running = False
+        self._disconnect()
+
+    def receive_loop(self):
+        Layout.enter('io')
+        while self.running:
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=self.reconnect)
+            except OSError:
+                sleep(self.reconnect)
+                continue
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(None)
+            # only sends time out, the receiving side keeps blocking on recv
+            seconds = int(self.send_timeout)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO,
+                struct.pack('ll', seconds, int((self.send_timeout - seconds) * 1e6)))
+            self.sock = sock
+            self.connected.set(1)
+            print(f"Connected to the detection server at {self.host}:{self.port}")
+            try:
+                while self.running:
+                    kind, body = receive_message(sock)
+                    if kind == RESULT:
+                        self._on_result(json.loads(body))
+            except (OSError, ConnectionError, ValueError) as e:
+                if self.running:
+                    print("Lost the detection server:", e)
+            self._disconnect()
+
+    def _on_result(self, result):
+        now = monotonic()
+        self.round_trip.observe(now - result['timestamp'])
+        self.server_time.observe(result['server_ms'] / 1000)
+        with self.condition:
+            self.results[result['camera']] = (result['seq'], result['timestamp'], result['detections'])
+            self.condition.notify_all()
+
+    def _disconnect(self):
+        sock, self.sock = self.sock, None
+        self.connected.set(0)
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        with self.condition:
+            self.condition.notify_all()
+
+    @property
+    def is_connected(self):
+        return self.sock is not None
+
+    # Sends one frame, returns False if it couldn't go out. ids are the tags the server should look
+    # for, None for all of them
+    def submit(self, camera:int, seq:int, timestamp:float, frame, ids = None):
+        sock = self.sock
+        if sock is None:
+            return False
+        ids = sorted(ids) if ids is not None else []
+        body = (FRAME_HEADER.pack(camera, seq, timestamp, len(ids)) + b''.join(TAG_ID.pack(i) for i in ids)
+            + encode(frame))
+        with self.send_lock:
+            try:
+                send_message(sock, FRAME, body)
+            except OSError:
+                # a send that timed out part way leaves the stream broken, so start over
+                self.dropped.inc()
+                self._disconnect()
+                return False
+        self.sent.inc()
+        self.sent_bytes.inc(len(body))
+        return True
+
+    # Waits up to timeout seconds for the detections for camera's frame seq.
+    # Returns the list of detection dicts, or None if they didn't make it in time
+    def wait_result(self, camera:int, seq:int, timeout:float):
+        with self.condition:
+            self.condition.wait_for(lambda: self.results.get(camera, (0,))[0] >= seq or self.sock is None, timeout)
+            result = self.results.get(camera)
+        if result is None or result[0] != seq:
+            return None
+        return result[2]
+
+# Base station side. Every connection gets a reader that keeps only the newest frame per camera
+# and a worker that runs detection on it, so a slow frame makes the server skip ahead instead of
+# falling behind. tracker is an ARTracker made without cameras
+class DetectionServer:
+    def __init__(self, tracker, host:str = '0.0.0.0', port:int = 9200):
+        self.tracker = tracker
+        # markersFound keeps state on the tracker so only one frame gets looked at at a time
+        self.tracker_lock = Lock()
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen()
+        self.port = self.server.getsockname()[1]
+        self.frames = Metrics.counter('offload_server_frames_total', 'Frames the detection server looked at')
+        self.skipped = Metrics.counter('offload_server_skipped_total', 'Frames replaced by a newer one before they got looked at')
+
+    def serve_forever(self):
+        while True:
+            conn, address = self.server.accept()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            print("Rover connected from", address)
+            Connection(self, conn).start()
+
+    # ids is the set of tags to look for, None for all of them
+    def detect(self, frame, ids = None):
+        image = decode(frame)
+        if image is None:
+            return []
+        with self.tracker_lock:
+            found = self.tracker.markersFound(image, ids)
+        return [{'id': d.id, 'corners': np.asarray(d.corners).tolist(), 'angle': d.angle, 'distance': d.distance,
+                 'centerX': float(d.centerX), 'centerY': float(d.centerY), 'width': float(d.width)} for d in found.values()]
+
+# One rover connected to the DetectionServer
+class Connection:
+    def __init__(self, server, conn):
+        self.server = server
+        self.conn = conn
+        self.condition = Condition()
+        # camera: (seq, timestamp, tag ids or None, jpeg bytes), only the newest
+        self.pending = {}
+        self.open = True
+
+    def start(self):
+        for target, name in ((self.read_loop, 'offload reader'), (self.work_loop, 'offload worker')):
+            t = Thread(target=target, name=name, args=())
+            t.daemon = True
+            t.start()
+
+    def read_loop(self):
+        try:
+            while True:
+                kind, body = receive_message(self.conn)
+                if kind != FRAME:
+                    continue
+                camera, seq, timestamp, count = FRAME_HEADER.unpack_from(body)
+                start = FRAME_HEADER.size + count * TAG_ID.size
+                ids = {TAG_ID.unpack_from(body, FRAME_HEADER.size + n * TAG_ID.size)[0] for n in range(count)} or None
+                with self.condition:
+                    if camera in self.pending:
+                        self.server.skipped.inc()
+                    self.pending[camera] = (seq, timestamp, ids, body[start:])
+                    self.condition.notify()
+        except (OSError, ConnectionError):
+            pass
+        print("Rover disconnected")
+        with self.condition:
+            self.open = False
+            self.condition.notify()
+
+    def work_loop(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or not self.open)
+                if not self.open:
+                    break
+                camera = next(iter(self.pending))
+                seq, timestamp, ids, jpeg = self.pending.pop(camera)
+            start = perf_counter()
+            detections = self.server.detect(np.frombuffer(jpeg, np.uint8), ids)
+            self.server.frames.inc()
+            result = {'camera': camera, 'seq': seq, 'timestamp': timestamp,
+                      'server_ms': (perf_counter() - start) * 1000, 'detections': detections}
+            try:
+                send_message(self.conn, RESULT, json.dumps(result).encode())
+            except OSError:
+                break
+        self.conn.close()
@@ -0,0 +1,122 @@
+import numpy as np
+
+# Reorders waypoints to cut down on the total distance driven.
+# Everything works on (east, north) points in meters from the mission's local frame.
+
+# Up to this many free waypoints get solved exactly, past that it's a heuristic
+EXACT_LIMIT = 9
+
+# Pairwise distances between all points, done in one shot with numpy
+def distance_matrix(points):
+    p = np.asarray(points, dtype=float)
+    diff = p[:, None, :] - p[None, :, :]
+    return np.hypot(diff[..., 0], diff[..., 1])
+
+# Length of a path through the given node indices
+def path_length(dist, path):
+    path = np.asarray(path)
+    return float(dist[path[:-1], path[1:]].sum())
+
+# Exact shortest path from head through every free node and ending at tail (Held-Karp)
+def _exact(dist, head, free, tail):
+    d = dist.tolist()
+    n = len(free)
+    full = (1 << n) - 1
+    # best[mask][j] is the shortest path from head through the nodes in mask ending at free[j]
+    best = [[float('inf')] * n for _ in range(1 << n)]
+    parent = [[-1] * n for _ in range(1 << n)]
+    for j in range(n):
+        best[1 << j][j] = d[head][free[j]]
+    for mask in range(1, 1 << n):
+        row = best[mask]
+        for j in range(n):
+            cost = row[j]
+            if cost == float('inf') or not mask & (1 << j):
+                continue
+            fj = d[free[j]]
+            for k in range(n):
+                if mask & (1 << k):
+                    continue
+                nxt = mask | (1 << k)
+                c = cost + fj[free[k]]
+                if c < best[nxt][k]:
+                    best[nxt][k] = c
+                    parent[nxt][k] = j
+    last = min(range(n), key=lambda j: best[full][j] + d[free[j]][tail])
+    order = []
+    mask = full
+    while last != -1:
+        order.append(free[last])
+        mask, last = mask ^ (1 << last), parent[mask][last]
+    return order[::-1]
+
+# Nearest neighbor to get a route going, then 2-opt until no reversal makes it shorter
+def _heuristic(dist, head, free, tail):
+    remaining = list(free)
+    order = []
+    current = head
+    while remaining:
+        nearest = min(remaining, key=lambda k: dist[current, k])
+        remaining.remove(nearest)
+        order.append(nearest)
+        current = nearest
+
+    route = np.array([head] + order + [tail])
+    improved = True
+    while improved:
+        improved = False
+        # reversing route[i..j] swaps edges (a, b) and (c, d) for (a, c) and (b, d),
+        # the gain for every j is computed at once for each i
+        for i in range(1, len(route) - 2):
+            a = route[i - 1]
+            b = route[i]
+            c = route[i + 1:-1]
+            d = route[i + 2:]
+            gain = dist[a, b] + dist[c, d] - dist[a, c] - dist[b, d]
+            j = int(np.argmax(gain))
+            if gain[j] > 1e-9:
+                j += i + 1
+                route[i:j + 1] = route[i:j + 1][::-1].copy()
+                improved = True
+    return route[1:-1].tolist()
+
+# Returns the order (indices into waypoints) to drive them in, starting from the rover's position.
+# pin_first and pin_last keep the first and last waypoints where they are in the list.
+def plan_route(start, waypoints, pin_first:bool = False, pin_last:bool = False):
+    count = len(waypoints)
+    if count < 2 or (count == 2 and (pin_first or pin_last)):
+        return list(range(count))
+
+    # node 0 is the rover, waypoint i is node i + 1, and the extra last node is a stand in
+    # for "anywhere" that's free to reach so the route doesn't have to end at a certain spot
+    points = [start] + list(waypoints) + [(0.0, 0.0)]
+    dist = distance_matrix(points)
+    anywhere = count + 1
+    dist[:, anywhere] = 0
+    dist[anywhere, :] = 0
+
+    head = 1 if pin_first else 0
+    tail = count if pin_last else anywhere
+    free = [k for k in range(1, count + 1) if k != head and k != tail]
+
+    if len(free) <= EXACT_LIMIT:
+        order = _exact(dist, head, free, tail)
+    else:
+        order = _heuristic(dist, head, free, tail)
+
+    if pin_first:
+        order = [head] + order
+    if pin_last:
+        order = order + [tail]
+    return [k - 1 for k in order]
+
+# Reorders a list of [lat, lon] locations for the shortest drive and prints how much it saved.
+# projected holds the locations' (east, north) points and start is the rover's (east, north).
+def optimize(locations, projected, start, pin_first:bool = False, pin_last:bool = False):
+    order = plan_route(start, projected, pin_first, pin_last)
+    dist = distance_matrix([start] + list(projected))
+    before = path_length(dist, [0] + list(range(1, len(projected) + 1)))
+    after = path_length(dist, [0] + [k + 1 for k in order])
+    print(f"Route: {before:.1f}m in file order, {after:.1f}m reordered, saves {before - after:.1f}m")
+    print("Waypoint order:", [k + 1 for k in order])
+    return [locations[k] for k in order]
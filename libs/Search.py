@@ -0,0 +1,65 @@
+from math import sin, radians, ceil
+
+# Search patterns for when the rover gets to a waypoint without seeing its marker.
+# Patterns are built as (east, north) offsets in meters around the target and then
+# turned into [lat, lon] locations that driveAlongCoordinates can drive like any others.
+
+# Width in meters of the strip the cameras can reliably see a tag in while driving.
+# hfov is one camera's horizontal field of view in degrees (DEGREES_PER_PIXEL * FRAME_WIDTH)
+# and detection_range is how far out in meters tags are reliably detected
+def swath_width(hfov:float, detection_range:float):
+    # anything past 180 degrees doesn't widen the strip, it only looks backwards
+    return 2 * detection_range * sin(radians(min(hfov, 180.0)) / 2)
+
+# Spacing between neighboring legs so the strips overlap by the given fraction
+# Raises ValueError if the settings leave no spacing, the patterns would never cover anything
+def leg_spacing(hfov:float, detection_range:float, overlap:float = .2):
+    spacing = swath_width(hfov, detection_range) * (1 - overlap)
+    if spacing <= 0:
+        raise ValueError(f"Search leg spacing has to be more than 0 but came out {spacing:.2f}m, "
+            f"check DETECTION_RANGE ({detection_range}) is more than 0 and OVERLAP ({overlap}) is under 1")
+    return spacing
+
+# Square spiral going out from the target. Legs go east, north, west, south, ...
+# and every other leg is one spacing longer than the last
+def spiral(spacing:float, max_radius:float):
+    points = []
+    east = north = 0.0
+    # east, north, west, south
+    directions = ((1, 0), (0, 1), (-1, 0), (0, -1))
+    leg = 1
+    turn = 0
+    while True:
+        for _ in range(2):
+            de, dn = directions[turn % 4]
+            east += de * leg * spacing
+            north += dn * leg * spacing
+            if abs(east) > max_radius or abs(north) > max_radius:
+                return points
+            points.append((east, north))
+            turn += 1
+        leg += 1
+
+# Back and forth passes covering the square around the target, going row by row south to north
+def lawnmower(spacing:float, max_radius:float):
+    rows = max(1, ceil(2 * max_radius / spacing))
+    # centers the rows on the target
+    first = -spacing * (rows - 1) / 2
+    points = []
+    for row in range(rows):
+        north = first + row * spacing
+        edges = (-max_radius, max_radius) if row % 2 == 0 else (max_radius, -max_radius)
+        points.append((edges[0], north))
+        points.append((edges[1], north))
+    return points
+
+# Builds the [lat, lon] search locations around a target using the mission's local frame
+def search_locations(frame, lat:float, lon:float, pattern:str, spacing:float, max_radius:float):
+    if spacing <= 0:
+        raise ValueError(f"Search spacing has to be more than 0, got {spacing}")
+    target_east, target_north = frame.project(lat, lon)
+    if pattern == "lawnmower":
+        offsets = lawnmower(spacing, max_radius)
+    else:
+        offsets = spiral(spacing, max_radius)
+    return [list(frame.to_geodetic(target_east + e, target_north + n)) for e, n in offsets]
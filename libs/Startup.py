@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, current_thread
+from time import monotonic
+
+# Records how long each part of bringing the rover up takes so slow startups can be tracked down
+class Timeline:
+    def __init__(self):
+        self.start = monotonic()
+        self.lock = Lock()
+        # (name, thread, start, end) with times relative to self.start
+        self.phases = []
+
+    # Runs func() as a named phase and records when it started and finished
+    def run(self, name:str, func, *args):
+        begin = monotonic()
+        try:
+            return func(*args)
+        finally:
+            end = monotonic()
+            with self.lock:
+                self.phases.append((name, current_thread().name, begin - self.start, end - self.start))
+
+    # Runs every {name: func} phase at the same time and waits for all of them.
+    # Returns {name: result}, if any of them raised the first error gets raised here
+    def run_parallel(self, phases:dict):
+        with ThreadPoolExecutor(max_workers=len(phases), thread_name_prefix='startup') as pool:
+            futures = {name: pool.submit(self.run, name, func) for name, func in phases.items()}
+            return {name: future.result() for name, future in futures.items()}
+
+    # Seconds since the timeline started
+    def elapsed(self):
+        return monotonic() - self.start
+
+    # Prints when each phase ran, phases that overlap ran at the same time
+    def report(self, width:int = 40):
+        total = max(self.elapsed(), 1e-9)
+        print(f"Startup timeline ({total:.2f}s total):")
+        with self.lock:
+            phases = sorted(self.phases, key=lambda phase: phase[2])
+        for name, thread, begin, end in phases:
+            first = int(begin / total * width)
+            last = max(first + 1, int(end / total * width))
+            bar = ' ' * first + '#' * (last - first) + ' ' * (width - last)
+            print(f"  {name:<14} |{bar}| {begin:6.2f}s -> {end:6.2f}s ({end - begin:5.2f}s) [{thread}]")
@@ -0,0 +1,172 @@
+from math import cos, radians, hypot
+from threading import Thread, Event, Lock
+from time import monotonic
+
+from libs import Layout
+
+# Meters per degree, close enough for deciding whether the rover moved
+METERS_PER_DEGREE_LAT = 110540.0
+METERS_PER_DEGREE_LON = 111320.0
+
+# Drops points from a path that are within tolerance (meters) of the line through
+# their neighbors (Douglas-Peucker). Points are (x, y, payload), x/y are in meters.
+def simplify(points, tolerance:float):
+    if len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    # done with a stack instead of recursion so long trails can't blow the stack
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        x1, y1 = points[first][0], points[first][1]
+        x2, y2 = points[last][0], points[last][1]
+        dx = x2 - x1
+        dy = y2 - y1
+        length = hypot(dx, dy)
+        worst = -1.0
+        index = -1
+        for i in range(first + 1, last):
+            px, py = points[i][0], points[i][1]
+            if length == 0:
+                distance = hypot(px - x1, py - y1)
+            else:
+                distance = abs(dy * (px - x1) - dx * (py - y1)) / length
+            if distance > worst:
+                worst = distance
+                index = i
+        if worst > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [p for p, k in zip(points, keep) if k]
+
+# Sends the rover's position, trail, detections and mission state to the map,
+# but only when something actually changed.
+# Fixes only get compared against thresholds on the calling thread, all of the
+# sending happens on the publisher's own thread so a slow radio can't hold anything up.
+class TelemetryPublisher:
+    # send is called with a dict holding the coords, heading, trail, detections and state
+    # min_distance (m) and min_heading (degrees) are how far the rover has to move or turn to be worth a point
+    # max_interval (s) is how long to go without sending before sending anyway so the map knows we're alive
+    # batch_size is how many trail points get held before they're sent
+    # tolerance (m) is how far off the line a trail point can be before the simplifier has to keep it
+    def __init__(self, send, min_distance:float = .5, min_heading:float = 5, max_interval:float = 5,
+                 batch_size:int = 10, tolerance:float = .25):
+        self.send = send
+        self.min_distance = min_distance
+        self.min_heading = min_heading
+        self.max_interval = max_interval
+        self.batch_size = batch_size
+        self.tolerance = tolerance
+
+        self.lock = Lock()
+        self.wake = Event()
+        self.origin = None
+        # trail points as (x, y, [lat, lon]) since the last send
+        self.trail = []
+        self.last_point = None
+        self.heading = 0.0
+        self.last_heading = None
+        self.detections = []
+        self.state = None
+        self.state_changed = False
+        self.sent = 0
+        self.errors = 0
+
+        self.running = True
+        self.thread = Thread(target=self.publish_loop, name='telemetry publisher', args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Fix callback for Location/LocationF9P
+    def on_fix(self, fix):
+        self.update(fix.latitude, fix.longitude, fix.bearing)
+
+    # Records a new position, only keeps it if the rover moved or turned enough
+    def update(self, lat:float, lon:float, heading:float):
+        if lat == 0 and lon == 0:
+            return
+        if self.origin is None:
+            self.origin = (lat, lon, cos(radians(lat)))
+        x = (lon - self.origin[1]) * self.origin[2] * METERS_PER_DEGREE_LON
+        y = (lat - self.origin[0]) * METERS_PER_DEGREE_LAT
+        with self.lock:
+            moved = self.last_point is None or hypot(x - self.last_point[0], y - self.last_point[1]) >= self.min_distance
+            turn = abs(heading - self.last_heading) if self.last_heading is not None else 360
+            turned = min(turn, 360 - turn) >= self.min_heading
+            if not moved and not turned:
+                return
+            self.last_point = (x, y)
+            self.last_heading = heading
+            self.heading = heading
+            self.trail.append((x, y, [lat, lon]))
+            full = len(self.trail) >= self.batch_size
+        # turning is worth telling the map about right away, moving can wait for a full batch
+        if full or turned:
+            self.wake.set()
+
+    # Adds a detection (any dict, like {'id': 1, 'distance': 350, 'angle': 2}) to the next send
+    def add_detection(self, detection:dict):
+        with self.lock:
+            self.detections.append(detection)
+        self.wake.set()
+
+    # Sets the mission state shown on the map, like "driving to waypoint 2"
+    def set_state(self, state:str):
+        with self.lock:
+            if state == self.state:
+                return
+            self.state = state
+            self.state_changed = True
+        self.wake.set()
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+
+    def publish_loop(self):
+        Layout.enter('io')
+        last_send = monotonic()
+        while self.running:
+            self.wake.wait(self.max_interval)
+            self.wake.clear()
+            with self.lock:
+                last_point = self.last_point
+                if last_point is None:
+                    # nothing to put on the map yet, detections and state wait for the first fix
+                    continue
+                trail = self.trail
+                detections = self.detections
+                state_changed = self.state_changed
+                self.trail = []
+                self.detections = []
+                self.state_changed = False
+                heading = self.heading
+                state = self.state
+            stale = monotonic() - last_send >= self.max_interval
+            if not trail and not detections and not state_changed and not stale:
+                continue
+
+            points = [p[2] for p in simplify(trail, self.tolerance)]
+            payload = {
+                'coords': points[-1] if points else self.to_coords(last_point),
+                'heading': heading,
+                'trail': points,
+                'detections': detections,
+                'state': state,
+            }
+            try:
+                self.send(payload)
+                self.sent += 1
+            except Exception as e:
+                # the map going down shouldn't take the rover with it
+                self.errors += 1
+                print("Telemetry send failed:", e)
+            last_send = monotonic()
+
+    # Converts a recorded (x, y) point back to [lat, lon]
+    def to_coords(self, point):
+        x, y = point
+        return [self.origin[0] + y / METERS_PER_DEGREE_LAT,
+                self.origin[1] + x / (self.origin[2] * METERS_PER_DEGREE_LON)]
@@ -0,0 +1,153 @@
+# UBX binary protocol support for the u-blox F9P.
+# Only NAV-PVT is decoded, it has position, velocity, heading and accuracy in one message.
+# Message layouts are in the F9P interface description (section 3.15.13 for NAV-PVT)
+# https://content.u-blox.com/sites/default/files/documents/u-blox-F9-HPG-1.32_InterfaceDescription_UBX-22008968.pdf
+from itertools import accumulate
+import struct
+
+SYNC = b'\xb5\x62'
+# sync chars, class, id and the 2 byte length
+HEADER_LENGTH = 6
+CHECKSUM_LENGTH = 2
+
+NAV_PVT = (0x01, 0x07)
+NAV_PVT_LENGTH = 92
+CFG_VALSET = (0x06, 0x8a)
+ACK_ACK = (0x05, 0x01)
+ACK_NAK = (0x05, 0x00)
+
+# configuration keys (interface description section 6.9)
+CFG_RATE_MEAS = (0x30210001, '<H')              # ms between measurements
+CFG_MSGOUT_UBX_NAV_PVT_USB = (0x20910009, '<B') # NAV-PVT every n solutions on USB
+CFG_MSGOUT_UBX_NAV_PVT_UART1 = (0x20910007, '<B')
+CFG_USBOUTPROT_UBX = (0x10780001, '<B')         # allow UBX out of USB at all
+
+# The part of NAV-PVT we use, from iTOW through pDOP. The date and time fields
+# (bytes 4 to 19) are skipped over since iTOW is all we need to order fixes.
+NAV_PVT_STRUCT = struct.Struct('<I16xBBBBiiiiIIiiiiiIIH')
+
+# anything claiming to be longer than this is a false sync
+MAX_PAYLOAD_LENGTH = 4096
+
+# flags bit 0, the receiver has a valid fix
+GNSS_FIX_OK = 0x01
+
+# 8 bit Fletcher checksum over class, id, length and payload.
+# CK_A is the plain sum and CK_B is the sum of the running sums, both done in C instead of a loop.
+def fletcher_checksum(data):
+    return sum(data) & 0xff, sum(accumulate(data)) & 0xff
+
+# Builds a complete UBX frame around a payload
+def frame(message_class:int, message_id:int, payload:bytes = b''):
+    body = struct.pack('<BBH', message_class, message_id, len(payload)) + payload
+    ck_a, ck_b = fletcher_checksum(body)
+    return SYNC + body + bytes((ck_a, ck_b))
+
+# Builds a CFG-VALSET that applies the given {key: value} settings to the RAM layer
+def valset(settings:dict, layers:int = 0x01):
+    payload = bytearray(struct.pack('<BBH', 0, layers, 0))
+    for (key, fmt), value in settings.items():
+        payload += struct.pack('<I', key) + struct.pack(fmt, value)
+    return frame(*CFG_VALSET, bytes(payload))
+
+# The one time setup to get NAV-PVT out of the USB port at the given rate (Hz)
+def nav_pvt_config(rate:float = 10):
+    return valset({
+        CFG_RATE_MEAS: int(round(1000 / rate)),
+        CFG_USBOUTPROT_UBX: 1,
+        CFG_MSGOUT_UBX_NAV_PVT_USB: 1,
+    })
+
+class UBXParser:
+    def __init__(self, buffer_size=4096):
+        # reusable read buffer so reading never allocates
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        # bytes that haven't been framed into a full message yet
+        self.pending = bytearray()
+        self.messages = 0
+        self.bad_checksums = 0
+        self.unknown = 0
+        self.acks = 0
+        self.naks = 0
+
+    # Reads whatever is waiting on the device (a file opened in binary mode) and parses it
+    def read_from(self, device):
+        count = device.readinto(self.buffer)
+        if not count:
+            return []
+        return self.feed(self.view[:count])
+
+    # Parses a chunk of raw bytes and returns a list of decoded NAV-PVT messages as dicts.
+    # Anything that isn't UBX (like NMEA mixed in on the same port) is skipped over.
+    def feed(self, data):
+        pending = self.pending
+        pending += data
+        view = memoryview(pending)
+        decoded = []
+        start = pending.find(SYNC)
+        consumed = 0
+        while start != -1 and start + HEADER_LENGTH <= len(pending):
+            message_class = pending[start + 2]
+            message_id = pending[start + 3]
+            length = pending[start + 4] | (pending[start + 5] << 8)
+            end = start + HEADER_LENGTH + length + CHECKSUM_LENGTH
+            if length > MAX_PAYLOAD_LENGTH:
+                self.bad_checksums += 1
+                consumed = start + 1
+                start = pending.find(SYNC, consumed)
+                continue
+            if end > len(pending):
+                # wait for the rest of the message
+                break
+            ck_a, ck_b = fletcher_checksum(view[start + 2:end - CHECKSUM_LENGTH])
+            if ck_a != pending[end - 2] or ck_b != pending[end - 1]:
+                # the sync chars could've shown up by chance, resync one byte later
+                self.bad_checksums += 1
+                consumed = start + 1
+            else:
+                self.messages += 1
+                consumed = end
+                kind = (message_class, message_id)
+                if kind == NAV_PVT and length == NAV_PVT_LENGTH:
+                    decoded.append(self.decode_nav_pvt(view[start + HEADER_LENGTH:end - CHECKSUM_LENGTH]))
+                elif kind == ACK_ACK:
+                    self.acks += 1
+                elif kind == ACK_NAK:
+                    self.naks += 1
+                else:
+                    self.unknown += 1
+            start = pending.find(SYNC, consumed)
+        if start != -1:
+            # the start of a message that's still coming in
+            consumed = start
+        elif pending.endswith(SYNC[:1]) and len(pending) - 1 >= consumed:
+            # keep a trailing 0xb5 in case it's the first half of the next sync
+            consumed = len(pending) - 1
+        else:
+            consumed = len(pending)
+        # the view has to go before the buffer can be resized
+        view.release()
+        del pending[:consumed]
+        return decoded
+
+    # Unpacks a NAV-PVT payload straight out of the buffer and converts it to the units Fix uses
+    def decode_nav_pvt(self, payload):
+        (itow, fix_type, flags, _, satellites, lon, lat, _, height_msl, h_acc, _,
+            vel_n, vel_e, _, ground_speed, heading, _, heading_acc, _) = NAV_PVT_STRUCT.unpack_from(payload)
+        return {
+            'type': 'NAV-PVT',
+            'time': itow,
+            'valid': bool(flags & GNSS_FIX_OK) and fix_type >= 2,
+            'quality': fix_type,
+            'satellites': satellites,
+            'latitude': lat * 1e-7,
+            'longitude': lon * 1e-7,
+            'height': height_msl / 1000.0,
+            'error': h_acc / 1000.0,
+            'speed': ground_speed / 1000.0,
+            'course': heading * 1e-5,
+            'course_error': heading_acc * 1e-5,
+            'velocity_north': vel_n / 1000.0,
+            'velocity_east': vel_e / 1000.0,
+        }
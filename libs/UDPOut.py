@@ -1,13 +1,43 @@
 import socket
+from threading import Lock
 
-from numpy import byte
+from libs import Metrics
+
+#counters for each kind of message, keyed by the message type byte
+sent = {
+    0x00: Metrics.counter('rover_udp_sent_total', 'UDP messages sent to the mbeds', kind='wheels'),
+    0x02: Metrics.counter('rover_udp_sent_total', 'UDP messages sent to the mbeds', kind='led'),
+}
+errors = {
+    0x00: Metrics.counter('rover_udp_errors_total', 'UDP messages that failed to send', kind='wheels'),
+    0x02: Metrics.counter('rover_udp_errors_total', 'UDP messages that failed to send', kind='led'),
+}
+#LEDs get sent from both the main thread and the flasher thread but Metrics counters only expect one
+#thread to update them, so kinds sent from more than one thread get counted under a lock
+locks = {0x02: Lock()}
+
+def count(counters, kind):
+    counter = counters.get(kind)
+    if counter is None:
+        return
+    lock = locks.get(kind)
+    if lock is None:
+        counter.inc()
+    else:
+        with lock:
+            counter.inc()
 
 def sendUDP(HOST,PORT,message): 
     #sends a message over UDP to a specific host and port
     BUFFERSIZE = 1024
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-        s.connect((HOST, PORT))
-        s.sendall(message)
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect((HOST, PORT))
+            s.sendall(message)
+    except OSError:
+        count(errors, message[1])
+        raise
+    count(sent, message[1])
 
 def sendWheelSpeeds(HOST, PORT, fl,ml,rl,fr,mr,rr):
     #sends a udp message containing the six different wheel speeds. 
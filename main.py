@@ -1,10 +1,17 @@
 import os
 import argparse
 import configparser
-from libs import UDPOut
-from libs import Drive
 import threading
+import signal
 from time import sleep
+from libs import Startup
+from libs import UDPOut
+from libs import Drive
+from libs import Layout
+
+# started right after the imports, the heavy ones (cv2, the gps library, flask) happen inside Drive's startup
+# so the startup report still covers them
+timeline = Startup.Timeline()
 
 path = os.path.dirname(os.path.abspath(__file__))
 
@@ -15,6 +22,7 @@ flashing = False
 
 
 def flash():
+    Layout.enter("io")
     while flashing:
         UDPOut.sendLED(mbedIP, mbedPort, "g")
         sleep(0.2)
@@ -24,7 +32,9 @@ def flash():
 
 argParser = argparse.ArgumentParser()
 argParser.add_argument(
-    "cameraInput", type=int, help="takes a number representing which camera to use"
+    "cameraInput",
+    nargs="+",
+    help="the cameras to use, main camera first then the others in the order of ORDER in [CAMERAS]",
 )
 argParser.add_argument(
     "-id",
@@ -39,6 +49,22 @@ argParser.add_argument(
     type=str,
     help="takes a filename for a text file, then reads that file for latlong coordinates",
 )
+argParser.add_argument(
+    "-o",
+    "--optimize",
+    action="store_true",
+    help="reorders the latLong coordinates for the shortest drive from where the rover starts",
+)
+argParser.add_argument(
+    "--pinFirst",
+    action="store_true",
+    help="with --optimize, keeps the first coordinate in the file as the first one driven to",
+)
+argParser.add_argument(
+    "--pinLast",
+    action="store_true",
+    help="with --optimize, keeps the last coordinate in the file as the last one driven to",
+)
 args = argParser.parse_args()
 
 
@@ -86,16 +112,20 @@ def drive(rover):
 
     flashing = False
     UDPOut.sendLED(mbedIP, mbedPort, "r")
-    rover.driveAlongCoordinates(locations, id1, id2)
+    rover.driveAlongCoordinates(
+        locations, id1, id2, optimize=args.optimize, pinFirst=args.pinFirst, pinLast=args.pinLast
+    )
 
-    if id1 != -1:
+    if id1 != -1 and not rover.aborted:
         rover.trackARMarker(id1, id2)
 
     flashing = True
-    lights = threading.Thread(target=flash)
+    lights = threading.Thread(target=flash, name="LED flasher")
     lights.start()
     # UDPOut.sendLED(mbedIP, mbedPort, 'g')
 
+    rover.dumpMetrics()
+
     f = open("Recorded_Coordinates_" + args.latLong + ".txt", "a")
     f.write("Latitude: " + rover.gps.latitude + "\n  Longitude: " + rover.gps.longitude)
     f.close()
@@ -117,6 +147,10 @@ if __name__ == "__main__":
     mbedIP = str(config["CONFIG"]["MBED_IP"])
     mbedPort = int(config["CONFIG"]["MBED_PORT"])
 
-    rover = Drive.Drive(50, args.cameraInput)
+    # camera numbers become ints, anything else is a device file
+    cameras = [int(c) if c.isdigit() else c for c in args.cameraInput]
+    rover = Drive.Drive(50, cameras, timeline)
+    # kill sends SIGTERM, the rover stops at the next control loop tick instead of mid maneuver
+    signal.signal(signal.SIGTERM, lambda signum, frame: rover.abort())
 
     drive(rover)
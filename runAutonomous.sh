@@ -6,27 +6,26 @@ left=$(cat config.ini | grep LEFT_CAMERA)
 left=${left: -3}
 right=$(cat config.ini | grep RIGHT_CAMERA)
 right=${right: -3}
-main_file=$(v4l2-ctl --list-devices | grep -A1 "$main):" | tail -1)
-left_file=$(v4l2-ctl --list-devices | grep -A1 "$left):" | tail -1)
-right_file=$(v4l2-ctl --list-devices | grep -A1 "$right):" | tail -1)
+#lists the devices once instead of once per camera
+devices=$(v4l2-ctl --list-devices)
+main_file=$(echo "$devices" | grep -A1 "$main):" | tail -1)
+left_file=$(echo "$devices" | grep -A1 "$left):" | tail -1)
+right_file=$(echo "$devices" | grep -A1 "$right):" | tail -1)
 
 echo $main_file $left_file $right_file
 
 #changes to camera settings to be optimized for what we need
-v4l2-ctl -d $main_file --set-ctrl=focus_auto=0
-v4l2-ctl -d $main_file --set-ctrl=focus_absolute=0
-v4l2-ctl -d $main_file --set-ctrl=contrast=255
-v4l2-ctl -d $main_file --set-ctrl=sharpness=255
-
-v4l2-ctl -d $left_file --set-ctrl=focus_auto=0
-v4l2-ctl -d $left_file --set-ctrl=focus_absolute=0
-v4l2-ctl -d $left_file --set-ctrl=contrast=255
-v4l2-ctl -d $left_file --set-ctrl=sharpness=255
-
-v4l2-ctl -d $right_file --set-ctrl=focus_auto=0
-v4l2-ctl -d $right_file --set-ctrl=focus_absolute=0
-v4l2-ctl -d $right_file --set-ctrl=contrast=255
-v4l2-ctl -d $right_file --set-ctrl=sharpness=255
+#each camera gets set up in the background at the same time, focus_auto has to go before focus_absolute
+setup_camera() {
+    v4l2-ctl -d $1 --set-ctrl=focus_auto=0
+    v4l2-ctl -d $1 --set-ctrl=focus_absolute=0
+    v4l2-ctl -d $1 --set-ctrl=contrast=255
+    v4l2-ctl -d $1 --set-ctrl=sharpness=255
+}
+setup_camera $main_file &
+setup_camera $left_file &
+setup_camera $right_file &
+wait
 
 python3 main.py $main_file $left_file $right_file
 #gdb autonomous --args autonomous $main_file $left_file $right_file #switch to this to debug